@@ -2,7 +2,6 @@ import ast
 import inspect
 import types
 import ctypes
-from itertools import zip_longest
 from collections import OrderedDict
 from textwrap import dedent
 
@@ -16,18 +15,46 @@ from .common import (
     iter_fields,
     quick_parse,
     get_source,
-    unwrap
+    unwrap,
+    node_fields,
+)
+from .graph import graph_walk, ParentMap
+from .transform import (
+    NodeTransformer,
+    EagerTransformer,
+    transform,
+    coroutine,
+    FusedTransformer,
+    Pipeline,
 )
-from .graph import graph_walk
-from .transform import NodeTransformer, transform, coroutine
 from .function import (
     func_rewrite,
+    wait_rewrites,
     create_function,
+    create_functions,
     func_code,
-    ast_sigparams
+    ast_sigparams,
+    ast_signature,
+    call_bindings,
 )
 
 from .matcher import Matcher
+from .fingerprint import ast_fingerprint, shape_ids
+from .location import LocationIndex
+from .scope import symbol_table, invalidate_symbol_tables, SymbolTable
+from .optimize import (
+    fold_constants,
+    module_constants,
+    hoist_lookups,
+    eliminate_common_subexpressions,
+)
+from .inline import inline, func_inline, inline_calls
+from .specialize import specialize, specialize_code
+from .vectorize import vectorize_loops
+from .stream import iter_statements, stream_walk
+from .rewrite import RewriteEngine, RewriteRule
+
+_missing = object()
 
 
 def reload_locals(frame):
@@ -37,20 +64,34 @@ def reload_locals(frame):
     )
 
 
-def replace_node(parent, field_name, field_index, node):
+def replace_node(parent, field_name, field_index, node, parent_map=None):
+    if parent_map is not None:
+        old_children = parent_map.children(parent)
+
     if field_index is None:
         setattr(parent, field_name, node)
     else:
         getattr(parent, field_name)[field_index] = node
+    invalidate_symbol_tables()
+
+    if parent_map is not None:
+        parent_map.update_children(parent, old_children)
 
 
-def delete_node(parent, field_name, field_index, node):
+def delete_node(parent, field_name, field_index, node, parent_map=None):
+    if parent_map is not None:
+        old_children = parent_map.children(parent)
+
     if field_index is None:
         old_node = getattr(parent, field_name)
         delattr(parent, field_name)
     else:
         old_node = getattr(parent, field_name).pop(field_index)
     assert node is old_node, "Existing node is not node we're trying to delete"
+    invalidate_symbol_tables()
+
+    if parent_map is not None:
+        parent_map.update_children(parent, old_children)
 
 
 def is_load_name(node):
@@ -86,41 +127,42 @@ def ast_field_equal(node1, node2):
     Note: If the value of the field is an ast.AST and are of equal type,
     we don't check any deeper.
     """
-    # check fields
-    field_gen1 = field_iter(node1)
-    field_gen2 = field_iter(node2)
-
-    for field_item1, field_item2 in zip_longest(field_gen1, field_gen2):
-        # unequal length
-        if field_item1 is None or field_item2 is None:
-            return False
-
-        field_value1 = field_item1[0]
-        field_value2 = field_item2[0]
-
-        field_name1 = field_item1[1]
-        field_name2 = field_item2[1]
+    if node1 is node2:
+        return True
 
-        field_index1 = field_item1[2]
-        field_index2 = field_item2[2]
+    node_class = type(node1)
+    if node_class is not type(node2):
+        return False
 
-        if type(field_value1) != type(field_value2):
-            return False
+    for field_name in node_fields(node_class):
+        value1 = getattr(node1, field_name, _missing)
+        value2 = getattr(node2, field_name, _missing)
+        if value1 is value2:
+            continue
 
-        if field_name1 != field_name2:
+        value_type = type(value1)
+        if value_type is not type(value2):
             return False
 
-        if field_index1 != field_index2:
-            return False
+        if value_type is list:
+            if len(value1) != len(value2):
+                return False
+            for item1, item2 in zip(value1, value2):
+                if type(item1) is not type(item2):
+                    return False
+                if isinstance(item1, ast.AST):
+                    continue
+                if item1 != item2:
+                    return False
+            continue
 
         # note, we don't do equality check on AST nodes since ast.walk
         # will hit it.
-        if isinstance(field_value1, ast.AST):
+        if isinstance(value1, ast.AST):
             continue
 
-        # this should largely be strings and numerics, afaik
-        assert isinstance(field_value1, (str, int, float, type(None)))
-        if field_value1 != field_value2:
+        # scalars. str, int, float, complex, bytes, None, Ellipsis etc
+        if value1 != value2:
             return False
 
     return True
@@ -132,35 +174,79 @@ def ast_equal(code1, code2, check_line_col=False, ignore_var_names=False):
 
     By default does not check line number or col offset
     """
-    gen1 = ast.walk(code1)
-    gen2 = ast.walk(code2)
+    return _ast_equal(code1, code2, check_line_col, ignore_var_names)
 
-    for node1, node2 in zip_longest(gen1, gen2):
-        # unequal length
-        if node1 is None or node2 is None:
-            return False
 
-        if type(node1) != type(node2):
+def _ast_equal(node1, node2, check_line_col, ignore_var_names):
+    if node1 is node2:
+        return True
+
+    node_class = type(node1)
+    if node_class is not type(node2):
+        return False
+
+    # ignore the names of load name variables.
+    if (
+        ignore_var_names
+        and node_class is ast.Name
+        and isinstance(node1.ctx, ast.Load)
+        and isinstance(node2.ctx, ast.Load)
+    ):
+        return True
+
+    if check_line_col and hasattr(node1, 'lineno'):
+        if node1.lineno != node2.lineno:
             return False
+        if node1.col_offset != node2.col_offset:
+            return False
+
+    fields = node_fields(node_class)
+    if not fields:
+        return True
 
-        # ignore the names of load name variables.
-        if ignore_var_names and is_load_name(node1) and is_load_name(node2):
+    for field_name in fields:
+        value1 = getattr(node1, field_name, _missing)
+        value2 = getattr(node2, field_name, _missing)
+        if value1 is value2:
             continue
 
-        if not ast_field_equal(node1, node2):
+        value_type = type(value1)
+        if value_type is not type(value2):
             return False
 
-        if check_line_col and hasattr(node1, 'lineno'):
-            if node1.lineno != node2.lineno:
+        if value_type is list:
+            # compare lengths before descending
+            if len(value1) != len(value2):
                 return False
-            if node1.col_offset != node2.col_offset:
+            for item1, item2 in zip(value1, value2):
+                if item1 is item2:
+                    continue
+                if isinstance(item1, ast.AST):
+                    if not _ast_equal(item1, item2, check_line_col,
+                                      ignore_var_names):
+                        return False
+                elif type(item1) is not type(item2) or item1 != item2:
+                    return False
+        elif isinstance(value1, ast.AST):
+            if not _ast_equal(value1, value2, check_line_col,
+                              ignore_var_names):
                 return False
+        # scalars. str, int, float, complex, bytes, None, Ellipsis etc
+        elif value1 != value2:
+            return False
 
     return True
 
 
 def ast_contains(code, fragment, ignore_var_names=False):
-    """ tests whether fragment is a child within code. """
+    """
+    tests whether fragment is a child within code.
+
+    With ignore_var_names, a node matches if it is the same as fragment up to
+    a consistent renaming of its load names. i.e. `x + y` matches `a + b` but
+    `x + x` does not. The yielded item will also have a `load_names` key whose
+    positions correspond to the load names of fragment.
+    """
     expr = _convert_to_expression(fragment)
 
     if expr is None:
@@ -169,9 +255,25 @@ def ast_contains(code, fragment, ignore_var_names=False):
     # unwrap 
     fragment = expr.body
 
+    if not ignore_var_names:
+        for item in graph_walk(code):
+            node = item['node']
+            if ast_equal(node, fragment):
+                yield item
+        return False
+
+    fragment_key, _ = ast_fingerprint(fragment, alpha=True)
+    # only nodes with the same shape need the full alpha fingerprint
+    table = {}
+    fragment_shape = shape_ids(fragment, table)[fragment]
+    shapes = shape_ids(code, table)
     for item in graph_walk(code):
         node = item['node']
-        if ast_equal(node, fragment, ignore_var_names=ignore_var_names):
+        if shapes.get(node) != fragment_shape:
+            continue
+        key, names = ast_fingerprint(node, alpha=True)
+        if key == fragment_key:
+            item['load_names'] = names
             yield item
 
     return False
@@ -207,22 +309,31 @@ def code_context_subset(code, context, key_code, key_context,
             current_depth : int
         }
     """
+    _, key_load_names = ast_fingerprint(key_code)
+
     # check expresion
     matches = ast_contains(code, key_code,
                            ignore_var_names=ignore_var_names)
     for matched_item in matches:
         matched = matched_item['node']
-        if code_context_match(matched, context, key_code, key_context):
+        # without ignore_var_names the load names are exactly the same.
+        matched_load_names = matched_item.get('load_names', key_load_names)
+        if code_context_match(matched, context, key_code, key_context,
+                              matched_load_names=matched_load_names,
+                              key_load_names=key_load_names):
             yield matched_item
 
 
-def code_context_match(matched, matched_context, key_code, key_context):
+def code_context_match(matched, matched_context, key_code, key_context,
+                       matched_load_names=None, key_load_names=None):
 
     # at this point the load names should be equal for each code
-    # fragment. they are equal by position. load_names does not
-    # have a set order, but a stable order per same tree structure.
-    key_load_names = load_names(key_code)
-    matched_load_names = load_names(matched)
+    # fragment. they are equal by position. ast_fingerprint returns them in
+    # first occurrence order which is stable per same tree structure.
+    if key_load_names is None:
+        _, key_load_names = ast_fingerprint(key_code)
+    if matched_load_names is None:
+        _, matched_load_names = ast_fingerprint(matched)
     if len(key_load_names) != len(matched_load_names):
         return
 
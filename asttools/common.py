@@ -3,6 +3,7 @@ Nothing here can import asttools modules.
 """
 import ast
 import inspect
+import pickle
 import types
 from textwrap import dedent
 
@@ -40,6 +41,18 @@ def iter_fields(node):
         else:
             yield field, field_name, None
 
+_node_fields = {}
+
+def node_fields(node_class):
+    """
+    Cached tuple of _fields for an ast.AST subclass.
+    """
+    fields = _node_fields.get(node_class)
+    if fields is None:
+        fields = tuple(node_class._fields)
+        _node_fields[node_class] = fields
+    return fields
+
 def get_source(obj):
 
     source = obj
@@ -47,7 +60,7 @@ def get_source(obj):
         source = inspect.getsource(obj)
     elif isinstance(obj, types.FunctionType):
         # try source generated from create_function first
-        source = getattr(obj, '__asttools_source__', None)
+        source = generated_source(obj)
         if source is None:
             source = inspect.unwrap(obj)
             source = dedent(inspect.getsource(source))
@@ -64,6 +77,28 @@ def get_source(obj):
         raise NotImplementedError("{0}".format(str(source)))
     return source
 
+def generated_source(func):
+    """
+    Source of a function made by create_function. None if func wasn't
+    generated by asttools.
+
+    create_function only stores a pickled ast as __asttools_ast__. The source
+    is unparsed on first access and cached on __asttools_source__ next to it.
+    Neither is ever removed, so threads racing on the first access just
+    unparse the same source twice.
+    """
+    source = getattr(func, '__asttools_source__', None)
+    if source is not None:
+        return source
+
+    dumped = getattr(func, '__asttools_ast__', None)
+    if dumped is None:
+        return None
+
+    source = ast.unparse(pickle.loads(dumped)).strip()
+    func.__asttools_source__ = source
+    return source
+
 def quick_parse(line, *args, **kwargs):
     """ quick way to generate nodes """
     if args or kwargs:
@@ -0,0 +1,112 @@
+"""
+Structural fingerprints for ast nodes.
+
+A fingerprint is a hashable nested tuple that mirrors the node structure. Two
+nodes with equal fingerprints are ast_equal. With alpha=True, Load names are
+replaced by the index of their first occurrence so that expressions that are
+the same up to a consistent renaming share a fingerprint:
+
+    ast_fingerprint(quick_parse("a + b * a"), alpha=True)
+    ast_fingerprint(quick_parse("x + y * x"), alpha=True)
+
+both return the same key, while "x + y * y" will not.
+"""
+import ast
+
+from .common import node_fields, _node_fields
+
+_missing = object()
+
+
+def ast_fingerprint(node, alpha=False):
+    """
+    Returns (key, load_names)
+
+    key : tuple
+        hashable structural representation of node. Does not include line
+        numbers or col offsets.
+    load_names : list
+        Name(ctx=Load()) ids in first occurrence order. With alpha=True, the
+        index into this list is what's stored in the key, so zipping the
+        load_names of two nodes with equal keys gives the name binding.
+    """
+    names = {}
+    key = _fingerprint(node, names, alpha)
+    return key, list(names)
+
+
+def _fingerprint(node, names, alpha):
+    node_class = type(node)
+
+    if node_class is ast.Name and isinstance(node.ctx, ast.Load):
+        index = names.setdefault(node.id, len(names))
+        if alpha:
+            return (ast.Name, index)
+
+    fields = _node_fields.get(node_class)
+    if fields is None:
+        fields = node_fields(node_class)
+
+    key = [node_class]
+    for field_name in fields:
+        value = getattr(node, field_name, _missing)
+        if type(value) is list:
+            value = tuple([
+                _fingerprint(item, names, alpha)
+                if isinstance(item, ast.AST)
+                else _scalar_key(item)
+                for item in value
+            ])
+        elif isinstance(value, ast.AST):
+            value = _fingerprint(value, names, alpha)
+        else:
+            value = _scalar_key(value)
+        key.append(value)
+    return tuple(key)
+
+
+def _scalar_key(value):
+    # 1 == True == 1.0 so the type needs to be part of the key
+    return (type(value), value)
+
+
+def shape_ids(root, table=None):
+    """
+    {node: int} for every node under root, computed bottom up in one pass.
+    Nodes share an id when their fingerprints are equal once Load names are
+    ignored, so only those can have equal alpha fingerprints.
+
+    table : dict
+        {shape: id}. Pass the same dict to compare ids across trees.
+    """
+    if table is None:
+        table = {}
+    ids = {}
+    name_load = table.setdefault((ast.Name,), len(table))
+    # breadth first order reversed puts children before their parents
+    for node in reversed(list(ast.walk(root))):
+        node_class = type(node)
+        if node_class is ast.Name and isinstance(node.ctx, ast.Load):
+            ids[node] = name_load
+            continue
+
+        fields = _node_fields.get(node_class)
+        if fields is None:
+            fields = node_fields(node_class)
+
+        shape = [node_class]
+        for field_name in fields:
+            value = getattr(node, field_name, _missing)
+            if type(value) is list:
+                value = tuple([
+                    ids[item] if isinstance(item, ast.AST)
+                    else _scalar_key(item)
+                    for item in value
+                ])
+            elif isinstance(value, ast.AST):
+                value = ids[value]
+            else:
+                value = _scalar_key(value)
+            shape.append(value)
+        ids[node] = table.setdefault(tuple(shape), len(table))
+    return ids
@@ -1,12 +1,20 @@
 import ast
+import copy
+import functools
 import inspect
+import pickle
+import threading
 import types
+import weakref
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 from .common import get_source
-from .repr import ast_source
 from .sigparams import (
     ast_sigparams as ast_sigparams,
+    ast_signature as ast_signature,
+    call_bindings as call_bindings,
 )
 
 
@@ -39,14 +47,11 @@ def create_function(code, func=None,
         env function will be executed in
     filename : str
         filename attached to code object and used for debug statements
+    ignore_closure : bool
+        compile without the closure of func. By default the new function
+        reuses the __closure__ cells of func and can only use its free
+        variables.
     """
-    if func:
-        filename = inspect.getfile(func)
-        globals = globals or func.__globals__
-
-    if filename is None:
-        filename = '<asttools.function.create_function>'
-
     if isinstance(code, str):
         code = ast.parse(code)
 
@@ -60,45 +65,302 @@ def create_function(code, func=None,
     func_def = module.body[0]
     func_name = func_def.name
 
-    grabber = getitem_grabber
+    funcs = {}
+    if func:
+        funcs[func_name] = func
+
+    new_funcs = create_functions(
+        [func_def],
+        funcs=funcs,
+        globals=globals,
+        filename=filename,
+        ignore_closure=ignore_closure,
+    )
+    return new_funcs[func_name]
+
 
-    uses_super = False
-    if func and func.__closure__ and not ignore_closure:
-        if func.__code__.co_freevars == ('__class__',):
-            uses_super = True
+def create_functions(codes, funcs=None,
+                     globals=None,
+                     filename=None,
+                     ignore_closure=False):
+    """
+    Batched create_function. Every function definition is compiled into a
+    single module and exec'd once.
+
+    codes : list of ast.FunctionDef, ast.Module, str
+        modules and source strings can hold multiple function definitions
+    funcs : dict
+        {func_name: Function} templates keyed by the name of the new function
+        definition. Used for closures (i.e. super()) and, if not passed in,
+        filename and globals.
+    globals : dict
+        env functions will be executed in. Required if the templates do not
+        share __globals__.
+    filename : str
+        filename attached to code object and used for debug statements
+
+    Returns {func_name: Function}
+
+    The source of each function is available lazily through get_source.
+    """
+    if isinstance(codes, (str, ast.AST)):
+        codes = [codes]
+    funcs = funcs or {}
+
+    func_defs = []
+    for code in codes:
+        if isinstance(code, str):
+            code = ast.parse(code)
+        if isinstance(code, ast.Module):
+            func_defs.extend(code.body)
         else:
-            raise Exception("Current can't handle closures other than super()")
+            func_defs.append(code)
+
+    names = []
+    for func_def in func_defs:
+        if not isinstance(func_def, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            raise TypeError("Expected ast.FunctionDef. "
+                            "Received {0}".format(type(func_def)))
+        if func_def.name in names:
+            raise ValueError("Duplicate function name "
+                             "{0}".format(func_def.name))
+        names.append(func_def.name)
+
+    templates = [funcs[name] for name in names if name in funcs]
+    if templates and filename is None:
+        filename = inspect.getfile(templates[0])
+
+    if templates and globals is None:
+        globals = templates[0].__globals__
+        if any(t.__globals__ is not globals for t in templates):
+            raise ValueError("Templates do not share __globals__. "
+                             "Pass in globals explicitly.")
+
+    if filename is None:
+        filename = '<asttools.function.create_function>'
 
-    if uses_super:
-        class_def = wrap_func_def_in_class(func_def)
-        module.body = [class_def]
-        grabber = klass_grabber
+    body = []
+    closure_names = set()
+    for func_def in func_defs:
+        func = funcs.get(func_def.name)
+        if func and func.__closure__ and not ignore_closure:
+            freevars = func.__code__.co_freevars
+            factory_def = closure_factory_def(
+                func_def,
+                freevars,
+                strip_defaults=same_defaults(func_def, func),
+            )
+            body.append(factory_def)
+            closure_names.add(func_def.name)
+        else:
+            body.append(func_def)
 
+    module = ast.Module(body, type_ignores=[])
     module = ast.fix_missing_locations(module)
     module_obj = compile(module, filename, 'exec')
 
     ns = {}
     exec(module_obj, globals, ns)
-    new_func = grabber(ns, func_name)
 
-    if uses_super:
-        new_func = types.FunctionType(
-            new_func.__code__,
-            new_func.__globals__,
-            closure=func.__closure__
+    new_funcs = {}
+    for func_def in func_defs:
+        func_name = func_def.name
+        # unparse is deferred to get_source
+        dumped_ast = pickle.dumps(
+            func_def,
+            protocol=pickle.HIGHEST_PROTOCOL,
         )
 
-    new_func.__asttools_source__ = ast_source(module)
+        if func_name in closure_names:
+            func = funcs[func_name]
+            factory = getitem_grabber(ns, _closure_factory_name(func_name))
+            template = ClosureTemplate(
+                factory,
+                func.__code__.co_freevars,
+                dumped_ast,
+                func_defaults=same_defaults(func_def, func),
+            )
+            new_func = template.instantiate(func)
+        else:
+            new_func = getitem_grabber(ns, func_name)
+            new_func.__asttools_ast__ = dumped_ast
+
+        new_funcs[func_name] = new_func
+
+    return new_funcs
+
+
+def _closure_factory_name(func_name):
+    return '__asttools_closure_{0}__'.format(func_name)
+
+
+def same_defaults_layout(func_def, func):
+    """
+    Whether func_def has defaults for the same parameters as func.
+    """
+    args = func_def.args
+    kw_defaults = {
+        arg.arg for arg, default in zip(args.kwonlyargs, args.kw_defaults)
+        if default is not None
+    }
+    return (
+        len(args.defaults) == len(func.__defaults__ or ())
+        and kw_defaults == set(func.__kwdefaults__ or ())
+    )
+
+
+def same_defaults(func_def, func):
+    """
+    Whether the default expressions of func_def are the ones func was
+    defined with, so that func's evaluated defaults can be reused. False if
+    a rewrite changed them or the source of func isn't available.
+    """
+    if not same_defaults_layout(func_def, func):
+        return False
+
+    try:
+        original = ast.parse(get_source(func)).body[0]
+    except (OSError, TypeError, SyntaxError, IndexError):
+        return False
+    if not isinstance(original, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return False
+
+    def dumps(args):
+        return [
+            None if default is None else ast.dump(default)
+            for default in args.defaults + args.kw_defaults
+        ]
+    return dumps(func_def.args) == dumps(original.args)
+
+
+def closure_factory_def(func_def, freevars, strip_defaults=False):
+    """
+    Wrap func_def in an enclosing function that declares freevars.
+
+    def __asttools_closure_func__(a, b):
+        def func():
+            return a + b
+        return func
 
-    return new_func
+    The free variables are parameters so that defaults are evaluated with
+    the live values. __class__ (i.e. super()) is provided by wrapping the
+    definition in a class.
+
+    Default expressions can refer to locals of the original enclosing scope
+    that aren't free variables. strip_defaults replaces them with None so the
+    caller can use the defaults of the original function instead. Only do
+    that when they're unchanged, see same_defaults.
+    """
+    func_name = func_def.name
+
+    if strip_defaults:
+        # don't mutate the passed in tree
+        func_def = copy.copy(func_def)
+        args = func_def.args = copy.copy(func_def.args)
+        args.defaults = [ast.Constant(value=None) for _ in args.defaults]
+        args.kw_defaults = [
+            None if default is None else ast.Constant(value=None)
+            for default in args.kw_defaults
+        ]
+
+    params = [name for name in freevars if name != '__class__']
+    ret = func_name
+
+    inner = func_def
+    if '__class__' in freevars:
+        inner = wrap_func_def_in_class(func_def)
+        ret = 'klass.{0}'.format(func_name)
+
+    source = "def {name}({params}):\n    return {ret}".format(
+        name=_closure_factory_name(func_name),
+        params=', '.join(params),
+        ret=ret,
+    )
+    factory_def = ast.parse(source).body[0]
+    factory_def.body.insert(0, inner)
+    return factory_def
+
+
+def _cell_contents(cell):
+    try:
+        return cell.cell_contents
+    except ValueError:
+        # cell hasn't been assigned yet
+        return None
+
+
+class ClosureTemplate:
+    """
+    Compiled closure factory for a function with free variables.
+
+    instantiate binds the compiled code to the __closure__ cells of a template
+    function. The cells are reused, not copied, so the new function sees the
+    same enclosing scope as the original. Since nothing is recompiled, a
+    template can be instantiated again each time the enclosing function of
+    the original is run.
+    """
+    def __init__(self, factory, freevars, dumped_ast=None,
+                 func_defaults=False):
+        self.factory = factory
+        self.freevars = freevars
+        self.params = [name for name in freevars if name != '__class__']
+        self.dumped_ast = dumped_ast
+        # use the defaults of the instantiating func
+        self.func_defaults = func_defaults
+
+    def instantiate(self, func):
+        freevars = func.__code__.co_freevars
+        if freevars != self.freevars:
+            raise ValueError("Template expects free variables {0}. "
+                             "Received {1}".format(self.freevars, freevars))
+
+        cells = dict(zip(freevars, func.__closure__))
+        values = [_cell_contents(cells[name]) for name in self.params]
+        made_func = self.factory(*values)
+        code = made_func.__code__
+
+        # a rewrite can drop free variables, i.e. a folded branch
+        extra = set(code.co_freevars) - set(freevars)
+        if extra:
+            raise ValueError(
+                "{0} requires free variables {1} not in the closure".format(
+                    code.co_name,
+                    sorted(extra),
+                )
+            )
+
+        defaults = made_func.__defaults__
+        kwdefaults = made_func.__kwdefaults__
+        if self.func_defaults:
+            defaults = func.__defaults__
+            kwdefaults = func.__kwdefaults__ and dict(func.__kwdefaults__)
+
+        closure = tuple(cells[name] for name in code.co_freevars) or None
+        new_func = types.FunctionType(
+            code,
+            made_func.__globals__,
+            made_func.__name__,
+            defaults,
+            closure,
+        )
+        new_func.__kwdefaults__ = kwdefaults
+        new_func.__annotations__ = made_func.__annotations__
+        new_func.__asttools_template__ = self
+        if self.dumped_ast is not None:
+            new_func.__asttools_ast__ = self.dumped_ast
+        return new_func
 
 
 def wrap_func_def_in_class(func_def):
+    body = func_def
+    if not isinstance(func_def, list):
+        body = [func_def]
+
     class_def = ast.ClassDef(
         name='klass',
         bases=[],
         keywords=[],
-        body=[func_def],
+        body=body,
         lineno=0,
         col_offset=0,
         decorator_list=[],
@@ -108,17 +370,169 @@ def wrap_func_def_in_class(func_def):
     return class_def
 
 
-def func_rewrite(transform, post_wrap=None):
-    def _wrapper(func):
-        code = ast.parse(get_source(func))
-        transform(code)
-        new_func = create_function(code, func=func)
+def func_rewrite(transform, post_wrap=None, deferred=None):
+    """
+    Decorator that rewrites the ast of a function with transform.
+
+    deferred : None, 'call' or 'background'
+        None rewrites when the function is decorated. 'call' returns a
+        trampoline right away and rewrites on the first call. 'background'
+        also queues the rewrite on a thread pool so it's usually done by the
+        first call. See wait_rewrites.
+    """
+    if deferred not in _deferred_modes:
+        raise ValueError("deferred must be one of {0}".format(_deferred_modes))
+
+    def _rewrite(func):
+        template = None
+        if func.__closure__:
+            template = _get_closure_template(func.__code__, transform)
+
+        if template is not None:
+            new_func = template.instantiate(func)
+        else:
+            code = ast.parse(get_source(func))
+            transform(code)
+            new_func = create_function(code, func=func)
+            template = getattr(new_func, '__asttools_template__', None)
+            if template is not None:
+                _set_closure_template(func.__code__, transform, template)
+
         if post_wrap:
             post_wrap(new_func, func)
         return new_func
+
+    def _wrapper(func):
+        if deferred is None:
+            return _rewrite(func)
+
+        rewrite = DeferredRewrite(func, _rewrite)
+        if deferred == 'background':
+            rewrite.submit()
+        return rewrite.trampoline
     return _wrapper
 
 
+_deferred_modes = (None, 'call', 'background')
+
+# closure templates keyed by (original code object, transform). A decorated
+# inner function is re-decorated every time its enclosing function runs, and
+# so is the func_rewrite decorator when it's written inline. Keeping the cache
+# here means only the first run pays for the parse/transform/compile.
+_closure_templates = weakref.WeakKeyDictionary()
+_closure_templates_lock = threading.Lock()
+
+
+def _get_closure_template(code, transform):
+    with _closure_templates_lock:
+        try:
+            return _closure_templates.get(code, {}).get(transform)
+        except TypeError:
+            # unhashable transform
+            return None
+
+
+def _set_closure_template(code, transform, template):
+    with _closure_templates_lock:
+        try:
+            _closure_templates.setdefault(code, {})[transform] = template
+        except TypeError:
+            pass
+
+
+class DeferredRewrite:
+    """
+    Rewrite of func that runs on first call or on the rewrite pool.
+
+    trampoline : function
+        stands in for func. Calls go to whatever target currently holds.
+        target starts as a function that does the rewrite and is swapped for
+        the rewritten function once it's done. Rebinding a cell is atomic,
+        so callers on other threads see either the old or the new target.
+        A module level trampoline is also replaced in its module by the
+        rewritten function so calls by name skip the extra hop.
+    """
+    def __init__(self, func, rewrite):
+        self.func = func
+        self._rewrite = rewrite
+        self._lock = threading.Lock()
+        self.new_func = None
+        self.future = None
+
+        def target(*args, **kwargs):
+            return self.result()(*args, **kwargs)
+
+        def trampoline(*args, **kwargs):
+            return target(*args, **kwargs)
+
+        def swap(new_func):
+            nonlocal target
+            target = new_func
+
+        self._swap = swap
+        functools.update_wrapper(trampoline, func)
+        trampoline.__asttools_deferred__ = self
+        self.trampoline = trampoline
+
+    def done(self):
+        return self.new_func is not None
+
+    def result(self):
+        """
+        The rewritten function. Does the rewrite if it hasn't been done.
+        Errors from the rewrite are raised here and the next call retries.
+        """
+        new_func = self.new_func
+        if new_func is not None:
+            return new_func
+
+        with self._lock:
+            if self.new_func is None:
+                new_func = self._rewrite(self.func)
+                self._swap(new_func)
+                self.new_func = new_func
+
+                namespace = self.func.__globals__
+                name = self.func.__name__
+                if self.func.__qualname__ == name \
+                   and namespace.get(name) is self.trampoline:
+                    namespace[name] = new_func
+        return self.new_func
+
+    def submit(self):
+        """ Queue the rewrite on the rewrite pool """
+        with _pending_lock:
+            self.future = _rewrite_pool().submit(self.result)
+            _pending.add(self.future)
+        return self.future
+
+
+def _rewrite_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(thread_name_prefix='asttools-rewrite')
+    return _pool
+
+
+_pool = None
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def wait_rewrites(timeout=None):
+    """
+    Wait for background rewrites queued by func_rewrite(deferred=
+    'background') since the last wait. Returns the number of rewrites that
+    failed. A failed rewrite raises again when the function is called.
+    """
+    with _pending_lock:
+        pending = list(_pending)
+    done, _ = futures.wait(pending, timeout=timeout)
+    with _pending_lock:
+        _pending.difference_update(done)
+    return sum(1 for future in done if future.exception() is not None)
+
+
 def func_code(func):
     """
     return the ast.FunctionDef node of a function
@@ -197,18 +611,11 @@ def add_call_starargs(node, name):
 
 
 def get_call_kwargs(node):
-    sigparams = ast_sigparams(node)
-    for name, param in sigparams.items():
-        if param.kind == inspect.Parameter.VAR_KEYWORD:
-            return name
+    return ast_signature(node).var_keyword
 
 
 def get_call_starargs(node):
-    sigparams = ast_sigparams(node)
-    starargs = [
-        param.name for param in sigparams.values()
-        if param.kind == inspect.Parameter.VAR_POSITIONAL
-    ]
+    starargs = ast_signature(node).var_positional
     if len(starargs) > 1:
         raise NotImplementedError("Got more than one starargs")
     if len(starargs) == 1:
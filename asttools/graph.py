@@ -1,4 +1,5 @@
 import ast
+import copy
 from collections import OrderedDict
 
 from .common import iter_fields
@@ -40,15 +41,18 @@ class AstGraphWalker(object):
             field_name : str,
             field_index : int or None,
             fields : OrderedDict {field_name : [field_item]}
-            current_depth : int,
+            depth : int,
             line : _ast.stmt.
             location : {parent, field_name, field_index}
         }
 
         field_index is None when field is not a list
-        current_depth starts from 0 at the top.
+        depth starts from 0 at the top.
 
-    In reality, I should just make this functions.
+    Every process runs on its own shallow copy of the walker, so the walk
+    state (current_depth and line) is never shared. process can be run any
+    number of times, including concurrently from several threads. lines
+    and _processed are copied back once a walk is done.
     """
 
     def __init__(self, code):
@@ -60,11 +64,12 @@ class AstGraphWalker(object):
         self.code = code
         self._processed = False
         self.line = None
+        self.lines = None
 
     def process(self):
-        if self._processed:
-            raise Exception('Grapher has already processed code')
-        yield from self.visit(self.code, None, None, None)
+        walker = copy.copy(self)
+        yield from walker.visit(self.code, None, None, None)
+        self.lines = walker.lines
         self._processed = True
 
     def visit(self, node, parent, field_name, field_index):
@@ -85,6 +90,7 @@ class AstGraphWalker(object):
         self.current_depth += 1
         node_item = self.handle_item(node, parent, field_name, field_index)
         if node_item is None:
+            self.current_depth -= 1
             return
 
         fields = OrderedDict()
@@ -121,5 +127,132 @@ class AstGraphWalker(object):
         return item
 
 def graph_walk(code):
+    """
+    Post-order walk of code that yields the AstGraphWalker items. The
+    Module itself isn't yielded.
+
+    Thread safety: a walk keeps all of its state in its own generator
+    frames, so any number of walks can run over the same tree at once. The
+    tree must not be mutated while it's being walked by another thread.
+    """
     walker = AstGraphWalker(code)
     return walker.process()
+
+# CPython shares single instances of these between every node that uses
+# them, so they can't have a single parent.
+_shared_node_types = (
+    ast.expr_context,
+    ast.boolop,
+    ast.operator,
+    ast.unaryop,
+    ast.cmpop,
+)
+
+def iter_child_locations(node):
+    """ yield child_node, field_name, field_index for ast children """
+    for item, field_name, field_index in iter_fields(node):
+        if isinstance(item, ast.AST) \
+           and not isinstance(item, _shared_node_types):
+            yield item, field_name, field_index
+
+class ParentMap:
+    """
+    node => NodeLocation(parent, field_name, field_index)
+
+    Built with one walk. Afterwards parent lookups are O(1) and ancestor
+    queries are O(depth). Pass the ParentMap to transform, replace_node or
+    delete_node to keep it up to date. If you mutate the tree yourself, call
+    update_children on the parent with its children from before the
+    mutation.
+
+    Shared singleton nodes like ast.Load and ast.Add are not tracked.
+    """
+    def __init__(self, code):
+        if isinstance(code, str):
+            code = ast.parse(code)
+        self.root = code
+        self._locations = {}
+        self.add(code)
+
+    def __contains__(self, node):
+        return node in self._locations
+
+    def __len__(self):
+        return len(self._locations)
+
+    def add(self, node, parent=None, field_name=None, field_index=None):
+        """ insert node and its subtree """
+        locations = self._locations
+        stack = [(node, parent, field_name, field_index)]
+        while stack:
+            node, parent, field_name, field_index = stack.pop()
+            locations[node] = NodeLocation(parent, field_name, field_index)
+            for item in iter_child_locations(node):
+                stack.append((item[0], node, item[1], item[2]))
+
+    def remove(self, node):
+        """ remove node and its subtree """
+        locations = self._locations
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            locations.pop(node, None)
+            stack.extend(item[0] for item in iter_child_locations(node))
+
+    def children(self, node):
+        return [item[0] for item in iter_child_locations(node)]
+
+    def update_children(self, node, old_children):
+        """
+        Sync the direct children of node after it was mutated.
+
+        old_children : list
+            children of node before the mutation. See ParentMap.children
+        """
+        locations = self._locations
+        new_children = list(iter_child_locations(node))
+        current = {item[0] for item in new_children}
+
+        for child in old_children:
+            if child in current:
+                continue
+            location = locations.get(child)
+            # child might have been moved under a different parent
+            if location is not None and location.parent is node:
+                self.remove(child)
+
+        for child, field_name, field_index in new_children:
+            location = locations.get(child)
+            if location is None or location.parent is not node:
+                self.add(child, node, field_name, field_index)
+            elif location.field_name != field_name \
+                    or location.field_index != field_index:
+                locations[child] = NodeLocation(node, field_name, field_index)
+
+    def location(self, node):
+        return self._locations[node]
+
+    def parent(self, node):
+        return self._locations[node].parent
+
+    def ancestors(self, node):
+        """ parent first up to the root """
+        locations = self._locations
+        parent = locations[node].parent
+        while parent is not None:
+            yield parent
+            parent = locations[parent].parent
+
+    def enclosing(self, node, node_types):
+        for parent in self.ancestors(node):
+            if isinstance(parent, node_types):
+                return parent
+
+    def enclosing_statement(self, node):
+        return self.enclosing(node, ast.stmt)
+
+    def enclosing_function(self, node):
+        return self.enclosing(
+            node,
+            (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda),
+        )
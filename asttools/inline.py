@@ -0,0 +1,487 @@
+"""
+Inline calls to small helper functions.
+
+    @inline
+    def norm(x, y):
+        return (x * x + y * y) ** 0.5
+
+    @func_inline
+    def lengths(points):
+        out = []
+        for x, y in points:
+            out.append(norm(x, y))
+        return out
+
+A helper is inlined if it's marked with @inline or if its body is a single
+return of at most max_size nodes. Helpers can't have closures, *args,
+**kwargs, nested scopes, yields or early returns.
+
+Calls are replaced in place with the return expression when the arguments
+can be substituted without changing the order they're evaluated in.
+Otherwise, when the call is the value of an assignment, return or
+expression statement, the arguments are assigned to locals and the body of
+the helper is spliced in before the statement. Locals of the helper are
+renamed so they don't clash with the caller.
+"""
+import ast
+import copy
+import inspect
+import types
+import weakref
+
+from .function import ast_signature, func_code, func_rewrite
+from .optimize import _child_slots, _conditional_nodes, _safe_value
+from .optimize import _scope_nodes, _set_slot, _unique_name
+from .scope import SymbolTable
+from .transform import EagerTransformer, transform
+
+INLINE_MAX_SIZE = 40
+
+_missing = object()
+
+_unsupported = _scope_nodes + (
+    ast.Return, ast.Yield, ast.YieldFrom, ast.Await,
+    ast.Global, ast.Nonlocal,
+)
+
+
+def inline(func):
+    """ Mark func to be inlined by func_inline regardless of size """
+    func.__asttools_inline__ = True
+    return func
+
+
+def _is_marker(node):
+    if isinstance(node, ast.Name):
+        return node.id == 'inline'
+    if isinstance(node, ast.Attribute):
+        return node.attr == 'inline'
+    return False
+
+
+def _is_simple(node):
+    return isinstance(node, (ast.Name, ast.Constant))
+
+
+class InlineHelper:
+    """
+    Parsed helper function that can be spliced into a caller.
+
+    stmts : statements before the final return
+    ret : the returned expression
+    locals : names local to the helper, including parameters
+    globals : globals the helper refers to
+    stored : names assigned in the helper body
+    load_counts : {name: number of loads}
+    conditional : names that are loaded in a conditionally evaluated spot
+    has_calls : whether the body calls anything
+    """
+    def __init__(self, func, func_def):
+        self.func = func
+        self.func_def = func_def
+        self.name = func_def.name
+        self.signature = ast_signature(func_def)
+
+        body = func_def.body
+        if ast.get_docstring(func_def) is not None:
+            body = body[1:]
+        self.stmts = body[:-1]
+        self.ret = body[-1].value
+
+        table = SymbolTable(func_def)
+        scope = table.scopes[func_def]
+        self.locals = scope.locals
+        self.globals = scope.globals
+
+        self.stored = set()
+        self.load_counts = {}
+        self.conditional = set()
+        self.has_calls = False
+        for stmt in body:
+            for node in ast.walk(stmt):
+                if isinstance(node, ast.Name):
+                    if isinstance(node.ctx, ast.Load):
+                        count = self.load_counts.get(node.id, 0)
+                        self.load_counts[node.id] = count + 1
+                    else:
+                        self.stored.add(node.id)
+                elif isinstance(node, ast.Call):
+                    self.has_calls = True
+
+                for sub in _conditional_nodes(node):
+                    self.conditional.update(
+                        n.id for n in ast.walk(sub)
+                        if isinstance(n, ast.Name)
+                    )
+
+    @property
+    def single_return(self):
+        return not self.stmts
+
+    def defaults(self):
+        return {
+            name: param.default
+            for name, param in inspect.signature(self.func).parameters.items()
+            if param.default is not inspect.Parameter.empty
+        }
+
+    def expand(self, substitutes, renames):
+        """
+        Copies of the helper statements and return expression.
+
+        substitutes : {param: ast.expr} loads of param are replaced with a
+            copy of the expression
+        renames : {local: new_name}
+        """
+        body = copy.deepcopy(self.stmts)
+        holder = ast.Expr(value=copy.deepcopy(self.ret))
+
+        stack = body + [holder]
+        while stack:
+            node = stack.pop()
+            for child, field_name, field_index in list(_child_slots(node)):
+                if isinstance(child, ast.Name):
+                    name = child.id
+                    if name in substitutes:
+                        new = copy.deepcopy(substitutes[name])
+                        _set_slot(node, field_name, field_index, new)
+                        continue
+                    if name in renames:
+                        child.id = renames[name]
+                    continue
+                stack.append(child)
+
+        return body, holder.value
+
+
+def _check_helper(func_def, marked, max_size):
+    if not isinstance(func_def, ast.FunctionDef):
+        return False
+
+    if not all(map(_is_marker, func_def.decorator_list)):
+        return False
+
+    args = func_def.args
+    if args.vararg is not None or args.kwarg is not None:
+        return False
+
+    body = func_def.body
+    if ast.get_docstring(func_def) is not None:
+        body = body[1:]
+    if not body:
+        return False
+
+    last = body[-1]
+    if not isinstance(last, ast.Return) or last.value is None:
+        return False
+
+    for stmt in body[:-1]:
+        if any(isinstance(node, _unsupported) for node in ast.walk(stmt)):
+            return False
+    if any(isinstance(node, _unsupported) for node in ast.walk(last.value)):
+        return False
+
+    if marked:
+        return True
+
+    if len(body) > 1:
+        return False
+    size = sum(1 for _ in ast.walk(last.value))
+    return size <= max_size
+
+
+def get_helper(func, max_size=INLINE_MAX_SIZE):
+    """
+    InlineHelper for func or None if func can't be inlined. Cached per
+    function.
+    """
+    if not isinstance(func, types.FunctionType):
+        return None
+
+    key = (func.__code__, max_size)
+    cache = _helpers.get(func)
+    if cache is not None and key in cache:
+        return cache[key]
+
+    helper = None
+    marked = getattr(func, '__asttools_inline__', False)
+    if func.__closure__ is None:
+        try:
+            func_def = func_code(func)
+        except (OSError, TypeError, SyntaxError, AssertionError):
+            func_def = None
+
+        if func_def is not None and _check_helper(func_def, marked, max_size):
+            helper = InlineHelper(func, func_def)
+
+    _helpers.setdefault(func, {})[key] = helper
+    return helper
+
+
+_helpers = weakref.WeakKeyDictionary()
+
+
+class Inliner(EagerTransformer):
+    """
+    Transformer for transform.
+
+    namespace : dict
+        globals of the caller. Call names are resolved against it.
+    table : SymbolTable
+        of the tree being transformed, built before any changes.
+    """
+    def __init__(self, namespace, table, taken, max_size=INLINE_MAX_SIZE):
+        super().__init__()
+        self.namespace = namespace
+        self.table = table
+        self.taken = taken
+        self.max_size = max_size
+        self.inlined = 0
+
+    def helper_for(self, call):
+        func = call.func
+        if not isinstance(func, ast.Name):
+            return None
+
+        try:
+            scope = self.table.scope_of(func)
+        except KeyError:
+            # added by an earlier inline
+            return None
+
+        if scope.kind == 'class' or func.id not in scope.globals:
+            return None
+
+        obj = self.namespace.get(func.id, _missing)
+        if obj is _missing:
+            return None
+
+        helper = get_helper(obj, self.max_size)
+        if helper is None:
+            return None
+
+        # globals of the helper have to mean the same thing here
+        helper_globals = helper.func.__globals__
+        for name in helper.globals:
+            if self.namespace.get(name, _missing) \
+               is not helper_globals.get(name, _missing):
+                return None
+            if _shadowed(name, scope):
+                return None
+        return helper
+
+    def bind(self, helper, call):
+        """
+        {param: ast.expr} with defaults as constants. None if the call can't
+        be bound statically.
+        """
+        try:
+            bound = helper.signature.bind(call)
+        except (TypeError, ValueError):
+            return None
+
+        passed = {id(arg) for arg in call.args}
+        passed.update(id(kw.value) for kw in call.keywords)
+
+        defaults = None
+        for param, value in bound.items():
+            if id(value) in passed:
+                continue
+            if defaults is None:
+                defaults = helper.defaults()
+            default = defaults.get(param, _missing)
+            if default is _missing or not _safe_value(default):
+                return None
+            bound[param] = ast.Constant(value=default)
+        return bound
+
+    def renames(self, helper, skip=()):
+        self.taken.update(helper.globals)
+        return {
+            name: _unique_name('_{0}_{1}'.format(helper.name, name),
+                               self.taken)
+            for name in sorted(helper.locals) if name not in skip
+        }
+
+    def visit_Call(self, node, meta):
+        helper = self.helper_for(node)
+        if helper is None or not helper.single_return:
+            return node
+
+        bound = self.bind(helper, node)
+        if bound is None:
+            return node
+
+        # an argument with side effects has to be evaluated exactly once, in
+        # call order and before anything else in the body. Otherwise the
+        # statement level inline binds the arguments first.
+        complex_params = [p for p, v in bound.items() if not _is_simple(v)]
+        if complex_params:
+            if len(complex_params) > 1 or helper.has_calls:
+                return node
+            param = complex_params[0]
+            if helper.load_counts.get(param, 0) != 1 \
+               or param in helper.conditional:
+                return node
+            if _first_load(helper.ret) != param:
+                return node
+            # names passed before it were read before it ran
+            value = bound[param]
+            for passed in node.args + [kw.value for kw in node.keywords]:
+                if passed is value:
+                    break
+                if not isinstance(passed, ast.Constant):
+                    return node
+
+        renames = self.renames(helper, skip=bound)
+        _, expr = helper.expand(bound, renames)
+        self.inlined += 1
+        return ast.copy_location(expr, node)
+
+    def visit_blocks(self, node):
+        for field_name in ('body', 'orelse', 'finalbody'):
+            stmts = getattr(node, field_name, None)
+            if not isinstance(stmts, list) or not stmts:
+                continue
+            if not isinstance(stmts[0], ast.stmt):
+                continue
+
+            new_stmts = []
+            for stmt in stmts:
+                new_stmts.extend(self.inline_stmt(stmt))
+            if len(new_stmts) != len(stmts):
+                setattr(node, field_name, new_stmts)
+
+    def inline_stmt(self, stmt):
+        """
+        Splice in the helper called by stmt. Returns the statements that
+        replace stmt.
+        """
+        call = _statement_call(stmt)
+        if call is None:
+            return [stmt]
+
+        try:
+            scope = self.table.scope_of(stmt)
+        except KeyError:
+            return [stmt]
+        if scope.kind != 'function':
+            return [stmt]
+
+        helper = self.helper_for(call)
+        if helper is None:
+            return [stmt]
+
+        bound = self.bind(helper, call)
+        if bound is None:
+            return [stmt]
+
+        # constants are substituted, everything else is evaluated into a
+        # local in the order of the call
+        substitutes = {
+            param: value for param, value in bound.items()
+            if isinstance(value, ast.Constant) and param not in helper.stored
+        }
+        renames = self.renames(helper, skip=substitutes)
+
+        # defaults go last
+        param_of = {id(value): param for param, value in bound.items()}
+        passed = call.args + [kw.value for kw in call.keywords]
+        params = [param_of[id(value)] for value in passed]
+        params += [param for param in bound if param not in params]
+
+        pre = []
+        for param in params:
+            if param in substitutes:
+                continue
+            value = bound[param]
+            assign = ast.Assign(
+                targets=[ast.Name(id=renames[param], ctx=ast.Store())],
+                value=value,
+            )
+            pre.append(ast.copy_location(assign, stmt))
+
+        body, expr = helper.expand(substitutes, renames)
+        for new_stmt in body:
+            ast.copy_location(new_stmt, stmt)
+        stmt.value = ast.copy_location(expr, call)
+        self.inlined += 1
+        return pre + body + [stmt]
+
+
+def _first_load(node):
+    """ first name loaded when node is evaluated. None if there are none """
+    if isinstance(node, ast.Name):
+        return node.id
+
+    if isinstance(node, ast.Dict):
+        children = [
+            child for pair in zip(node.keys, node.values) for child in pair
+            if child is not None
+        ]
+    else:
+        children = [child for child, _, _ in _child_slots(node)]
+
+    for child in children:
+        name = _first_load(child)
+        if name is not None:
+            return name
+    return None
+
+
+def _statement_call(stmt):
+    if isinstance(stmt, (ast.Assign, ast.AnnAssign, ast.Return, ast.Expr)):
+        value = stmt.value
+        if isinstance(value, ast.Call):
+            return value
+
+
+def _shadowed(name, scope):
+    """ whether a local of scope or an enclosing function hides name """
+    while scope is not None and scope.kind != 'module':
+        if scope.kind != 'class' and name in scope.locals:
+            return True
+        scope = scope.parent
+    return False
+
+
+def inline_calls(code, namespace, max_size=INLINE_MAX_SIZE):
+    """
+    Inline calls to helpers in code. Calls are resolved against namespace.
+    Only calls in the original tree are inlined. Calls brought in by an
+    inlined body are left alone.
+    """
+    # the tree may have changed since a cached table was built
+    table = SymbolTable(code)
+    taken = set()
+    for node in ast.walk(code):
+        if isinstance(node, ast.Name):
+            taken.add(node.id)
+        elif isinstance(node, ast.arg):
+            taken.add(node.arg)
+
+    inliner = Inliner(namespace, table, taken, max_size)
+    transform(code, inliner)
+    ast.fix_missing_locations(code)
+    return code
+
+
+def func_inline(func=None, max_size=INLINE_MAX_SIZE):
+    """
+    Decorator that inlines helpers called by func. Helpers are looked up in
+    the globals of func when it's decorated.
+
+        @func_inline
+        def hot(): ...
+
+        @func_inline(max_size=100)
+        def hot(): ...
+    """
+    def _wrapper(func):
+        def _transform(code):
+            return inline_calls(code, func.__globals__, max_size=max_size)
+        return func_rewrite(_transform)(func)
+
+    if func is None:
+        return _wrapper
+    return _wrapper(func)
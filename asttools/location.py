@@ -0,0 +1,135 @@
+"""
+Source location index.
+
+Build once over the lineno/col_offset/end_lineno/end_col_offset of a tree and
+answer "which node is at line L col C" without walking the tree again.
+
+    index = LocationIndex(code)
+    index.node_at(3, 10)       # innermost node at that position
+    index.nodes_in((3, 0), (5, 0))
+    index.statement(node)      # top level statement that holds node
+
+Positions are (lineno, col_offset) tuples. Like the ast, lines are 1 based,
+columns are 0 based utf-8 byte offsets, and end positions are exclusive.
+"""
+import ast
+from bisect import bisect_left, bisect_right
+
+from .common import node_fields
+
+
+class LocationIndex:
+    def __init__(self, code):
+        if isinstance(code, str):
+            code = ast.parse(code)
+        self.code = code
+
+        if isinstance(code, ast.Module):
+            body = code.body
+        else:
+            body = [code]
+
+        entries = []
+        statements = {}
+        for statement in body:
+            for node, depth in _walk_depth(statement):
+                statements[node] = statement
+                if getattr(node, 'end_lineno', None) is None:
+                    # ctx, operators, ast.arguments, etc
+                    continue
+                start = (node.lineno, node.col_offset)
+                end = (node.end_lineno, node.end_col_offset)
+                entries.append((start, end, depth, node))
+
+        # outer nodes first when starts are equal
+        entries.sort(key=lambda e: (e[0], -e[1][0], -e[1][1], e[2]))
+
+        self._starts = [e[0] for e in entries]
+        self._ends = [e[1] for e in entries]
+        self._nodes = [e[3] for e in entries]
+        self._positions = {node: i for i, node in enumerate(self._nodes)}
+        self._statements = statements
+        self._parents = _interval_parents(self._starts, self._ends)
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def span(self, node):
+        """ (start, end) positions of node """
+        i = self._positions[node]
+        return self._starts[i], self._ends[i]
+
+    def node_at(self, lineno, col_offset=0):
+        """
+        Innermost node whose span contains the position. None if no node
+        does.
+
+        Binary search for the last node that starts at or before the
+        position, then step out through its enclosing spans.
+        """
+        point = (lineno, col_offset)
+        i = bisect_right(self._starts, point) - 1
+        ends = self._ends
+        parents = self._parents
+        while i >= 0:
+            if point < ends[i]:
+                return self._nodes[i]
+            i = parents[i]
+        return None
+
+    def nodes_in(self, start, end):
+        """
+        Nodes whose span is within [start, end), in source order.
+        """
+        lo = bisect_left(self._starts, start)
+        hi = bisect_left(self._starts, end)
+        ends = self._ends
+        nodes = self._nodes
+        return [nodes[i] for i in range(lo, hi) if ends[i] <= end]
+
+    def enclosing(self, node):
+        """
+        Innermost node whose span contains the span of node.
+        """
+        i = self._parents[self._positions[node]]
+        if i < 0:
+            return None
+        return self._nodes[i]
+
+    def statement(self, node):
+        """
+        Top level statement that contains node.
+        """
+        return self._statements[node]
+
+
+def _walk_depth(node):
+    stack = [(node, 0)]
+    while stack:
+        node, depth = stack.pop()
+        yield node, depth
+
+        for field_name in node_fields(type(node)):
+            value = getattr(node, field_name, None)
+            if isinstance(value, ast.AST):
+                stack.append((value, depth + 1))
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, ast.AST):
+                        stack.append((item, depth + 1))
+
+
+def _interval_parents(starts, ends):
+    """
+    Index of the innermost enclosing interval for each interval. -1 for
+    intervals that aren't contained by any other. Expects intervals sorted
+    by start with outer intervals first.
+    """
+    parents = []
+    stack = []
+    for i, (start, end) in enumerate(zip(starts, ends)):
+        while stack and not (end <= ends[stack[-1]]):
+            stack.pop()
+        parents.append(stack[-1] if stack else -1)
+        stack.append(i)
+    return parents
@@ -1,4 +1,7 @@
 import ast
+import functools
+import inspect
+import re
 from .common import quick_parse, iter_fields
 
 """
@@ -10,38 +13,134 @@ for node in ast.walk(test):
     if matcher.match(node):
         node.kwargs = quick_parse("locals()").value
         node.func.attr = 'format'
+
+Named wildcards like _any_x_ match the same things as _any_ and capture
+what they matched:
+
+matcher = Matcher("_any_left_ * 2")
+matcher.captures(quick_parse("df['a'] * 2").value)
+# {'left': <ast.Subscript>}
 """
 
 _missing = object()
 
+_capture_pattern = re.compile(r'^_any_(\w+)_$')
+
+
+def capture_name(val):
+    """ name of a named wildcard like _any_x_. None for anything else """
+    if isinstance(val, str):
+        match = _capture_pattern.match(val)
+        if match is not None:
+            return match.group(1)
+        return None
+
+    # ast.Call.args, ast.With.body
+    if isinstance(val, list) and len(val) == 1:
+        return capture_name(val[0])
+
+    if isinstance(val, ast.Name):
+        return capture_name(val.id)
+    if isinstance(val, ast.Expr):
+        return capture_name(val.value)
+    return None
+
+
+def _same_capture(left, right):
+    if isinstance(left, list):
+        return isinstance(right, list) and len(left) == len(right) \
+            and all(map(_same_capture, left, right))
+    if isinstance(left, ast.AST):
+        return isinstance(right, ast.AST) and ast.dump(left) == ast.dump(right)
+    return left == right
+
+
+@functools.lru_cache(maxsize=None)
+def _takes_bindings(func):
+    """ whether a match_* hook takes bindings. Older overrides don't """
+    try:
+        params = inspect.signature(func).parameters
+    except (TypeError, ValueError):
+        return False
+    return 'bindings' in params or any(
+        param.kind == param.VAR_KEYWORD for param in params.values()
+    )
+
 
 def is_any(val):
     # string match
     if val in ['<any>', '_any_']:
         return True
 
+    if isinstance(val, str):
+        return _capture_pattern.match(val) is not None
+
     # ast.Call.args, ast.With.
     if isinstance(val, list) and len(val) == 1:
         return is_any(val[0])
 
-    if isinstance(val, ast.Name) and val.id == '_any_':
+    if isinstance(val, ast.Name) and is_any(val.id):
         return True
     return False
 
 
 class Matcher:
-    def __init__(self, template):
+    """
+    Thread safety: the template is never mutated and the match state lives
+    on the stack, so a Matcher can be shared between threads. With verbose
+    on, the logs of concurrent matches are interleaved.
+
+    Named wildcards are bound in a dict that is passed down the match, see
+    captures. A name used more than once has to match equal subtrees.
+
+    verbose : bool
+        record every comparison in logs. Off by default since logs would
+        otherwise grow with every match.
+    """
+    def __init__(self, template, verbose=False):
         if isinstance(template, str):
             template = quick_parse(template)
             if isinstance(template, ast.Expr):
                 template = template.value
         self.template = template
+        self.verbose = verbose
         self.logs = []
+        self.capture_names = {
+            name for name in map(capture_name, _template_values(template))
+            if name is not None
+        }
 
     def log(self, *entry):
-        self.logs.append(entry)
+        if self.verbose:
+            self.logs.append(entry)
+
+    def captures(self, other):
+        """
+        {name: matched} for the named wildcards if other matches. None if it
+        doesn't. Wildcards in list fields like call args capture the list.
+        """
+        bindings = {}
+        if self.match(other, bindings=bindings):
+            return bindings
+        return None
 
-    def match(self, other, node=_missing):
+    def bind(self, bindings, template, other):
+        """
+        Bind other if template is a named wildcard. False if the name was
+        already bound to something else.
+        """
+        if bindings is None:
+            return True
+        name = capture_name(template)
+        if name is None:
+            return True
+        bound = bindings.get(name, _missing)
+        if bound is _missing:
+            bindings[name] = other
+            return True
+        return _same_capture(bound, other)
+
+    def match(self, other, node=_missing, bindings=None):
         if node is _missing:  # first run
             node = self.template
             # unwrap expression
@@ -51,13 +150,18 @@ class Matcher:
         method = 'match_' + node.__class__.__name__
         matcher = getattr(self, method, self.generic_match)
 
-        node_item = matcher(other, node)
+        if bindings is not None and _takes_bindings(
+            getattr(matcher, '__func__', matcher)
+        ):
+            node_item = matcher(other, node, bindings=bindings)
+        else:
+            node_item = matcher(other, node)
 
         self.log('MATCHER', matcher.__name__, node, other)
 
         return node_item
 
-    def generic_match(self, other, node):
+    def generic_match(self, other, node, bindings=None):
         if type(node) != type(other):
             return False
 
@@ -65,12 +169,20 @@ class Matcher:
         if not isinstance(node, ast.AST):
             return node == other
 
-        return self.match_children(other, node)
+        return self.match_children(other, node, bindings=bindings)
 
-    def match_children(self, other, node, skip=()):
+    def match_children(self, other, node, skip=(), bindings=None):
         if not isinstance(node, ast.AST):
             return True
 
+        if skip and bindings is not None:
+            # skipped fields are wildcards
+            for field_name, value in ast.iter_fields(node):
+                if field_name in skip and not self.bind(
+                    bindings, value, getattr(other, field_name, None)
+                ):
+                    return False
+
         for item, field_name, field_index in iter_fields(node):
             # we still try to grab other's child to make sure we have the same
             # structure.
@@ -86,20 +198,21 @@ class Matcher:
                 continue
 
             # children did not match, short circuit out of here
-            matched = self.match(other_child, item)
+            matched = self.match(other_child, item, bindings)
 
-            self.log(
-                'match_children',
-                other_child,
-                item,
-                f'{field_name}[{field_index}], matched: {matched}',
-            )
+            if self.verbose:
+                self.log(
+                    'match_children',
+                    other_child,
+                    item,
+                    f'{field_name}[{field_index}], matched: {matched}',
+                )
 
             if not matched:
                 return False
         return True
 
-    def match_Name(self, other, node):
+    def match_Name(self, other, node, bindings=None):
         """
         TODO: determine if this is too broad. Previously I only matched
         ast.Name if it was a child in certain spots i.e. Attribute / Call.
@@ -110,34 +223,40 @@ class Matcher:
         Since _any_ is top level, it whitelists anything it compares to.
         """
         if is_any(node.id):
-            return True
-        return self.match_children(other, node)
+            return self.bind(bindings, node.id, other)
+        return self.match_children(other, node, bindings=bindings)
 
-    def match_Constant(self, other, node):
-        if is_any(node.s):
-            return True
-        return self.match_children(other, node)
+    def match_Constant(self, other, node, bindings=None):
+        if is_any(node.value):
+            return self.bind(bindings, node.value, other)
+        return self.match_children(other, node, bindings=bindings)
 
-    def match_Attribute(self, other, node):
-        skip = ()
-        if node.attr == '_any_':
-            skip = ('attr')
-        if isinstance(node.value, ast.Name) and node.value.id == '_any_':
-            skip = ('value')
+    def match_Attribute(self, other, node, bindings=None):
+        skip = []
+        if is_any(node.attr):
+            skip.append('attr')
+        if isinstance(node.value, ast.Name) and is_any(node.value.id):
+            skip.append('value')
 
-        return self.match_children(other, node, skip=skip)
+        return self.match_children(other, node, skip=skip, bindings=bindings)
 
-    def match_Call(self, other, node):
+    def match_Call(self, other, node, bindings=None):
         """
         TODO: should support partial match?
         call(_any_)
+
+        A named wildcard only captures the args, so call(_any_args_) doesn't
+        match calls with keywords. Otherwise they'd be lost on a rewrite.
         """
         skip = ()
         if is_any(node.args):
+            if capture_name(node.args) is not None \
+               and getattr(other, 'keywords', None):
+                return False
             skip = ('args', 'keywords', 'starargs', 'kwargs')
-        return self.match_children(other, node, skip=skip)
+        return self.match_children(other, node, skip=skip, bindings=bindings)
 
-    def match_With(self, other, node):
+    def match_With(self, other, node, bindings=None):
         """
         with With():
             _any_
@@ -147,42 +266,51 @@ class Matcher:
         line = body[0]
         if len(body) == 1 and isinstance(line, ast.Expr) \
            and is_any(line.value):
-            skip = ('body')
+            skip = ('body',)
 
-        return self.match_children(other, node, skip=skip)
+        return self.match_children(other, node, skip=skip, bindings=bindings)
 
-    def match_Subscript(self, other, node):
+    def match_Subscript(self, other, node, bindings=None):
         sl = node.slice
         skip = ()
 
         # ast.Index is scheduled for deprecation
         if isinstance(sl, ast.Index) and isinstance(sl.value, ast.Name)\
            and sl.value.id == '_any_':
-            skip = ('slice')
+            skip = ('slice',)
 
         # python 3.9 now represents simple indices by their values.
-        if isinstance(sl, ast.Name) and sl.id == '_any_':
-            skip = ('slice')
+        if isinstance(sl, ast.Name) and is_any(sl.id):
+            skip = ('slice',)
 
-        return self.match_children(other, node, skip=skip)
+        return self.match_children(other, node, skip=skip, bindings=bindings)
 
-    def match_UnaryOp(self, other, node):
+    def match_UnaryOp(self, other, node, bindings=None):
         skip = ()
         if is_any(node.operand):
-            skip = ('operand')
+            skip = ('operand',)
 
-        return self.match_children(other, node, skip=skip)
+        return self.match_children(other, node, skip=skip, bindings=bindings)
 
-    def match_BinOp(self, other, node):
+    def match_BinOp(self, other, node, bindings=None):
         skip = []
         if is_any(node.left):
             skip.append(('left'))
         if is_any(node.right):
             skip.append(('right'))
 
-        return self.match_children(other, node, skip=skip)
+        return self.match_children(other, node, skip=skip, bindings=bindings)
 
     def __eq__(self, other):
         if not isinstance(other, ast.AST):
             raise TypeError("Can only compare to AST")
         return self.match(other)
+
+
+def _template_values(template):
+    """ nodes, and the str fields of nodes, in template """
+    for node in ast.walk(template):
+        yield node
+        for _, value in ast.iter_fields(node):
+            if isinstance(value, str):
+                yield value
@@ -0,0 +1,1200 @@
+"""
+Constant folding and dead code elimination.
+
+    @func_rewrite(fold_constants)
+    def hot(x):
+        if DEBUG:
+            log(x)
+        return x * (60 * 60)
+
+fold_constants folds constant expressions, removes branches that can never
+run and drops statements after a return/raise/break/continue. Given a dict of
+constants (see module_constants), global loads of those names are inlined
+first so that branches on them can be pruned too.
+"""
+import ast
+import copy
+import operator
+from textwrap import dedent
+
+from .common import get_source, node_fields
+from .scope import SymbolTable, invalidate_symbol_tables
+from .transform import EagerTransformer, transform
+
+_binops = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.MatMult: operator.matmul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.LShift: operator.lshift,
+    ast.RShift: operator.rshift,
+    ast.BitOr: operator.or_,
+    ast.BitXor: operator.xor,
+    ast.BitAnd: operator.and_,
+}
+
+_unaryops = {
+    ast.Not: operator.not_,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    ast.Invert: operator.invert,
+}
+
+# `is` is only folded for singletons. the identity of other constants is
+# an implementation detail.
+_singletons = (None, True, False, Ellipsis)
+
+_cmpops = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+    ast.Is: operator.is_,
+    ast.IsNot: operator.is_not,
+}
+
+# don't fold into huge constants. i.e. 'a' * 10 ** 9
+MAX_FOLDED_SIZE = 4096
+
+_terminal_stmts = (ast.Return, ast.Raise, ast.Continue, ast.Break)
+
+
+def is_constant(node):
+    return type(node) is ast.Constant
+
+
+def _safe_value(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value.bit_length() <= MAX_FOLDED_SIZE
+    if isinstance(value, (str, bytes, tuple, frozenset)):
+        return len(value) <= MAX_FOLDED_SIZE
+    return isinstance(value, (float, complex, bool, type(None)))
+
+
+def _is_singleton(value):
+    return any(value is singleton for singleton in _singletons)
+
+
+def _constant(value, node):
+    return ast.copy_location(ast.Constant(value=value), node)
+
+
+def _changes_function(stmts):
+    """
+    Would dropping stmts change the enclosing function? Dropping the only
+    yield turns a generator into a function and global/nonlocal change the
+    scope of names.
+    """
+    unsafe = (ast.Yield, ast.YieldFrom, ast.Await, ast.Global, ast.Nonlocal)
+    stack = list(stmts)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, unsafe):
+            return True
+        # nested scopes don't affect us
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef,
+                             ast.ClassDef, ast.Lambda)):
+            continue
+        stack.extend(ast.iter_child_nodes(node))
+    return False
+
+
+_block_scopes = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+_comprehensions = (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)
+
+
+def _bound_names(nodes, skip_dead=False):
+    """
+    Names that nodes bind in their own scope. Only walrus targets count
+    inside comprehensions.
+
+    skip_dead : bool
+        leave out what's bound in dead blocks. See _dead_block.
+    """
+    names = set()
+    stack = [(node, False) for node in nodes]
+    while stack:
+        node, in_comprehension = stack.pop()
+        if skip_dead and _is_dead_block(node):
+            continue
+
+        if isinstance(node, ast.Name):
+            if not in_comprehension and not isinstance(node.ctx, ast.Load):
+                names.add(node.id)
+            continue
+        if isinstance(node, ast.NamedExpr):
+            names.add(node.target.id)
+        elif in_comprehension:
+            pass
+        elif isinstance(node, _block_scopes):
+            names.add(node.name)
+            continue
+        elif isinstance(node, ast.Lambda):
+            continue
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names.update(
+                alias.asname or alias.name.split('.')[0]
+                for alias in node.names if alias.name != '*'
+            )
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, (ast.ExceptHandler, ast.MatchAs,
+                               ast.MatchStar)):
+            if node.name:
+                names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+
+        in_comprehension = in_comprehension \
+            or isinstance(node, _comprehensions)
+        stack.extend(
+            (child, in_comprehension) for child in ast.iter_child_nodes(node)
+        )
+    return names
+
+
+def _dead_block(stmts):
+    """
+    Dead statements that bind names can't just be deleted, they still make
+    those names local to the function. They're kept under an if 0: instead,
+    which the compiler drops.
+    """
+    block = ast.If(test=_constant(0, stmts[0]), body=stmts, orelse=[])
+    return ast.copy_location(block, stmts[0])
+
+
+def _is_dead_block(node):
+    return isinstance(node, ast.If) and is_constant(node.test) \
+        and not node.test.value and not node.orelse
+
+
+def _drop_dead_blocks(node):
+    """
+    Remove the dead blocks of the scope of node that no longer matter. At
+    module and class level nothing is made local, so they all go. In a
+    function they go once everything they bind is also bound elsewhere.
+    """
+    live = None
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        args = node.args
+        live = {
+            arg.arg for arg in
+            args.posonlyargs + args.args + args.kwonlyargs
+            + [args.vararg, args.kwarg] if arg is not None
+        }
+        live |= _bound_names(node.body, skip_dead=True)
+
+    stack = [node]
+    while stack:
+        parent = stack.pop()
+        for field_name in ('body', 'orelse', 'finalbody', 'handlers',
+                           'cases'):
+            stmts = getattr(parent, field_name, None)
+            if not isinstance(stmts, list) or not stmts:
+                continue
+            new_stmts = [
+                stmt for stmt in stmts
+                if not _is_dead_block(stmt) or _changes_function(stmt.body)
+                or live is not None and not _bound_names(stmt.body) <= live
+            ]
+            if len(new_stmts) != len(stmts):
+                if not new_stmts and field_name == 'body' \
+                   and not isinstance(parent, ast.Module):
+                    new_stmts = [ast.copy_location(ast.Pass(), stmts[0])]
+                setattr(parent, field_name, new_stmts)
+            stack.extend(
+                stmt for stmt in new_stmts
+                if not isinstance(stmt, _block_scopes)
+            )
+
+
+class ConstantFolder(EagerTransformer):
+    """
+    Transformer for transform. Expressions are folded bottom up, so by the
+    time a node is visited its children are already folded.
+
+    constants : dict
+        {name: value} of globals to inline
+    symbols : SymbolTable
+        used to only inline names that resolve to globals
+    """
+    def __init__(self, constants=None, symbols=None):
+        super().__init__()
+        self.constants = constants or {}
+        self.symbols = symbols
+
+    def visit_Name(self, node, meta):
+        if not isinstance(node.ctx, ast.Load):
+            return node
+
+        name = node.id
+        if name not in self.constants:
+            return node
+
+        if self.symbols is not None:
+            scope = self.symbols.scope_of(node)
+            if name not in scope.globals:
+                return node
+
+        value = self.constants[name]
+        if not _safe_value(value):
+            return node
+        return _constant(value, node)
+
+    def visit_BinOp(self, node, meta):
+        left = node.left
+        right = node.right
+        if not (is_constant(left) and is_constant(right)):
+            return node
+
+        func = _binops.get(type(node.op))
+        if func is None:
+            return node
+
+        # 2 ** 100000 would take a while just to be rejected
+        if isinstance(node.op, (ast.Pow, ast.LShift)) \
+           and isinstance(right.value, int) \
+           and abs(right.value) > MAX_FOLDED_SIZE:
+            return node
+
+        try:
+            value = func(left.value, right.value)
+        except Exception:
+            # leave it for runtime to raise
+            return node
+
+        if not _safe_value(value):
+            return node
+        return _constant(value, node)
+
+    def visit_UnaryOp(self, node, meta):
+        if not is_constant(node.operand):
+            return node
+
+        try:
+            value = _unaryops[type(node.op)](node.operand.value)
+        except Exception:
+            return node
+
+        if not _safe_value(value):
+            return node
+        return _constant(value, node)
+
+    def visit_BoolOp(self, node, meta):
+        is_and = isinstance(node.op, ast.And)
+        values = list(node.values)
+        # leading constants either decide the result or can be dropped
+        while len(values) > 1 and is_constant(values[0]):
+            truthy = bool(values[0].value)
+            if truthy != is_and:
+                return values[0]
+            values.pop(0)
+
+        if len(values) == 1:
+            return values[0]
+
+        if len(values) != len(node.values):
+            node.values = values
+        return node
+
+    def visit_Compare(self, node, meta):
+        operands = [node.left] + node.comparators
+        if not all(map(is_constant, operands)):
+            return node
+
+        result = True
+        for op, left, right in zip(node.ops, operands, operands[1:]):
+            func = _cmpops.get(type(op))
+            if func is None:
+                return node
+            if isinstance(op, (ast.Is, ast.IsNot)) \
+               and not _is_singleton(left.value) \
+               and not _is_singleton(right.value):
+                return node
+            try:
+                result = func(left.value, right.value)
+            except Exception:
+                return node
+            if not result:
+                break
+
+        if not isinstance(result, bool):
+            return node
+        return _constant(result, node)
+
+    def visit_IfExp(self, node, meta):
+        if not is_constant(node.test):
+            return node
+        if node.test.value:
+            return node.body
+        return node.orelse
+
+    def prune_blocks(self, node):
+        """
+        Remove dead statements from the statement lists of node.
+
+        The children of node have already been folded at this point.
+        """
+        for field_name in ('body', 'orelse', 'finalbody'):
+            stmts = getattr(node, field_name, None)
+            if not isinstance(stmts, list) or not stmts:
+                continue
+            if not isinstance(stmts[0], ast.stmt):
+                continue
+
+            new_stmts = prune_stmts(stmts)
+            if new_stmts is stmts:
+                continue
+
+            if not new_stmts and field_name == 'body' \
+               and not isinstance(node, ast.Module):
+                new_stmts = [ast.copy_location(ast.Pass(), stmts[0])]
+            setattr(node, field_name, new_stmts)
+
+        if isinstance(node, _block_scopes + (ast.Module,)):
+            _drop_dead_blocks(node)
+
+    visit_blocks = prune_blocks
+
+
+def prune_stmts(stmts):
+    """
+    Returns stmts with constant if/while branches resolved and statements
+    after a return/raise/break/continue removed. Returns the same list if
+    nothing changed. Removed statements that bind names are kept as a dead
+    block until their scope is done, see _drop_dead_blocks.
+    """
+    new_stmts = []
+    changed = False
+    for i, stmt in enumerate(stmts):
+        replacement = _dead_branch_replacement(stmt)
+        if replacement is None:
+            new_stmts.append(stmt)
+        else:
+            new_stmts.extend(replacement)
+            changed = True
+
+        if new_stmts and is_terminal(new_stmts[-1]):
+            rest = stmts[i+1:]
+            if rest and not _changes_function(rest):
+                if _bound_names(rest):
+                    if len(rest) == 1 and _is_dead_block(rest[0]):
+                        new_stmts.extend(rest)
+                        break
+                    new_stmts.append(_dead_block(rest))
+                changed = True
+                break
+            if rest:
+                new_stmts.extend(rest)
+                break
+
+    if not changed:
+        return stmts
+    return new_stmts
+
+
+def is_terminal(stmt):
+    """
+    Whether control never falls through to the statement after stmt.
+    """
+    if isinstance(stmt, _terminal_stmts):
+        return True
+    if isinstance(stmt, ast.If) and stmt.orelse:
+        return is_terminal(stmt.body[-1]) and is_terminal(stmt.orelse[-1])
+    return False
+
+
+def _dead_branch_replacement(stmt):
+    """
+    Statements that replace stmt when its branch is decided by a constant.
+    None if it can't be replaced.
+    """
+    test = getattr(stmt, 'test', None)
+    if not is_constant(test) or _is_dead_block(stmt) and _bound_names([stmt]):
+        return None
+
+    if isinstance(stmt, ast.If):
+        if test.value:
+            keep, drop = stmt.body, stmt.orelse
+        else:
+            keep, drop = stmt.orelse, stmt.body
+    elif isinstance(stmt, ast.While) and not test.value:
+        keep, drop = stmt.orelse, stmt.body
+    else:
+        return None
+
+    if _changes_function(drop):
+        return None
+    if _bound_names(drop):
+        return keep + [_dead_block(drop)]
+    return keep
+
+
+def module_constants(module):
+    """
+    Simple module level constants. {name: value}
+
+    A name counts if it's assigned a literal once at the top level of the
+    module and is never bound anywhere else.
+
+    module : ast.Module, module object or source string
+    """
+    if isinstance(module, str):
+        module = ast.parse(module)
+    elif not isinstance(module, ast.AST):
+        module = ast.parse(get_source(module))
+
+    candidates = {}
+    for stmt in module.body:
+        if not isinstance(stmt, ast.Assign) or len(stmt.targets) != 1:
+            continue
+        target = stmt.targets[0]
+        if not isinstance(target, ast.Name):
+            continue
+        try:
+            value = ast.literal_eval(fold_expression(stmt.value))
+        except (ValueError, TypeError, SyntaxError):
+            continue
+        if isinstance(value, (list, dict, set)):
+            # mutable
+            continue
+        candidates[target.id] = value
+
+    if not candidates:
+        return candidates
+
+    # any other binding disqualifies the name
+    counts = dict.fromkeys(candidates, 0)
+    for node in ast.walk(module):
+        names = ()
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            names = (node.id,)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef,
+                               ast.ClassDef)):
+            names = (node.name,)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names = [
+                alias.asname or alias.name.split('.')[0]
+                for alias in node.names
+            ]
+        elif isinstance(node, ast.Global):
+            # global X in a function means it can be rebound at runtime
+            names = node.names
+        for name in names:
+            if name in counts:
+                counts[name] += 1
+
+    return {
+        name: value for name, value in candidates.items()
+        if counts[name] == 1
+    }
+
+
+def fold_expression(node, constants=None):
+    """
+    Folded copy of an expression node. The original is left alone.
+    """
+    node = copy.deepcopy(node)
+    folder = ConstantFolder(constants)
+    transform(node, folder)
+    return folder.replaced.get(node, node)
+
+
+def fold_constants(code, constants=None):
+    """
+    Fold constant expressions and remove dead code in place. Can be passed
+    straight to func_rewrite.
+
+    constants : dict
+        {name: value} of globals to inline. See module_constants.
+    """
+    symbols = None
+    if constants:
+        symbols = SymbolTable(code)
+    folder = ConstantFolder(constants, symbols)
+    transform(code, folder)
+    # transform doesn't visit the root Module
+    folder.prune_blocks(code)
+    invalidate_symbol_tables()
+    return code
+
+
+_scope_nodes = (
+    ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda,
+    ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp,
+)
+
+_loop_nodes = (ast.For, ast.AsyncFor, ast.While)
+
+# zero argument super() needs to see its own name
+_unhoistable = {'super'}
+
+# parents that only read the value of an attribute chain
+_read_parents = (
+    ast.BinOp, ast.UnaryOp, ast.Compare, ast.BoolOp, ast.IfExp,
+    ast.Subscript, ast.FormattedValue,
+)
+
+
+def _child_slots(node):
+    """ (child, field_name, field_index) for the ast children of node """
+    for field_name in node_fields(type(node)):
+        value = getattr(node, field_name, None)
+        if isinstance(value, ast.AST):
+            yield value, field_name, None
+        elif isinstance(value, list):
+            for i, item in enumerate(value):
+                if isinstance(item, ast.AST):
+                    yield item, field_name, i
+
+
+def _outer_loops(node):
+    """
+    (parent, field_name, field_index, loop) for loops that aren't inside
+    another loop. Nested scopes are not entered.
+    """
+    for child, field_name, field_index in _child_slots(node):
+        if isinstance(child, _loop_nodes):
+            yield node, field_name, field_index, child
+        elif not isinstance(child, _scope_nodes):
+            yield from _outer_loops(child)
+
+
+def _attribute_chain(node):
+    """
+    (root_name, dotted) for a pure load like np.linalg.norm. None otherwise.
+    """
+    attrs = []
+    while isinstance(node, ast.Attribute):
+        if not isinstance(node.ctx, ast.Load):
+            return None
+        attrs.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name) or not isinstance(node.ctx, ast.Load):
+        return None
+    attrs.append(node.id)
+    return node.id, '.'.join(reversed(attrs))
+
+
+def _attribute_root(node):
+    while isinstance(node, (ast.Attribute, ast.Subscript)):
+        node = node.value
+    if isinstance(node, ast.Name):
+        return node.id
+
+
+def _set_slot(parent, field_name, field_index, value):
+    if field_index is None:
+        setattr(parent, field_name, value)
+    else:
+        getattr(parent, field_name)[field_index] = value
+
+
+class LoopLookups:
+    """
+    Name and attribute loads within a loop.
+
+    names : {name: [slot]}
+    chains : {dotted: (root_name, [slot])}
+    data_chains : chains that are used as something other than a callable
+    opaque_calls : whether the loop calls anything not in PURE_CALLS. Such
+        a call could change any attribute it can reach.
+    stored : names bound within the loop
+    escaped : names whose object could be mutated within the loop. i.e. it
+        is passed bare, has a method called at any depth, an attribute
+        assigned or an attribute chain passed or aliased.
+
+    where slot is (parent, field_name, field_index)
+
+    With attributes off, attribute chains aren't collected and their root
+    names count as plain loads.
+    """
+    def __init__(self, loop, attributes=True):
+        self.attributes = attributes
+        self.names = {}
+        self.chains = {}
+        self.data_chains = set()
+        self.opaque_calls = False
+        self.stored = set()
+        self.escaped = set()
+        self.visit(loop, None, None, None)
+
+    def visit(self, node, parent, field_name, field_index):
+        if isinstance(node, _scope_nodes):
+            # anything a nested scope touches could be changed by calling it
+            for sub in ast.walk(node):
+                if isinstance(sub, ast.Name):
+                    self.escaped.add(sub.id)
+            return
+
+        slot = (parent, field_name, field_index)
+
+        if isinstance(node, ast.Call) \
+           and _dotted_name(node.func) not in PURE_CALLS:
+            self.opaque_calls = True
+
+        if isinstance(node, ast.Attribute) and self.attributes:
+            chain = _attribute_chain(node)
+            if chain is not None:
+                root, dotted = chain
+                self.chains.setdefault(dotted, (root, []))[1].append(slot)
+                is_call = isinstance(parent, ast.Call) and field_name == 'func'
+                if not is_call:
+                    self.data_chains.add(dotted)
+                # root.a.method() can rebind attributes of root.a and an
+                # object that's passed on or aliased can be changed by
+                # whatever gets it
+                if is_call or not isinstance(parent, _read_parents):
+                    self.escaped.add(root)
+                return
+            root = _attribute_root(node)
+            if root is not None and not isinstance(node.ctx, ast.Load):
+                self.escaped.add(root)
+
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                self.names.setdefault(node.id, []).append(slot)
+            else:
+                self.stored.add(node.id)
+            return
+
+        for child, child_field, child_index in _child_slots(node):
+            self.visit(child, node, child_field, child_index)
+
+
+def hoist_lookups(code, attributes=True):
+    """
+    Bind global, builtin and attribute lookups used in loops to locals
+    before the loop. Can be passed straight to func_rewrite.
+
+        for row in rows:
+            total += np.sum(row) + len(row)
+
+    becomes
+
+        try:
+            _np_sum = np.sum
+            _len = len
+            _hoisted = True
+        except Exception:
+            _hoisted = False
+        if _hoisted:
+            for row in rows:
+                total += _np_sum(row) + _len(row)
+        else:
+            <original loop>
+
+    A global is hoisted if nothing in the tree rebinds it. Attribute chains
+    on a global that are only called, i.e. np.sum, are assumed not to
+    change while the loop runs. Other chains on a global, and any chain on
+    a local (i.e. self.x), are only hoisted if the loop only calls
+    PURE_CALLS and the root isn't rebound in the loop, passed bare, used by
+    a nested scope, has a method called on it at any depth or has an
+    attribute chain passed on or aliased.
+
+    The lookups run once before the loop. If one fails, the original loop
+    runs instead and raises where it used to.
+
+    attributes : bool
+        hoist attribute lookups as well as names
+    """
+    table = SymbolTable(code)
+    declared_globals = set()
+    for scope in table.scopes.values():
+        declared_globals.update(scope.declared_globals)
+
+    taken = set()
+    for node in ast.walk(code):
+        if isinstance(node, ast.Name):
+            taken.add(node.id)
+        elif isinstance(node, ast.arg):
+            taken.add(node.arg)
+
+    for node, scope in list(table.scopes.items()):
+        if scope.kind != 'function':
+            continue
+
+        # locals that nested scopes can rebind
+        nonlocals = set()
+        stack = list(scope.children)
+        while stack:
+            child = stack.pop()
+            nonlocals.update(child.nonlocals)
+            stack.extend(child.children)
+
+        # last first so that splicing in the guard doesn't move the loops
+        # still to be done
+        loops = list(_outer_loops(node))
+        for parent, field_name, field_index, loop in reversed(loops):
+            _hoist_loop(
+                loop,
+                (parent, field_name, field_index),
+                scope,
+                declared_globals,
+                nonlocals,
+                attributes,
+                taken,
+            )
+    invalidate_symbol_tables()
+    return code
+
+
+def _is_hoistable_global(name, scope, declared_globals):
+    return (
+        name in scope.globals
+        and name not in scope.bindings
+        and name not in declared_globals
+        and name not in _unhoistable
+    )
+
+
+def _hoist_loop(loop, loop_slot, scope, declared_globals, nonlocals,
+                attributes, taken):
+    lookups = LoopLookups(loop, attributes)
+    local_names = scope.locals - nonlocals
+
+    def is_global(name):
+        return _is_hoistable_global(name, scope, declared_globals)
+
+    hoisted = []
+    for name, slots in lookups.names.items():
+        if is_global(name):
+            hoisted.append((name, slots))
+
+    for dotted, (root, slots) in lookups.chains.items():
+        if dotted in lookups.data_chains and lookups.opaque_calls:
+            # i.e. a call to a module function that bumps STATE.x
+            continue
+
+        if is_global(root):
+            # module functions are looked up the same every time but data
+            # on a global object can be changed by the loop
+            mutable = root in lookups.escaped or root in lookups.names
+            if dotted not in lookups.data_chains or not mutable:
+                hoisted.append((dotted, slots))
+            continue
+
+        usable = (
+            root in local_names
+            and root not in lookups.stored
+            and root not in lookups.escaped
+            and root not in lookups.names
+        )
+        if usable:
+            hoisted.append((dotted, slots))
+
+    if not hoisted:
+        return
+
+    fallback = copy.deepcopy(loop)
+
+    assigns = []
+    for dotted, slots in hoisted:
+        local_name = _unique_name('_' + dotted.replace('.', '_'), taken)
+        parent, field_name, field_index = slots[0]
+        if field_index is None:
+            lookup = getattr(parent, field_name)
+        else:
+            lookup = getattr(parent, field_name)[field_index]
+
+        assign = ast.Assign(
+            targets=[ast.Name(id=local_name, ctx=ast.Store())],
+            value=copy.deepcopy(lookup),
+        )
+        assigns.append(ast.copy_location(assign, loop))
+
+        for parent, field_name, field_index in slots:
+            name = ast.Name(id=local_name, ctx=ast.Load())
+            _set_slot(parent, field_name, field_index, name)
+
+    flag = _unique_name('_hoisted', taken)
+    guard_source = dedent("""
+    try:
+        pass
+        {flag} = True
+    except Exception:
+        {flag} = False
+    if {flag}:
+        pass
+    else:
+        pass
+    """).format(flag=flag)
+    guard_try, guard_if = ast.parse(guard_source).body
+    guard_try.body[:1] = assigns
+    guard_if.body = [loop]
+    guard_if.orelse = [fallback]
+
+    parent, field_name, field_index = loop_slot
+    stmts = getattr(parent, field_name)
+    stmts[field_index:field_index+1] = [guard_try, guard_if]
+    for stmt in (guard_try, guard_if):
+        ast.copy_location(stmt, loop)
+        ast.fix_missing_locations(stmt)
+
+
+def _unique_name(base, taken):
+    name = base
+    i = 0
+    while name in taken:
+        i += 1
+        name = '{0}_{1}'.format(base, i)
+    taken.add(name)
+    return name
+
+
+# calls and attributes that common subexpression elimination treats as
+# pure. i.e. they don't change any state and return the same value for the
+# same inputs.
+PURE_CALLS = frozenset([
+    'abs', 'len', 'min', 'max', 'round', 'int', 'float', 'complex', 'bool',
+    'str', 'tuple', 'frozenset', 'isinstance', 'hash',
+    'math.sqrt', 'math.exp', 'math.log', 'math.log10', 'math.sin',
+    'math.cos', 'math.tan', 'math.tanh', 'math.floor', 'math.ceil',
+    'math.fabs', 'math.hypot',
+    'np.sqrt', 'np.exp', 'np.log', 'np.log10', 'np.abs', 'np.sin',
+    'np.cos', 'np.tan', 'np.tanh', 'np.floor', 'np.ceil',
+])
+
+PURE_ATTRIBUTES = frozenset([
+    'shape', 'dtype', 'ndim', 'size', 'T', 'real', 'imag',
+    'values', 'index', 'columns',
+    'math.pi', 'math.e', 'np.pi', 'np.e', 'np.nan', 'np.inf',
+])
+
+_cse_simple_stmts = (
+    ast.Assign, ast.AugAssign, ast.AnnAssign, ast.Expr, ast.Return,
+    ast.Delete, ast.Pass,
+)
+
+# expressions whose value only depends on the names they load
+_name_pure_exprs = (
+    ast.BinOp, ast.UnaryOp, ast.Compare, ast.BoolOp, ast.IfExp,
+    ast.Tuple, ast.Name, ast.Constant,
+)
+
+# expressions whose value also depends on the state of objects
+_state_pure_exprs = (ast.Subscript, ast.Attribute, ast.Call, ast.Slice)
+
+
+def _conditional_nodes(node):
+    """ children of node that might not be evaluated """
+    if isinstance(node, ast.BoolOp):
+        return node.values[1:]
+    if isinstance(node, ast.IfExp):
+        return [node.body, node.orelse]
+    if isinstance(node, ast.Compare):
+        return node.comparators[1:]
+    return []
+
+
+class ExprHasher:
+    """
+    Structural ids of expressions. Every structure gets a small int id made
+    from its node type, scalar fields and the ids of its children, so
+    equal subtrees get equal ids and the whole tree is hashed in one pass.
+
+    pure : {node: (is_pure, depends_on_state, names)}
+    """
+    def __init__(self, pure_calls=PURE_CALLS,
+                 pure_attributes=PURE_ATTRIBUTES):
+        self.pure_calls = pure_calls
+        self.pure_attributes = pure_attributes
+        self.ids = {}
+        self.node_ids = {}
+        self.pure = {}
+        self.sizes = {}
+
+    def visit(self, node):
+        """ id of node. computes the ids of all its children """
+        node_id = self.node_ids.get(node)
+        if node_id is not None:
+            return node_id
+
+        parts = [type(node)]
+        pure = isinstance(node, _name_pure_exprs + _state_pure_exprs) \
+            or isinstance(node, (ast.expr_context, ast.operator,
+                                 ast.unaryop, ast.cmpop, ast.boolop,
+                                 ast.keyword))
+        state = isinstance(node, _state_pure_exprs)
+        names = set()
+        size = 1
+
+        for field_name in node_fields(type(node)):
+            value = getattr(node, field_name, None)
+            if isinstance(value, ast.AST):
+                parts.append(self.visit(value))
+                child_pure, child_state, child_names = self.pure[value]
+                pure = pure and child_pure
+                state = state or child_state
+                names |= child_names
+                size += self.sizes[value]
+            elif isinstance(value, list):
+                items = []
+                for item in value:
+                    if isinstance(item, ast.AST):
+                        items.append(self.visit(item))
+                        child_pure, child_state, child_names = self.pure[item]
+                        pure = pure and child_pure
+                        state = state or child_state
+                        names |= child_names
+                        size += self.sizes[item]
+                    else:
+                        items.append(('scalar', item))
+                parts.append(tuple(items))
+            else:
+                parts.append((type(value), value))
+
+        if isinstance(node, ast.Name):
+            names.add(node.id)
+            pure = pure and isinstance(node.ctx, ast.Load)
+        elif isinstance(node, ast.Call):
+            name = _dotted_name(node.func)
+            pure = pure and name in self.pure_calls
+        elif isinstance(node, ast.Attribute):
+            pure = pure and (
+                node.attr in self.pure_attributes
+                or _dotted_name(node) in self.pure_attributes
+                # the func of a pure call
+                or _dotted_name(node) in self.pure_calls
+            )
+
+        key = tuple(parts)
+        node_id = self.ids.setdefault(key, len(self.ids))
+        self.node_ids[node] = node_id
+        self.pure[node] = (pure, state, frozenset(names))
+        self.sizes[node] = size
+        return node_id
+
+
+def _dotted_name(node):
+    chain = _attribute_chain(node)
+    if chain is not None:
+        return chain[1]
+
+
+class _Group:
+    """ occurrences of the same available expression in a block """
+    def __init__(self, expr_id, index):
+        self.expr_id = expr_id
+        self.first_index = index
+        self.occurrences = []
+
+
+def _stmt_effects(stmt, hasher):
+    """
+    (stored_names, mutates_state) for a simple statement. mutates_state is
+    True when the statement can change the state of an object. i.e. it
+    calls something impure or assigns to a subscript or attribute.
+    """
+    stored = set()
+    mutates = False
+    for node in ast.walk(stmt):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            stored.add(node.id)
+        elif isinstance(node, (ast.Subscript, ast.Attribute)) \
+                and not isinstance(node.ctx, ast.Load):
+            mutates = True
+        elif isinstance(node, ast.Call):
+            if _dotted_name(node.func) not in hasher.pure_calls:
+                mutates = True
+        elif isinstance(node, (ast.Await, ast.Yield, ast.YieldFrom,
+                               ast.NamedExpr)):
+            mutates = True
+    return stored, mutates
+
+
+def _candidates(node, parent, field_name, field_index, out):
+    """
+    (node, parent, field_name, field_index) of expressions that are always
+    evaluated when the statement is. Nested scopes and conditionally
+    evaluated children are skipped.
+    """
+    if isinstance(node, ast.expr):
+        out.append((node, parent, field_name, field_index))
+    if isinstance(node, _scope_nodes):
+        return
+
+    skip = {id(child) for child in _conditional_nodes(node)}
+    for child, child_field, child_index in _child_slots(node):
+        if id(child) in skip:
+            continue
+        if isinstance(child, (ast.expr_context, ast.operator)):
+            continue
+        _candidates(child, node, child_field, child_index, out)
+
+
+def _stmt_expressions(stmt):
+    """ expression roots of a simple statement that are read """
+    if isinstance(stmt, (ast.Assign, ast.AnnAssign, ast.AugAssign,
+                         ast.Expr, ast.Return)):
+        if stmt.value is not None:
+            return [(stmt.value, stmt, 'value', None)]
+    return []
+
+
+def _block_cse(stmts, hasher, taken, min_size):
+    """
+    Eliminate common subexpressions in a run of simple statements. Returns
+    the new statement list.
+    """
+    available = {}
+    groups = []
+
+    for index, stmt in enumerate(stmts):
+        stored, mutates = _stmt_effects(stmt, hasher)
+
+        if mutates:
+            # a store through a subscript or attribute, or an impure call,
+            # can change the object behind any name, i.e. through an alias.
+            # Nothing read before it can be reused and the order of
+            # evaluation within the statement isn't known.
+            available.clear()
+            continue
+
+        found = []
+        for root, parent, field_name, field_index in _stmt_expressions(stmt):
+            _candidates(root, parent, field_name, field_index, found)
+
+        for node, parent, field_name, field_index in found:
+            pure, state, names = hasher.pure[node]
+            if not pure or hasher.sizes[node] < min_size:
+                continue
+            expr_id = hasher.node_ids[node]
+            group = available.get(expr_id)
+            if group is None:
+                group = _Group(expr_id, index)
+                available[expr_id] = group
+                groups.append(group)
+            group.occurrences.append((node, parent, field_name, field_index))
+
+        # stores take effect after the statement is evaluated
+        for expr_id, group in list(available.items()):
+            node = group.occurrences[0][0]
+            _, state, names = hasher.pure[node]
+            if names & stored:
+                del available[expr_id]
+
+    # largest expressions first. smaller ones inside them go along.
+    groups = [g for g in groups if len(g.occurrences) > 1]
+    groups.sort(key=lambda g: -hasher.sizes[g.occurrences[0][0]])
+
+    replaced = set()
+    inserts = {}
+    for group in groups:
+        occurrences = [
+            occ for occ in group.occurrences if id(occ[0]) not in replaced
+        ]
+        if len(occurrences) < 2:
+            continue
+
+        first = occurrences[0][0]
+        temp = _unique_name('_cse', taken)
+        assign = ast.Assign(
+            targets=[ast.Name(id=temp, ctx=ast.Store())],
+            value=copy.deepcopy(first),
+        )
+        ast.copy_location(assign, stmts[group.first_index])
+        ast.fix_missing_locations(assign)
+        inserts.setdefault(group.first_index, []).append(assign)
+
+        for node, parent, field_name, field_index in occurrences:
+            replaced.update(id(sub) for sub in ast.walk(node))
+            name = ast.copy_location(ast.Name(id=temp, ctx=ast.Load()), node)
+            _set_slot(parent, field_name, field_index, name)
+
+    if not inserts:
+        return stmts
+
+    new_stmts = []
+    for index, stmt in enumerate(stmts):
+        new_stmts.extend(inserts.get(index, []))
+        new_stmts.append(stmt)
+    return new_stmts
+
+
+def _cse_blocks(node, hasher, taken, min_size):
+    """ run _block_cse on every basic block in the scope of node """
+    for child, _, _ in list(_child_slots(node)):
+        if not isinstance(child, _scope_nodes):
+            _cse_blocks(child, hasher, taken, min_size)
+
+    for field_name in ('body', 'orelse', 'finalbody'):
+        stmts = getattr(node, field_name, None)
+        if not isinstance(stmts, list) or not stmts:
+            continue
+        if not isinstance(stmts[0], ast.stmt):
+            continue
+
+        new_stmts = []
+        block = []
+        for stmt in stmts + [None]:
+            if isinstance(stmt, _cse_simple_stmts):
+                block.append(stmt)
+                continue
+            if block:
+                new_stmts.extend(_block_cse(block, hasher, taken, min_size))
+                block = []
+            if stmt is not None:
+                new_stmts.append(stmt)
+
+        if len(new_stmts) != len(stmts):
+            setattr(node, field_name, new_stmts)
+
+
+def eliminate_common_subexpressions(code, pure_calls=PURE_CALLS,
+                                    pure_attributes=PURE_ATTRIBUTES,
+                                    min_size=3):
+    """
+    Hoist repeated pure subexpressions into temporaries. Can be passed
+    straight to func_rewrite.
+
+        c = df['a'] * 2 + 1
+        d = df['a'] * 2 - 1
+
+    becomes
+
+        _cse = df['a'] * 2
+        c = _cse + 1
+        d = _cse - 1
+
+    Works per basic block, i.e. runs of simple statements in a function.
+    An expression stays available until a name it reads is rebound. A
+    statement that calls something impure or assigns to a subscript or
+    attribute could mutate any object through an alias, so it drops every
+    expression and none of its own are reused. Only expressions that are
+    always evaluated count, and arithmetic is assumed to have no side
+    effects.
+
+    pure_calls : set of str
+        dotted names of calls treated as pure. i.e. 'len', 'np.sqrt'
+    pure_attributes : set of str
+        attribute names or dotted names treated as pure
+    min_size : int
+        smallest expression, in nodes, worth a temporary
+    """
+    hasher = ExprHasher(pure_calls, pure_attributes)
+    for node in ast.walk(code):
+        if isinstance(node, ast.expr):
+            hasher.visit(node)
+
+    taken = set()
+    for node in ast.walk(code):
+        if isinstance(node, ast.Name):
+            taken.add(node.id)
+        elif isinstance(node, ast.arg):
+            taken.add(node.arg)
+
+    for node in ast.walk(code):
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            _cse_blocks(node, hasher, taken, min_size)
+    invalidate_symbol_tables()
+    return code
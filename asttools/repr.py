@@ -1,27 +1,114 @@
 import ast
+import copy
+import sys
 
-from .graph import graph_walk
+from .common import node_fields
 
-def ast_repr(obj):
+def ast_repr(obj, max_depth=None, max_items=None):
     if isinstance(obj, ast.AST):
         obj_class = obj.__class__.__name__
-        source =  ast_source(obj)
+        source = ast_source(obj, max_depth=max_depth, max_items=max_items)
         return('ast.{obj_class}: {source}'.format(**locals()))
     if isinstance(obj, list):
-        return([ast_repr(o) for o in obj])
+        return([ast_repr(o, max_depth, max_items) for o in obj])
     return obj
 
-def ast_print(*objs):
-    print(*list(ast_repr(obj) for obj in objs))
+def ast_print(*objs, max_depth=None, max_items=None):
+    print(*list(ast_repr(obj, max_depth, max_items) for obj in objs))
 
-def ast_source(obj):
+def ast_source(obj, max_depth=None, max_items=None):
+    """
+    Source of an ast node.
+
+    With max_depth or max_items, an abbreviated source is rendered from the
+    top of the tree only. See abbreviate.
+
+    Renders aren't cached. Nodes are mutated in place all the time and a
+    cache keyed on identity would show stale source, while checking for
+    changes costs a walk of the tree. Abbreviate large trees instead.
+    """
+    if max_depth is not None or max_items is not None:
+        obj = abbreviate(obj, max_depth=max_depth, max_items=max_items)
+    return _unparse(obj)
+
+def _unparse(obj):
     source = ast.unparse(obj)
     return source.strip()
 
+def _placeholder(node):
+    if isinstance(node, ast.stmt):
+        return ast.Expr(value=ast.Constant(value=...))
+    return ast.Name(id='...', ctx=ast.Load())
+
+def abbreviate(node, max_depth=None, max_items=None):
+    """
+    Copy the top of node for abbreviated rendering.
+
+    Expressions and statements deeper than max_depth are replaced with `...`.
+    Lists of expressions and statements longer than max_items are cut off
+    with a trailing `...`. Nodes below the cut off are never visited.
+    """
+    return _abbreviate(node, 0, max_depth, max_items)
+
+def _abbreviate(node, depth, max_depth, max_items):
+    if max_depth is not None and depth >= max_depth:
+        if isinstance(node, (ast.expr, ast.stmt)):
+            return _placeholder(node)
+
+    # f-strings only allow Constant/FormattedValue parts and arguments has
+    # lists that must line up. leave them whole.
+    if isinstance(node, (ast.JoinedStr, ast.arguments)):
+        limit = None
+    else:
+        limit = max_items
+
+    new_node = copy.copy(node)
+    for field_name in node_fields(type(node)):
+        value = getattr(node, field_name, None)
+        if isinstance(value, ast.AST):
+            value = _abbreviate(value, depth + 1, max_depth, max_items)
+            setattr(new_node, field_name, value)
+            continue
+
+        if not isinstance(value, list):
+            continue
+
+        items = value
+        if limit is not None and len(items) > limit:
+            items = items[:limit]
+
+        new_items = [
+            _abbreviate(item, depth + 1, max_depth, max_items)
+            if isinstance(item, ast.AST) else item
+            for item in items
+        ]
+
+        if len(items) != len(value):
+            nodes = [v for v in value if isinstance(v, (ast.expr, ast.stmt))]
+            if nodes:
+                new_items.append(_placeholder(nodes[0]))
+            else:
+                # can't mark the cut off. keep everything.
+                new_items = [
+                    _abbreviate(item, depth + 1, max_depth, max_items)
+                    if isinstance(item, ast.AST) else item
+                    for item in value
+                ]
+
+        setattr(new_node, field_name, new_items)
+    return new_node
+
 class IndentDumper:
-    def visit(self, item):
-        node = item['node']
-        class_name = node.__class__.__name__
+    def __init__(self):
+        self._handlers = {}
+
+    def get_handler(self, node):
+        node_class = node.__class__
+        handler = self._handlers.get(node_class)
+        if handler is not None:
+            return handler
+
+        class_name = node_class.__name__
         type_method = 'visit_{class_name}'.format(class_name=class_name)
 
         generic = self.visit_generic
@@ -29,11 +116,20 @@ class IndentDumper:
             generic = self.visit_non_ast
 
         handler = getattr(self, type_method, generic)
+        self._handlers[node_class] = handler
+        return handler
+
+    def visit(self, item):
+        node = item['node']
+        handler = self.get_handler(node)
         rep = handler(item)
         if rep is None:
             return None
 
         field = item['field_name']
+        if field is None:
+            return rep
+
         field_index = item['field_index']
         if field_index is not None:
             field = "{field}[{field_index}]".format(**locals())
@@ -61,6 +157,10 @@ class IndentDumper:
         return "{class_name}(s={s})".format(class_name=class_name,
                                                   s=repr(node.s))
 
+    def visit_Constant(self, item):
+        node = item['node']
+        return "Constant(value={value})".format(value=repr(node.value))
+
     def visit_non_ast(self, item):
         # normal repr printing for nonasts
         node = item['node']
@@ -70,17 +170,94 @@ class IndentDumper:
         return None
 
 
-def indented(code):
+def indented(code, file=None, max_depth=None, node_types=None,
+             compact=False, buffer_size=1000):
+    """
+    Dump an indented tree of code, one line per node. Parents are written
+    before their children.
+
+    file : text sink with a write method. Defaults to sys.stdout.
+    max_depth : int
+        don't descend past this depth. Module body statements are depth 0.
+    node_types : type or tuple of types
+        only write nodes of these types. Their children are still visited.
+    compact : bool
+        write the depth as a number instead of indenting the line.
+    buffer_size : int
+        number of lines to buffer between writes.
+    """
     if isinstance(code, str):
-        code = ast.parse(text)
+        code = ast.parse(code)
+
+    if file is None:
+        file = sys.stdout
 
     dumper = IndentDumper()
-    walker = graph_walk(code)
-    for item in walker:
+    lines = []
+    write = file.write
+
+    for item in _dump_walk(code, max_depth):
         node = item['node']
-        indent = "  " * item['depth']
+        if node_types is not None and not isinstance(node, node_types):
+            continue
+
         rep = dumper.visit(item)
         if rep is None:
             continue
+
+        depth = item['depth']
+        if compact:
+            prefix = '{0} '.format(depth)
+        else:
+            prefix = "  " * depth
+
         for line in rep.split('\n'):
-            print(indent, line)
+            lines.append(prefix + line + '\n')
+
+        if len(lines) >= buffer_size:
+            write(''.join(lines))
+            lines.clear()
+
+    if lines:
+        write(''.join(lines))
+
+
+def _dump_walk(code, max_depth=None):
+    """
+    Preorder walk that yields the items IndentDumper expects. Like
+    graph_walk, the Module itself is skipped and scalars aren't yielded.
+    """
+    if isinstance(code, ast.Module):
+        stack = [
+            (line, 'body', i, 0)
+            for i, line in reversed(list(enumerate(code.body)))
+        ]
+    else:
+        stack = [(code, None, None, 0)]
+
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        node, field_name, field_index, depth = pop()
+        yield {
+            'node': node,
+            'field_name': field_name,
+            'field_index': field_index,
+            'depth': depth,
+        }
+
+        if max_depth is not None and depth >= max_depth:
+            continue
+
+        children = []
+        for child_field in node_fields(type(node)):
+            value = getattr(node, child_field, None)
+            if isinstance(value, ast.AST):
+                children.append((value, child_field, None, depth + 1))
+            elif isinstance(value, list):
+                for i, child in enumerate(value):
+                    if isinstance(child, ast.AST):
+                        children.append((child, child_field, i, depth + 1))
+
+        for child in reversed(children):
+            push(child)
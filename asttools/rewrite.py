@@ -0,0 +1,261 @@
+"""
+Rewrite rules from Matcher templates.
+
+    engine = RewriteEngine()
+    engine.add("_any_x_ * 2", "_any_x_ + _any_x_")
+    engine.add("len(_any_seq_) == 0", "not _any_seq_")
+    engine.rewrite(code)
+
+Named wildcards in the template capture subtrees, see Matcher.captures, and
+the same names in the replacement are swapped for copies of them. A
+replacement can also be a function taking (captures, node) that returns the
+new node.
+
+Rules are indexed by the node type of the template root, so only the rules
+that could match are tried at each node. A pass is one transform and
+children are rewritten before their parents. Passes are repeated until
+nothing changes or max_iterations is hit.
+"""
+import ast
+import copy
+
+from .common import quick_parse
+from .fingerprint import ast_fingerprint
+from .matcher import Matcher, capture_name, is_any
+from .transform import EagerTransformer, transform
+
+REWRITE_MAX_ITERATIONS = 10
+
+_missing = object()
+
+
+def _parse_template(template):
+    if isinstance(template, str):
+        template = quick_parse(template)
+        if isinstance(template, ast.Expr):
+            template = template.value
+    return template
+
+
+class RewriteRule:
+    """
+    template => replacement.
+
+    template : str, ast.AST or Matcher
+    replacement : str, ast.AST or function(captures, node)
+    hits : number of nodes rewritten by this rule
+    """
+    def __init__(self, template, replacement, name=None):
+        matcher = template
+        if not isinstance(matcher, Matcher):
+            matcher = Matcher(template)
+        self.matcher = matcher
+
+        root = matcher.template
+        if is_any(root):
+            raise ValueError("template root can't be a wildcard")
+        self.node_type = type(root)
+
+        if name is None:
+            name = ast.unparse(root)
+        self.name = name
+
+        if not callable(replacement):
+            replacement = _parse_template(replacement)
+            if isinstance(root, ast.stmt) and isinstance(replacement, ast.expr):
+                replacement = ast.Expr(value=replacement)
+
+            names = {
+                capture_name(node) for node in ast.walk(replacement)
+            } - {None}
+            missing = names - matcher.capture_names
+            if missing:
+                msg = "replacement uses names not captured by template: {0}"
+                raise ValueError(msg.format(sorted(missing)))
+        self.replacement = replacement
+        self.hits = 0
+
+    def __repr__(self):
+        return "RewriteRule({0}, hits={1})".format(self.name, self.hits)
+
+    def apply(self, node):
+        """
+        rewritten node or None if the rule doesn't match or the rewrite is
+        structurally the same as node. The latter would never converge.
+        """
+        captures = self.matcher.captures(node)
+        if captures is None:
+            return None
+
+        if callable(self.replacement):
+            new_node = self.replacement(captures, node)
+            if new_node is None or new_node is node:
+                return None
+        else:
+            new_node = self.build(captures)
+
+        if type(new_node) is type(node) \
+           and ast_fingerprint(new_node)[0] == ast_fingerprint(node)[0]:
+            return None
+
+        self.hits += 1
+        ast.copy_location(new_node, node)
+        ast.fix_missing_locations(new_node)
+        return new_node
+
+    def build(self, captures):
+        """ copy of the replacement with the captures filled in """
+        holder = ast.Expr(value=copy.deepcopy(self.replacement))
+        _fill(holder, captures)
+        return holder.value
+
+
+def _captured(node, captures):
+    """ what the placeholder node stands for or _missing """
+    if isinstance(node, ast.Name):
+        return captures.get(capture_name(node), _missing)
+    if isinstance(node, ast.Expr):
+        # an expression statement only stands in for a body
+        captured = captures.get(capture_name(node), _missing)
+        if isinstance(captured, list):
+            return captured
+    return _missing
+
+
+def _fill(node, captures):
+    """
+    Swap the placeholders under node for copies of what they captured.
+    List fields are rebuilt in one go so splicing doesn't move the slots.
+    """
+    for field_name, value in ast.iter_fields(node):
+        if isinstance(value, list):
+            new_values = []
+            for item in value:
+                captured = _captured(item, captures)
+                if captured is _missing:
+                    if isinstance(item, ast.AST):
+                        _fill(item, captures)
+                    new_values.append(item)
+                elif isinstance(captured, list):
+                    # i.e. call args or a body
+                    new_values.extend(
+                        _copy_capture(c, item) for c in captured
+                    )
+                else:
+                    new_values.append(_copy_capture(captured, item))
+            value[:] = new_values
+
+        elif isinstance(value, ast.AST):
+            captured = _captured(value, captures)
+            if captured is _missing:
+                _fill(value, captures)
+                continue
+
+            if isinstance(captured, list):
+                # f(_any_x_) captures a list of args
+                if len(captured) != 1:
+                    raise ValueError(
+                        "{0} captured {1} nodes and can't go in {2}".format(
+                            capture_name(value), len(captured), field_name
+                        )
+                    )
+                captured = captured[0]
+            setattr(node, field_name, _copy_capture(captured, value))
+
+
+def _set_ctx(node, ctx):
+    if hasattr(node, 'ctx'):
+        node.ctx = type(ctx)()
+    if isinstance(node, (ast.Tuple, ast.List)):
+        for elt in node.elts:
+            _set_ctx(elt, ctx)
+    elif isinstance(node, ast.Starred):
+        _set_ctx(node.value, ctx)
+
+
+def _copy_capture(captured, placeholder):
+    """
+    copy of captured with the ctx of the slot it goes in. _any_x_ += 1 =>
+    _any_x_ = _any_x_ + 1 reads the captured target.
+    """
+    new_node = copy.deepcopy(captured)
+    ctx = getattr(placeholder, 'ctx', None)
+    if ctx is not None:
+        _set_ctx(new_node, ctx)
+    return new_node
+
+
+class _RewriteTransformer(EagerTransformer):
+    def __init__(self, index):
+        super().__init__()
+        self.index = index
+        self.rewrites = 0
+
+    def generic_visit(self, node, meta):
+        rules = self.index.get(type(node))
+        if not rules:
+            return node
+
+        for rule in rules:
+            new_node = rule.apply(node)
+            if new_node is not None:
+                self.rewrites += 1
+                return new_node
+        return node
+
+
+class RewriteEngine:
+    """
+    Applies RewriteRules in as few passes as possible. Can be passed
+    straight to func_rewrite.
+
+    max_iterations : int
+        cap on the number of passes. A set of rules that keeps rewriting,
+        i.e. a * 2 => a + a and a + a => a * 2, stops there.
+    iterations : passes taken by the last rewrite
+    converged : whether the last rewrite stopped because nothing changed
+    """
+    def __init__(self, rules=(), max_iterations=REWRITE_MAX_ITERATIONS):
+        self.rules = []
+        self.index = {}
+        self.max_iterations = max_iterations
+        self.iterations = 0
+        self.converged = True
+        for rule in rules:
+            if not isinstance(rule, RewriteRule):
+                rule = RewriteRule(*rule)
+            self.add_rule(rule)
+
+    def add(self, template, replacement, name=None):
+        """ add a rule. Rules are tried in the order they are added """
+        return self.add_rule(RewriteRule(template, replacement, name=name))
+
+    def add_rule(self, rule):
+        self.rules.append(rule)
+        self.index.setdefault(rule.node_type, []).append(rule)
+        return rule
+
+    @property
+    def hits(self):
+        """ {rule name: hits} """
+        return {rule.name: rule.hits for rule in self.rules}
+
+    def reset_hits(self):
+        for rule in self.rules:
+            rule.hits = 0
+
+    def rewrite(self, code):
+        self.iterations = 0
+        self.converged = False
+        while self.iterations < self.max_iterations:
+            visitor = _RewriteTransformer(self.index)
+            transform(code, visitor)
+            # transform never visits the Module, so swap its statements here
+            visitor.substitute_children(code)
+            self.iterations += 1
+            if not visitor.rewrites:
+                self.converged = True
+                break
+        return code
+
+    __call__ = rewrite
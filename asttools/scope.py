@@ -0,0 +1,362 @@
+"""
+Scope and symbol table analysis.
+
+    table = symbol_table(code)
+    scope = table.scopes[func_def]
+    scope.free      # free variables, i.e. co_freevars
+    scope.cells     # locals used by nested scopes, i.e. co_cellvars
+    scope.globals   # declared and implicit globals
+
+Scopes follow the compiler. Module, function, lambda, class and comprehension
+nodes open a scope. Defaults, decorators, annotations, class bases and the
+first iterable of a comprehension are evaluated in the enclosing scope.
+Class scopes are skipped when resolving names for nested scopes.
+"""
+import ast
+import weakref
+
+from .common import node_fields
+
+FUNCTION_SCOPES = ('function', 'lambda', 'comprehension')
+
+
+class Scope:
+    def __init__(self, node, kind, parent=None):
+        self.node = node
+        self.kind = kind
+        self.parent = parent
+        self.children = []
+        if parent is not None:
+            parent.children.append(self)
+
+        # raw names seen in this scope
+        self.bindings = set()
+        self.loads = set()
+        self.declared_globals = set()
+        self.nonlocals = set()
+
+        # resolved by SymbolTable
+        self.globals = set()
+        self.free = set()
+        self.cells = set()
+
+    @property
+    def locals(self):
+        if self.kind == 'module':
+            return set()
+        return self.bindings - self.declared_globals - self.nonlocals
+
+    @property
+    def is_function(self):
+        return self.kind in FUNCTION_SCOPES
+
+    def __repr__(self):
+        name = getattr(self.node, 'name', self.node.__class__.__name__)
+        return "Scope({kind}, {name})".format(kind=self.kind, name=name)
+
+
+class SymbolTable:
+    """
+    Builds the scopes of a tree in one preorder pass and then resolves
+    free, cell and global names.
+
+    scopes : {node: Scope} for every node that opens a scope.
+    """
+    def __init__(self, code):
+        if isinstance(code, str):
+            code = ast.parse(code)
+        self.code = code
+        self.scopes = {}
+        self._node_scopes = {}
+
+        self.root = Scope(code, 'module')
+        self.scopes[code] = self.root
+        if isinstance(code, ast.Module):
+            self.generic_visit(code, self.root)
+        else:
+            self.visit(code, self.root)
+
+        # names bound at module level, including through global statements
+        self._global_bindings = set(self.root.bindings)
+        for scope in self.scopes.values():
+            self._resolve(scope)
+            self._global_bindings.update(
+                scope.bindings & scope.declared_globals
+            )
+
+    def scope_of(self, node):
+        """ scope node is evaluated in """
+        return self._node_scopes[node]
+
+    def free_variables(self, node):
+        return self.scopes[node].free
+
+    def binding_scope(self, name, scope):
+        """
+        Scope whose binding of name a load in scope sees. Class scopes are
+        skipped for nested scopes. None when nothing binds it, i.e. a
+        builtin.
+        """
+        if scope.kind != 'module' and name not in scope.declared_globals:
+            if name in scope.locals:
+                return scope
+
+            parent = scope.parent
+            while parent is not None and parent.kind != 'module':
+                if parent.kind != 'class':
+                    if name in parent.declared_globals:
+                        break
+                    if name in parent.locals:
+                        return parent
+                parent = parent.parent
+
+        if name in self._global_bindings:
+            return self.root
+
+    def _new_scope(self, node, kind, parent):
+        scope = Scope(node, kind, parent)
+        self.scopes[node] = scope
+        return scope
+
+    def visit(self, node, scope):
+        self._node_scopes[node] = scope
+        method = 'visit_' + node.__class__.__name__
+        visitor = getattr(self, method, None)
+        if visitor is None:
+            return self.generic_visit(node, scope)
+        return visitor(node, scope)
+
+    def generic_visit(self, node, scope, skip=()):
+        for field_name in node_fields(type(node)):
+            if field_name in skip:
+                continue
+            value = getattr(node, field_name, None)
+            if isinstance(value, ast.AST):
+                self.visit(value, scope)
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, ast.AST):
+                        self.visit(item, scope)
+
+    def visit_list(self, nodes, scope):
+        for node in nodes:
+            if node is not None:
+                self.visit(node, scope)
+
+    def visit_Name(self, node, scope):
+        if isinstance(node.ctx, ast.Load):
+            scope.loads.add(node.id)
+        else:
+            scope.bindings.add(node.id)
+
+    def visit_Global(self, node, scope):
+        scope.declared_globals.update(node.names)
+
+    def visit_Nonlocal(self, node, scope):
+        scope.nonlocals.update(node.names)
+
+    def visit_Import(self, node, scope):
+        for alias in node.names:
+            if alias.name == '*':
+                continue
+            name = alias.asname or alias.name.split('.')[0]
+            scope.bindings.add(name)
+
+    visit_ImportFrom = visit_Import
+
+    def visit_ExceptHandler(self, node, scope):
+        if node.name:
+            scope.bindings.add(node.name)
+        self.generic_visit(node, scope)
+
+    def visit_MatchAs(self, node, scope):
+        if node.name:
+            scope.bindings.add(node.name)
+        self.generic_visit(node, scope)
+
+    def visit_MatchStar(self, node, scope):
+        if node.name:
+            scope.bindings.add(node.name)
+
+    def visit_MatchMapping(self, node, scope):
+        if node.rest:
+            scope.bindings.add(node.rest)
+        self.generic_visit(node, scope)
+
+    def visit_NamedExpr(self, node, scope):
+        # walrus in a comprehension binds in the enclosing scope
+        target_scope = scope
+        while target_scope.kind == 'comprehension':
+            target_scope = target_scope.parent
+        name = node.target.id
+        target_scope.bindings.add(name)
+        if target_scope is not scope:
+            if target_scope.kind == 'module':
+                scope.declared_globals.add(name)
+            else:
+                scope.nonlocals.add(name)
+        self._node_scopes[node.target] = target_scope
+        self.visit(node.value, scope)
+
+    def _visit_arguments(self, args, scope, new_scope):
+        """ defaults and annotations are evaluated in the outer scope """
+        self._node_scopes[args] = new_scope
+        self.visit_list(args.defaults, scope)
+        self.visit_list(args.kw_defaults, scope)
+
+        all_args = args.posonlyargs + args.args + args.kwonlyargs
+        if args.vararg:
+            all_args.append(args.vararg)
+        if args.kwarg:
+            all_args.append(args.kwarg)
+
+        for arg in all_args:
+            self._node_scopes[arg] = new_scope
+            new_scope.bindings.add(arg.arg)
+            if arg.annotation is not None:
+                self.visit(arg.annotation, scope)
+
+    def visit_FunctionDef(self, node, scope):
+        scope.bindings.add(node.name)
+        self.visit_list(node.decorator_list, scope)
+        if node.returns is not None:
+            self.visit(node.returns, scope)
+
+        new_scope = self._new_scope(node, 'function', scope)
+        self._visit_arguments(node.args, scope, new_scope)
+        self.visit_list(node.body, new_scope)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node, scope):
+        new_scope = self._new_scope(node, 'lambda', scope)
+        self._visit_arguments(node.args, scope, new_scope)
+        self.visit(node.body, new_scope)
+
+    def visit_ClassDef(self, node, scope):
+        scope.bindings.add(node.name)
+        self.visit_list(node.decorator_list, scope)
+        self.visit_list(node.bases, scope)
+        self.visit_list(node.keywords, scope)
+
+        new_scope = self._new_scope(node, 'class', scope)
+        self.visit_list(node.body, new_scope)
+
+    def _visit_comprehension(self, node, scope, elements):
+        generators = node.generators
+        # the first iterable is evaluated in the enclosing scope
+        self.visit(generators[0].iter, scope)
+
+        new_scope = self._new_scope(node, 'comprehension', scope)
+        for i, generator in enumerate(generators):
+            self._node_scopes[generator] = new_scope
+            self.visit(generator.target, new_scope)
+            if i > 0:
+                self.visit(generator.iter, new_scope)
+            self.visit_list(generator.ifs, new_scope)
+
+        self.visit_list(elements, new_scope)
+
+    def visit_ListComp(self, node, scope):
+        self._visit_comprehension(node, scope, [node.elt])
+
+    visit_SetComp = visit_ListComp
+    visit_GeneratorExp = visit_ListComp
+
+    def visit_DictComp(self, node, scope):
+        self._visit_comprehension(node, scope, [node.key, node.value])
+
+    def _resolve(self, scope):
+        if scope.kind == 'module':
+            scope.globals.update(scope.bindings, scope.loads)
+            return
+
+        scope.globals.update(scope.declared_globals)
+        local_names = scope.locals
+
+        for name in scope.nonlocals:
+            self._resolve_free(scope, name)
+
+        for name in scope.loads:
+            if name in local_names or name in scope.declared_globals:
+                continue
+            if name in scope.nonlocals:
+                continue
+            if not self._resolve_free(scope, name):
+                scope.globals.add(name)
+
+        # zero argument super() closes over the __class__ cell
+        if scope.is_function \
+           and ('super' in scope.loads or '__class__' in scope.loads):
+            self._resolve_class_cell(scope)
+
+    def _resolve_free(self, scope, name):
+        """
+        Find the enclosing function scope that binds name. Marks it as a
+        cell there and free in every scope in between.
+        """
+        passed = [scope]
+        parent = scope.parent
+        while parent is not None and parent.kind != 'module':
+            if parent.kind == 'class':
+                passed.append(parent)
+                parent = parent.parent
+                continue
+
+            if name in parent.declared_globals:
+                return False
+
+            if name in parent.locals:
+                parent.cells.add(name)
+                for free_scope in passed:
+                    free_scope.free.add(name)
+                return True
+
+            passed.append(parent)
+            parent = parent.parent
+        return False
+
+    def _resolve_class_cell(self, scope):
+        passed = [scope]
+        parent = scope.parent
+        while parent is not None and parent.kind != 'module':
+            if parent.kind == 'class':
+                parent.cells.add('__class__')
+                for free_scope in passed:
+                    free_scope.free.add('__class__')
+                return True
+            passed.append(parent)
+            parent = parent.parent
+        return False
+
+
+def symbol_table(code):
+    """
+    Cached SymbolTable of code, keyed on the identity of the root node.
+
+    The cache can't see a tree change. transform, replace_node and
+    delete_node drop every cached table. After changing a tree any other
+    way, call invalidate_symbol_tables.
+    """
+    if isinstance(code, str):
+        return SymbolTable(code)
+
+    table = _symbol_tables.get(code)
+    if table is None:
+        table = SymbolTable(code)
+        _symbol_tables[code] = table
+    return table
+
+
+def invalidate_symbol_tables(code=None):
+    """
+    Drop the cached table of code, or all of them. A table cached for an
+    ancestor of code is kept, so pass nothing when unsure.
+    """
+    if code is None:
+        _symbol_tables.clear()
+    else:
+        _symbol_tables.pop(code, None)
+
+
+_symbol_tables = weakref.WeakKeyDictionary()
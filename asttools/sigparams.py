@@ -1,4 +1,5 @@
 import ast
+import weakref
 from typing import (
     Any,
     cast,
@@ -9,6 +10,9 @@ from inspect import (
 )
 
 from .common import get_arg_name
+from .scope import symbol_table
+
+_missing = object()
 
 
 def ast_sigparams(node):
@@ -27,14 +31,265 @@ def ast_sigparams(node):
     Note: The defaults will ast.Node since we don't know the values of
     variables till runtime.
     """
-    if isinstance(node, ast.Call):
-        ret = _ast_sigparams_call(node)
-    elif isinstance(node, ast.FunctionDef):
-        ret = _ast_sigparams_def(node)
-    else:
-        raise TypeError()
+    return dict(ast_signature(node).parameters)
+
+
+def ast_signature(node):
+    """
+    Cached AstSignature for an ast.Call or ast.FunctionDef.
+
+    The cache is keyed on node identity and is invalidated when the argument
+    lists of the node are changed.
+    """
+    stamp = _node_stamp(node)
+    sig = _signatures.get(node)
+    if sig is None or sig.stamp != stamp:
+        sig = AstSignature(node, stamp)
+        _signatures[node] = sig
+    return sig
+
+
+_signatures = weakref.WeakKeyDictionary()
+
+
+def _node_stamp(node):
+    """
+    Field values that make up the signature. Cheap way to tell whether a
+    node was mutated since its signature was cached, including in place
+    renames of an arg, keyword or Name.
+    """
+    node_type = type(node)
+    if node_type is ast.Call:
+        return (
+            *map(_expr_stamp, node.args),
+            None,
+            *[(kw.arg, _expr_stamp(kw.value)) for kw in node.keywords],
+        )
+
+    if node_type is ast.FunctionDef:
+        args = node.args
+        return (
+            _arg_name(args.vararg),
+            _arg_name(args.kwarg),
+            *map(_arg_name, args.posonlyargs),
+            None,
+            *map(_arg_name, args.args),
+            None,
+            *map(_expr_stamp, args.defaults),
+            None,
+            *map(_arg_name, args.kwonlyargs),
+            None,
+            *map(_expr_stamp, args.kw_defaults),
+        )
+
+    raise TypeError()
+
+
+def _arg_name(arg):
+    if arg is None:
+        return None
+    return arg.arg
+
+
+def _expr_stamp(node):
+    """
+    The id keeps a rebuilt but equal node from hitting the cache, since bind
+    hands out the nodes themselves. The value catches in place mutation and
+    a dead node's id being reused.
+    """
+    if node is None:
+        return None
+    return id(node), _value_stamp(node)
+
+
+def _value_stamp(node):
+    """
+    Value of the nodes that get_sig_default_value could evaluate or that
+    name a parameter. Anything else is kept as the node itself, so it
+    doesn't need one.
+    """
+    node_type = type(node)
+    if node_type is ast.Name:
+        return node.id
+    if node_type is ast.Constant:
+        return type(node.value), node.value
+    if node_type in (ast.List, ast.Tuple, ast.Set):
+        return node_type, *map(_value_stamp, node.elts)
+    if node_type is ast.Dict:
+        return (
+            node_type,
+            *[key and _value_stamp(key) for key in node.keys],
+            *map(_value_stamp, node.values),
+        )
+    if node_type is ast.UnaryOp:
+        return type(node.op), _value_stamp(node.operand)
+    if node_type is ast.BinOp:
+        return (
+            type(node.op),
+            _value_stamp(node.left),
+            _value_stamp(node.right),
+        )
+    if node_type is ast.Starred:
+        return node_type, _value_stamp(node.value)
+    return node_type
+
+
+class AstSignature:
+    """
+    Static signature of an ast.FunctionDef or ast.Call.
 
-    return ret
+    parameters is the ast_sigparams dict and is only built on first access.
+    For FunctionDef signatures, bind maps the arguments of an ast.Call to the
+    parameters without going through inspect.Signature.
+    """
+    def __init__(self, node, stamp=None):
+        if not isinstance(node, (ast.Call, ast.FunctionDef)):
+            raise TypeError()
+
+        # weakref so the signature cache doesn't keep nodes alive
+        self._node = weakref.ref(node)
+        self.stamp = stamp
+        self.is_def = isinstance(node, ast.FunctionDef)
+        self._parameters = None
+
+        if self.is_def:
+            self.name = node.name
+            self._init_binding(node.args)
+
+    def _init_binding(self, args: ast.arguments):
+        posonly = [arg.arg for arg in args.posonlyargs]
+        positional = posonly + [arg.arg for arg in args.args]
+        kwonly = [arg.arg for arg in args.kwonlyargs]
+
+        defaults = dict(zip(reversed(positional), reversed(args.defaults)))
+        for name, default in zip(kwonly, args.kw_defaults):
+            if default is not None:
+                defaults[name] = default
+
+        self.positional = positional
+        self.kwonly = kwonly
+        self.defaults = defaults
+        self.vararg = args.vararg.arg if args.vararg else None
+        self.kwarg = args.kwarg.arg if args.kwarg else None
+        # names that can be passed as keywords
+        self.keyword_names = frozenset(positional[len(posonly):] + kwonly)
+
+        order = positional[:]
+        if self.vararg:
+            order.append(self.vararg)
+        order.extend(kwonly)
+        if self.kwarg:
+            order.append(self.kwarg)
+        self.order = order
+
+    @property
+    def node(self):
+        return self._node()
+
+    @property
+    def parameters(self):
+        if self._parameters is None:
+            node = self.node
+            if self.is_def:
+                self._parameters = _ast_sigparams_def(node)
+            else:
+                self._parameters = _ast_sigparams_call(node)
+        return self._parameters
+
+    @property
+    def var_positional(self):
+        """ names of the VAR_POSITIONAL parameters """
+        return [
+            param.name for param in self.parameters.values()
+            if param.kind == Parameter.VAR_POSITIONAL
+        ]
+
+    @property
+    def var_keyword(self):
+        """ name of the first VAR_KEYWORD parameter """
+        for name, param in self.parameters.items():
+            if param.kind == Parameter.VAR_KEYWORD:
+                return name
+
+    def bind(self, call: ast.Call):
+        """
+        Statically bind the arguments of call to the parameters.
+
+        Returns {param_name: ast.expr} in parameter order. The *args
+        parameter is bound to a list of the extra positional nodes and
+        **kwargs to a dict of the extra keyword nodes. Parameters that aren't
+        passed are bound to their default node.
+
+        Raises TypeError when the call doesn't fit the signature and
+        ValueError when the call unpacks *iterables or **mappings since that
+        can't be bound statically.
+        """
+        if not self.is_def:
+            raise TypeError("Can only bind against a FunctionDef signature")
+
+        name = self.name
+        positional = self.positional
+        num_positional = len(positional)
+        bound = {}
+        extra = []
+
+        for i, arg in enumerate(call.args):
+            if type(arg) is ast.Starred:
+                raise ValueError("Cannot statically bind *unpacking")
+            if i < num_positional:
+                bound[positional[i]] = arg
+            else:
+                extra.append(arg)
+
+        vararg = self.vararg
+        if extra and vararg is None:
+            raise TypeError(
+                f"{name}() takes {num_positional} positional arguments "
+                f"but {len(call.args)} were given"
+            )
+        if vararg is not None:
+            bound[vararg] = extra
+
+        kwarg = self.kwarg
+        keyword_names = self.keyword_names
+        extra_keywords = {}
+        for kw in call.keywords:
+            kw_name = kw.arg
+            if kw_name is None:
+                raise ValueError("Cannot statically bind **unpacking")
+            if kw_name in keyword_names:
+                if kw_name in bound:
+                    raise TypeError(
+                        f"{name}() got multiple values for argument "
+                        f"'{kw_name}'"
+                    )
+                bound[kw_name] = kw.value
+            elif kwarg is not None:
+                extra_keywords[kw_name] = kw.value
+            else:
+                raise TypeError(
+                    f"{name}() got an unexpected keyword argument "
+                    f"'{kw_name}'"
+                )
+
+        if kwarg is not None:
+            bound[kwarg] = extra_keywords
+
+        if len(bound) == len(self.order):
+            return {param: bound[param] for param in self.order}
+
+        defaults = self.defaults
+        ret = {}
+        for param in self.order:
+            value = bound.get(param, _missing)
+            if value is _missing:
+                value = defaults.get(param, _missing)
+                if value is _missing:
+                    raise TypeError(
+                        f"{name}() missing required argument: '{param}'"
+                    )
+            ret[param] = value
+        return ret
 
 
 def create_sigparam(
@@ -45,11 +300,18 @@ def create_sigparam(
 
     contains_starargs = False
     parameters = {}
+    taken = {arg for arg in args if isinstance(arg, str)}
+    taken.update(keywords)
     for arg, default in args.items():
         if isinstance(arg, int):
-            raise Exception("Cannot handle constant args currently")
-
-        if arg.startswith('*'):
+            # positional arg that isn't a plain name. There is no name to
+            # align with, so it is keyed by position.
+            param = Parameter(
+                positional_arg_name(arg, taken),
+                default=get_sig_default_value(default),
+                kind=Parameter.POSITIONAL_ONLY,
+            )
+        elif arg.startswith('*'):
             param = Parameter(default, kind=Parameter.VAR_POSITIONAL)
             contains_starargs = True
         else:
@@ -90,26 +352,40 @@ def create_sigparam(
     return parameters
 
 
+def positional_arg_name(index, taken=()):
+    """ _index, with more leading underscores while it's in taken """
+    name = '_{0}'.format(index)
+    while name in taken:
+        name = '_' + name
+    return name
+
+
 def get_sig_default_value(node):
+    """
+    Value of a default/argument node. Literals are evaluated, anything else
+    is only known at runtime and the ast node is returned.
+    """
     if node is _empty:
         return _empty
 
-    match node:
-        case ast.Constant():
-            return node.value
-        case _:
-            raise ValueError(f"Cannot derive live value from {node}")
+    if type(node) is ast.Constant:
+        return node.value
+
+    try:
+        return ast.literal_eval(node)
+    except (ValueError, TypeError):
+        return node
 
 
 def get_call_arg_params(node: ast.Call) -> dict[str | int, Any]:
     """
+    Names map to _empty and *name to name. Any other expression is keyed by
+    its position.
     """
     args = node.args
     arg_params = {}
     for i, arg in enumerate(args):
         match arg:
-            case ast.Constant():
-                arg_params[i] = arg.value
             case ast.Name():
                 arg_params[arg.id] = _empty
             case ast.Starred():
@@ -117,6 +393,8 @@ def get_call_arg_params(node: ast.Call) -> dict[str | int, Any]:
                     raise ValueError("Only support name for *varargs")
                 name = cast(ast.Name, arg.value)
                 arg_params['*' + name.id] = name.id
+            case _:
+                arg_params[i] = arg
     return arg_params
 
 
@@ -149,41 +427,102 @@ def _ast_sigparams_call(call: ast.Call):
 
 def _ast_sigparams_def(node: ast.FunctionDef):
     def_args = node.args
+    parameters = {}
 
-    arg_params = get_params_from_func_def(
-        def_args.args,
-        def_args.defaults,
-        def_args.vararg,
-        '*',
-    )
+    posonlyargs = def_args.posonlyargs
+    positional = posonlyargs + def_args.args
+    defaults = def_args.defaults
+    # defaults line up with the end of the positional args
+    first_default = len(positional) - len(defaults)
+    for i, arg in enumerate(positional):
+        default = _empty
+        if i >= first_default:
+            default = get_sig_default_value(defaults[i - first_default])
+
+        kind = Parameter.POSITIONAL_OR_KEYWORD
+        if i < len(posonlyargs):
+            kind = Parameter.POSITIONAL_ONLY
+
+        parameters[arg.arg] = Parameter(arg.arg, kind, default=default)
+
+    if def_args.vararg:
+        name = def_args.vararg.arg
+        parameters[name] = Parameter(name, Parameter.VAR_POSITIONAL)
+
+    # kw_defaults line up with kwonlyargs. None when there isn't a default
+    for arg, default in zip(def_args.kwonlyargs, def_args.kw_defaults):
+        default = _empty if default is None else get_sig_default_value(default)
+        parameters[arg.arg] = Parameter(
+            arg.arg,
+            Parameter.KEYWORD_ONLY,
+            default=default,
+        )
+
+    if def_args.kwarg:
+        name = def_args.kwarg.arg
+        parameters[name] = Parameter(name, Parameter.VAR_KEYWORD)
 
-    kw_params = get_params_from_func_def(
-        def_args.kwonlyargs,
-        def_args.kw_defaults,
-        def_args.kwarg,
-        '**',
-    )
-    parameters = create_sigparam(arg_params, kw_params)
     return parameters
 
 
-def get_params_from_func_def(
-        args: list[ast.arg],
-        defaults: list,
-        variadic: ast.arg | None,
-        variadic_perfix: str,
-):
-    params: dict[str | int, Any] = {
-        arg.arg: _empty for arg in args
-    }
-
-    for name, default in zip(reversed(params.keys()), defaults):
-        params[name] = default
-
-    if variadic:
-        params[variadic_perfix + variadic.arg] = variadic.arg
-
-    return params
+def call_bindings(code):
+    """
+    Bind every call site in code to the function definition it calls.
+
+    Walks the tree once to index FunctionDefs by the scope that binds their
+    name and collect the calls to plain names. Each call name is resolved
+    with the symbol table like the compiler would, so a method called by
+    its bare name doesn't bind to the method. Then yields a dict per call
+    site of an indexed function:
+        {
+            node : ast.Call,
+            func_def : ast.FunctionDef,
+            bound : {param_name: ast.expr} or None,
+            error : Exception or None,
+        }
+
+    bound is the AstSignature.bind of the call. If the call can't be bound
+    statically, bound is None and error is the exception raised.
+
+    When a name is defined more than once in a scope, the last definition
+    wins.
+    """
+    if isinstance(code, str):
+        code = ast.parse(code)
+
+    table = symbol_table(code)
+    scope_of = table.scope_of
+    binding_scope = table.binding_scope
+    func_defs = {}
+    calls = []
+    for node in ast.walk(code):
+        node_type = type(node)
+        if node_type is ast.FunctionDef:
+            name = node.name
+            func_defs[binding_scope(name, scope_of(node)), name] = node
+        elif node_type is ast.Call and type(node.func) is ast.Name:
+            calls.append(node)
+
+    for call in calls:
+        name = call.func.id
+        scope = binding_scope(name, scope_of(call.func))
+        func_def = func_defs.get((scope, name))
+        if func_def is None:
+            continue
+
+        bound = None
+        error = None
+        try:
+            bound = ast_signature(func_def).bind(call)
+        except (TypeError, ValueError) as e:
+            error = e
+
+        yield {
+            'node': call,
+            'func_def': func_def,
+            'bound': bound,
+            'error': error,
+        }
 
 
 if __name__ == '__main__':
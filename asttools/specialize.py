@@ -0,0 +1,499 @@
+"""
+Runtime specialization.
+
+    @specialize(constants=['mode'])
+    def apply(data, mode):
+        if mode == 'sum':
+            return sum(data)
+        if isinstance(data, dict):
+            return max(data.values())
+        return max(data)
+
+Every call is keyed on the types of its arguments and the values of the
+constants parameters. Once a key has been seen threshold times, a variant
+is compiled for it. The constant parameters are substituted, isinstance and
+type checks on the arguments are resolved, and the result is run through
+fold_constants to prune the dead branches. Calls with a known key dispatch
+straight to their variant. Variants are kept in an LRU cache of maxsize.
+"""
+import ast
+import builtins
+import copy
+import functools
+import inspect
+from collections import OrderedDict
+from textwrap import dedent
+
+from .common import get_source
+from .function import create_function
+from .optimize import _safe_value, fold_constants
+from .scope import SymbolTable
+from .transform import EagerTransformer, transform
+
+_missing = object()
+
+
+def _constant_key(value):
+    """
+    Guard key part for a constant. Floats are keyed on repr since -0.0 ==
+    0.0 and nan != nan, and neither should share or miss a variant.
+    """
+    if isinstance(value, (float, complex)):
+        return (type(value), repr(value))
+    return value
+
+
+def _tuple_source(items):
+    """ source of a tuple display. (a,) and () need care """
+    if len(items) == 1:
+        return '({0},)'.format(items[0])
+    return '({0})'.format(', '.join(items))
+
+
+class SpecializeTransformer(EagerTransformer):
+    """
+    Substitute constant parameters and resolve type checks on parameters
+    with known types.
+
+    constants : {param: value}
+    types : {param: type}
+    namespace : globals used to resolve the classes in type checks
+    """
+    def __init__(self, table, func_scope, constants, types, namespace):
+        super().__init__()
+        self.table = table
+        self.func_scope = func_scope
+        self.constants = constants
+        self.types = types
+        self.namespace = namespace
+
+    def resolves_to_param(self, node):
+        """ whether a Name load refers to the parameter of the function """
+        try:
+            scope = self.table.scope_of(node)
+        except KeyError:
+            return False
+        name = node.id
+        if scope is self.func_scope:
+            return True
+        return name in scope.free and _free_owner(scope, name) \
+            is self.func_scope
+
+    def param_type(self, node):
+        if not isinstance(node, ast.Name) or node.id not in self.types:
+            return _missing
+        if not self.resolves_to_param(node):
+            return _missing
+        return self.types[node.id]
+
+    def resolve_class(self, node):
+        """ class a Name/Tuple of global names refers to """
+        if isinstance(node, ast.Tuple):
+            classes = tuple(map(self.resolve_class, node.elts))
+            if any(c is _missing for c in classes):
+                return _missing
+            return classes
+
+        if not isinstance(node, ast.Name):
+            return _missing
+        try:
+            scope = self.table.scope_of(node)
+        except KeyError:
+            return _missing
+        if node.id not in scope.globals:
+            return _missing
+
+        obj = self.namespace.get(node.id, _missing)
+        if obj is _missing:
+            obj = getattr(builtins, node.id, _missing)
+        if not isinstance(obj, type):
+            return _missing
+        return obj
+
+    def visit_Name(self, node, meta):
+        if not isinstance(node.ctx, ast.Load):
+            return node
+        value = self.constants.get(node.id, _missing)
+        if value is _missing or not self.resolves_to_param(node):
+            return node
+        return ast.copy_location(ast.Constant(value=value), node)
+
+    def is_builtin(self, node, obj):
+        """ whether node is a Name that refers to the builtin obj """
+        if not isinstance(node, ast.Name) or node.id != obj.__name__:
+            return False
+        try:
+            scope = self.table.scope_of(node)
+        except KeyError:
+            return False
+        if node.id not in scope.globals:
+            return False
+        return self.namespace.get(node.id, obj) is obj
+
+    def visit_Call(self, node, meta):
+        # isinstance(param, cls)
+        if not self.is_builtin(node.func, isinstance):
+            return node
+        if len(node.args) != 2 or node.keywords:
+            return node
+
+        param_type = self.param_type(node.args[0])
+        classes = self.resolve_class(node.args[1])
+        if param_type is _missing or classes is _missing:
+            return node
+        result = issubclass(param_type, classes)
+        return ast.copy_location(ast.Constant(value=result), node)
+
+    def visit_Compare(self, node, meta):
+        # type(param) is cls
+        if len(node.ops) != 1:
+            return node
+        if not isinstance(node.ops[0], (ast.Is, ast.IsNot, ast.Eq, ast.NotEq)):
+            return node
+
+        left = node.left
+        if not (isinstance(left, ast.Call)
+                and self.is_builtin(left.func, type)
+                and len(left.args) == 1 and not left.keywords):
+            return node
+
+        param_type = self.param_type(left.args[0])
+        cls = self.resolve_class(node.comparators[0])
+        if param_type is _missing or cls is _missing \
+           or isinstance(cls, tuple):
+            return node
+
+        result = param_type is cls
+        if isinstance(node.ops[0], (ast.IsNot, ast.NotEq)):
+            result = not result
+        return ast.copy_location(ast.Constant(value=result), node)
+
+
+def _free_owner(scope, name):
+    """ function scope that holds the cell for a free name """
+    parent = scope.parent
+    while parent is not None:
+        if parent.kind != 'class' and name in parent.cells:
+            return parent
+        parent = parent.parent
+
+
+def _rebound_params(func_def):
+    """
+    Parameters that are assigned to in the function. Same named locals of
+    nested scopes count too, which only makes this more conservative.
+    """
+    params = {
+        arg.arg for arg in
+        func_def.args.posonlyargs + func_def.args.args
+        + func_def.args.kwonlyargs
+    }
+
+    rebound = set()
+    for node in ast.walk(func_def):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            if node.id in params:
+                rebound.add(node.id)
+        elif isinstance(node, (ast.Nonlocal, ast.Global)):
+            rebound.update(params.intersection(node.names))
+    return rebound
+
+
+def specialize_code(code, constants=None, types=None, namespace=None):
+    """
+    Specialize the function definition in code in place. Can be used as a
+    func_rewrite transform with functools.partial.
+
+    constants : {param: value}
+        parameters that always have this value
+    types : {param: type}
+        parameters that always have exactly this type
+    namespace : dict
+        globals of the function. Used to resolve type checks.
+    """
+    constants = constants or {}
+    types = types or {}
+    namespace = namespace or {}
+
+    if isinstance(code, ast.Module):
+        func_def = code.body[0]
+    else:
+        func_def = code
+
+    rebound = _rebound_params(func_def)
+    constants = {
+        name: value for name, value in constants.items()
+        if name not in rebound and _safe_value(value)
+    }
+    types = {
+        name: value for name, value in types.items()
+        if name not in rebound
+    }
+
+    if constants or types:
+        # defaults and annotations are evaluated outside of the function so
+        # only the body is affected
+        table = SymbolTable(code)
+        specializer = SpecializeTransformer(
+            table,
+            table.scopes[func_def],
+            constants,
+            types,
+            namespace,
+        )
+        transform(code, specializer)
+
+    fold_constants(code)
+    return code
+
+
+class Specialized:
+    """
+    State behind a specialize decorated function. Keeps the generic
+    function, call counts per key and the compiled variants. The decorated
+    function itself is a generated dispatcher. See dispatcher.
+
+    Thread safety: calls can run from several threads. Another thread can
+    evict a variant between its lookup and it being marked as recently
+    used. That call still runs the variant it got.
+    """
+    def __init__(self, func, constants=(), threshold=10, maxsize=8):
+        self.func = func
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.variants = OrderedDict()
+        self.counts = {}
+
+        self.signature = inspect.signature(func)
+        params = list(self.signature.parameters.values())
+        self.positional = [
+            p.name for p in params
+            if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)
+        ]
+        self.keyword_names = {
+            p.name for p in params
+            if p.kind in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY)
+        }
+        self.defaults = {
+            p.name: p.default for p in params
+            if p.default is not p.empty
+        }
+
+        for name in constants:
+            if name not in self.signature.parameters:
+                raise ValueError("{0} is not a parameter of {1}".format(
+                    name, func.__name__))
+        self.constants = [
+            (name, self._position(name)) for name in constants
+        ]
+
+        self._code = None
+        self.disabled = False
+
+    def _position(self, name):
+        if name in self.positional:
+            return self.positional.index(name)
+        return None
+
+    def key(self, args, kwargs):
+        """
+        Guard key for a call. The types of the arguments plus the values of
+        the constant parameters.
+        """
+        key = tuple(map(type, args))
+        if kwargs:
+            key += tuple((k, type(v)) for k, v in kwargs.items())
+        for name, index in self.constants:
+            if index is not None and index < len(args):
+                value = args[index]
+            else:
+                value = kwargs.get(name, _missing)
+            key += (_constant_key(value),)
+        return key
+
+    def call(self, args, kwargs):
+        """ dispatch without a generated guard """
+        if self.disabled:
+            return self.func(*args, **kwargs)
+
+        try:
+            key = self.key(args, kwargs)
+            variant = self.variants.get(key)
+        except TypeError:
+            # unhashable constant
+            return self.func(*args, **kwargs)
+
+        if variant is not None:
+            try:
+                self.variants.move_to_end(key)
+            except KeyError:
+                # evicted by another thread since the get
+                pass
+            return variant(*args, **kwargs)
+        return self.miss(key, args, kwargs)
+
+    def miss(self, key, args, kwargs=None):
+        """ count a call without a variant and build one once it's hot """
+        kwargs = kwargs or {}
+        if self.disabled:
+            return self.func(*args, **kwargs)
+
+        count = self.counts.get(key, 0) + 1
+        if count < self.threshold:
+            if len(self.counts) > self.maxsize * 10:
+                # one off keys shouldn't pile up
+                self.counts.clear()
+            self.counts[key] = count
+            return self.func(*args, **kwargs)
+
+        self.counts.pop(key, None)
+        variant = self.build(args, kwargs)
+        if variant is None:
+            return self.func(*args, **kwargs)
+
+        self.variants[key] = variant
+        if len(self.variants) > self.maxsize:
+            try:
+                self.variants.popitem(last=False)
+            except KeyError:
+                # emptied by another thread
+                pass
+        return variant(*args, **kwargs)
+
+    def call_values(self, args, kwargs):
+        """ {param: value} for the named parameters of a call """
+        values = dict(zip(self.positional, args))
+        for name, value in kwargs.items():
+            if name in self.keyword_names:
+                values[name] = value
+        return values
+
+    def build(self, args, kwargs):
+        """
+        Compile the variant for a call. None if the function can't be
+        specialized.
+        """
+        try:
+            if self._code is None:
+                self._code = ast.parse(get_source(self.func))
+        except (OSError, TypeError, SyntaxError):
+            self.disabled = True
+            return None
+
+        values = self.call_values(args, kwargs)
+        types = {name: type(value) for name, value in values.items()}
+
+        constants = {}
+        for name, _ in self.constants:
+            value = values.get(name, _missing)
+            if value is _missing:
+                value = self.defaults.get(name, _missing)
+            if value is not _missing:
+                constants[name] = value
+
+        code = copy.deepcopy(self._code)
+        specialize_code(code, constants, types, self.func.__globals__)
+        return create_function(code, func=self.func)
+
+    def cache_clear(self):
+        self.variants.clear()
+        self.counts.clear()
+
+    def dispatcher(self):
+        """
+        Generate the dispatch function.
+
+        When func only has regular parameters, the dispatcher mirrors its
+        signature and the guard key is built inline.
+
+        def dispatch(data, mode):
+            key = (type(data), type(mode), mode)
+            ...
+            return variant(data, mode)
+
+        Otherwise every call goes through call.
+        """
+        params = self.signature.parameters.values()
+        mirror = all(p.kind == p.POSITIONAL_OR_KEYWORD for p in params)
+        if not mirror:
+            source = dedent("""
+            def dispatch(*args, **kwargs):
+                return _asttools_call(args, kwargs)
+            """)
+        else:
+            names = self.positional
+            key_items = ['_asttools_type({0})'.format(name) for name in names]
+            key_items += [
+                '_asttools_constant_key({0})'.format(name)
+                for name, _ in self.constants
+            ]
+            source = dedent("""
+            def dispatch({args}):
+                key = {key}
+                try:
+                    variant = _asttools_get(key)
+                except TypeError:
+                    return _asttools_func({args})
+                if variant is None:
+                    return _asttools_miss(key, {arg_tuple})
+                try:
+                    _asttools_move_to_end(key)
+                except KeyError:
+                    pass
+                return variant({args})
+            """).format(
+                args=', '.join(names),
+                key=_tuple_source(key_items),
+                arg_tuple=_tuple_source(names),
+            )
+
+        namespace = {
+            '_asttools_get': self.variants.get,
+            '_asttools_move_to_end': self.variants.move_to_end,
+            '_asttools_call': self.call,
+            '_asttools_miss': self.miss,
+            '_asttools_func': self.func,
+            '_asttools_type': type,
+            '_asttools_constant_key': _constant_key,
+        }
+        dispatch = create_function(source, globals=namespace)
+        if mirror:
+            dispatch.__defaults__ = self.func.__defaults__
+        functools.update_wrapper(dispatch, self.func)
+        dispatch.specialized = self
+        dispatch.variants = self.variants
+        dispatch.cache_clear = self.cache_clear
+        return dispatch
+
+
+def specialize(func=None, constants=(), threshold=10, maxsize=8):
+    """
+    Decorator that compiles specialized variants of func for its hot
+    argument types and constant values.
+
+    constants : list of str
+        parameters whose values are part of the guard and substituted into
+        the variants. Values must be hashable.
+    threshold : int
+        calls with the same key before a variant is compiled
+    maxsize : int
+        number of variants to keep. Least recently used are evicted first.
+
+    The returned function has the Specialized state as .specialized and its
+    variants as .variants.
+    """
+    if isinstance(constants, str):
+        constants = [constants]
+
+    def _wrapper(func):
+        specialized = Specialized(
+            func,
+            constants=constants,
+            threshold=threshold,
+            maxsize=maxsize,
+        )
+        return specialized.dispatcher()
+
+    if func is None:
+        return _wrapper
+    return _wrapper(func)
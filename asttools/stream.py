@@ -0,0 +1,137 @@
+"""
+Parse and walk large sources one top-level statement at a time.
+
+    with open('generated.py') as f:
+        for item in stream_walk(f):
+            ...
+
+The source is tokenized lazily and split where a top-level statement ends.
+Only the lines of the current statement are held, and every statement is
+parsed on its own, so peak memory is bounded by the largest statement
+instead of the whole file. Line numbers match the original source.
+"""
+import ast
+import io
+import tokenize
+
+from .graph import AstGraphWalker
+
+# keywords that continue the compound statement before them
+_continuations = frozenset(['else', 'elif', 'except', 'finally'])
+
+_skipped_tokens = frozenset([tokenize.NL, tokenize.COMMENT])
+
+
+def _readline(source):
+    if isinstance(source, str):
+        return io.StringIO(source).readline
+    if hasattr(source, 'readline'):
+        return source.readline
+    raise TypeError("source must be a str or have a readline")
+
+
+def iter_statement_sources(source):
+    """
+    yield (lineno, text) for every top-level statement of source. Decorators
+    stay with their def and comments before a statement go with it.
+    Statements on one line separated by ; come out together.
+
+    source : str or file-like with readline
+    """
+    readline = _readline(source)
+    buffer = []
+    # line number of buffer[0]
+    first_line = 1
+
+    def reader():
+        line = readline()
+        if line:
+            buffer.append(line)
+        return line
+
+    depth = 0
+    # last line of a finished statement, pending the next token
+    pending = None
+    last_newline = 0
+    line_start = True
+    decorator = False
+
+    try:
+        for token in tokenize.generate_tokens(reader):
+            token_type = token.type
+            if token_type in _skipped_tokens:
+                continue
+
+            if token_type == tokenize.INDENT:
+                depth += 1
+                pending = None
+                continue
+
+            if token_type == tokenize.DEDENT:
+                depth -= 1
+                if depth == 0:
+                    pending = last_newline
+                continue
+
+            if token_type == tokenize.NEWLINE:
+                last_newline = token.start[0]
+                line_start = True
+                if depth == 0 and not decorator:
+                    pending = last_newline
+                continue
+
+            if token_type == tokenize.ENDMARKER:
+                break
+
+            if pending is not None:
+                if token_type != tokenize.NAME \
+                   or token.string not in _continuations:
+                    count = pending - first_line + 1
+                    yield first_line, ''.join(buffer[:count])
+                    del buffer[:count]
+                    first_line = pending + 1
+                pending = None
+
+            if line_start:
+                decorator = depth == 0 and token.string == '@'
+                line_start = False
+    except tokenize.TokenError as e:
+        msg, (lineno, offset) = e.args
+        raise SyntaxError(msg, ('<stream>', lineno, offset, None))
+
+    text = ''.join(buffer)
+    if text.strip():
+        yield first_line, text
+
+
+def iter_statements(source):
+    """
+    yield an ast.Module for every top-level statement of source. Line
+    numbers are those of the whole source. See iter_statement_sources.
+    """
+    for lineno, text in iter_statement_sources(source):
+        try:
+            module = ast.parse(text)
+        except SyntaxError as e:
+            if e.lineno is not None:
+                e.lineno += lineno - 1
+            raise
+        if not module.body:
+            # only comments
+            continue
+        ast.increment_lineno(module, lineno - 1)
+        yield module
+
+
+def stream_walk(source):
+    """
+    graph_walk that parses and walks source one top-level statement at a
+    time. Items are the same as graph_walk's except that the parent of a
+    top-level statement is the Module of its own chunk. Nothing holds on to
+    a statement after its items are yielded.
+
+    source : str or file-like with readline
+    """
+    for module in iter_statements(source):
+        walker = AstGraphWalker(module)
+        yield from walker.process()
@@ -1,4 +1,5 @@
 import ast
+import io
 from textwrap import dedent
 
 # TODO
@@ -8,6 +9,10 @@ import pandas as pd
 import numpy as np
 
 import collections
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 
 from asttools import (
@@ -16,14 +21,18 @@ from asttools import (
     _convert_to_expression,
     ast_source,
     ast_equal,
+    indented,
     ast_contains,
+    ast_fingerprint,
     code_context_subset,
     generate_getter_var,
     generate_getter_lazy,
     graph_walk
 )
 
-from ..graph import NodeLocation
+from ..fingerprint import shape_ids
+from ..graph import AstGraphWalker, NodeLocation, ParentMap
+from .. import replace_node, delete_node
 
 
 class TestEval:
@@ -68,6 +77,91 @@ def test_ast_source_expression():
     assert source == ast_source(expr)
 
 
+def test_ast_source_mutation():
+    """
+    ast_source is used to look at trees while they're being changed, so it
+    must never return a stale render.
+    """
+    code = ast.parse("a + b")
+    assert ast_source(code) == 'a + b'
+
+    code.body[0].value.left.id = 'c'
+    assert ast_source(code) == 'c + b'
+
+
+def test_ast_source_abbreviated():
+    source = """
+    def bob(x):
+        a = x + 1
+        b = a * 2
+        c = b - 3
+        return c
+    """
+    code = ast.parse(dedent(source))
+    abbrev = ast_source(code, max_depth=2, max_items=2)
+    assert abbrev == dedent("""
+    def bob(x):
+        ...
+        ...
+        ...
+    """).strip()
+
+    abbrev = ast_source(code, max_depth=3, max_items=2)
+    assert abbrev == dedent("""
+    def bob(x):
+        ... = ...
+        ... = ...
+        ...
+    """).strip()
+
+    code = ast.parse("test(1, 2, 3, np.random.randn(10, 10))")
+    assert ast_source(code, max_items=2) == "test(1, 2, ...)"
+    assert ast_source(code, max_depth=3) == "...(..., ..., ..., ...)"
+
+
+def test_indented():
+    source = """
+    a = foo(1, b.c)
+    if x:
+        pass
+    """
+    out = io.StringIO()
+    indented(dedent(source), file=out)
+    assert out.getvalue() == dedent("""\
+     body[0] = Assign
+       targets[0] = Name(id=a)
+         ctx = Store
+       value = Call
+         func = Name(id=foo)
+         args[0] = Constant(value=1)
+         args[1] = Attribute(attr=c)
+           value = Name(id=b)
+     body[1] = If
+       test = Name(id=x)
+       body[0] = Pass
+    """)
+
+    out = io.StringIO()
+    indented(dedent(source), file=out, max_depth=1, compact=True)
+    assert out.getvalue().splitlines() == [
+        "0 body[0] = Assign",
+        "1 targets[0] = Name(id=a)",
+        "1 value = Call",
+        "0 body[1] = If",
+        "1 test = Name(id=x)",
+        "1 body[0] = Pass",
+    ]
+
+    out = io.StringIO()
+    indented(dedent(source), file=out, node_types=ast.Name, compact=True)
+    assert out.getvalue().splitlines() == [
+        "1 targets[0] = Name(id=a)",
+        "2 func = Name(id=foo)",
+        "3 value = Name(id=b)",
+        "1 test = Name(id=x)",
+    ]
+
+
 def test_ast_equal():
     source = """test(np.random.randn(10, 10))"""
     code1 = ast.parse(source, mode='eval')
@@ -88,6 +182,56 @@ def test_ast_equal():
     assert ast_equal(code3.body.args[0], code4.body)
 
 
+def test_ast_equal_constants():
+    """
+    Previously ast_field_equal asserted on the scalar types and would barf
+    on bytes and complex.
+    """
+    for source in ["b'dale'", "1j", "...", "None", "'dale'", "1.5"]:
+        code1 = ast.parse(source, mode='eval')
+        code2 = ast.parse(source, mode='eval')
+        assert ast_equal(code1, code2)
+
+    assert not ast_equal(ast.parse("b'dale'"), ast.parse("b'bob'"))
+    assert not ast_equal(ast.parse("1j"), ast.parse("2j"))
+    # same value but different types
+    assert not ast_equal(ast.parse("1"), ast.parse("True"))
+    assert not ast_equal(ast.parse("1"), ast.parse("1.0"))
+
+
+def test_ast_equal_hand_built():
+    """
+    Optional fields like Constant.kind default to None on the class, so a
+    hand built node doesn't have them in its __dict__.
+    """
+    parsed = ast.parse('1', mode='eval').body
+    built = ast.Constant(value=1)
+    assert 'kind' not in built.__dict__
+    assert ast_equal(parsed, built)
+    assert ast_fingerprint(parsed) == ast_fingerprint(built)
+
+    parsed = ast.parse("def f(x):\n    return x").body[0]
+    built = ast.FunctionDef(
+        name='f',
+        args=ast.arguments(
+            posonlyargs=[], args=[ast.arg(arg='x')], kwonlyargs=[],
+            kw_defaults=[], defaults=[],
+        ),
+        body=[ast.Return(value=ast.Name(id='x', ctx=ast.Load()))],
+        decorator_list=[],
+    )
+    assert ast_equal(parsed, built)
+    assert ast_fingerprint(parsed) == ast_fingerprint(built)
+
+
+def test_ast_equal_list_length():
+    code1 = ast.parse("test(1, 2)", mode='eval')
+    code2 = ast.parse("test(1, 2, 3)", mode='eval')
+    assert not ast_equal(code1, code2)
+    assert not ast_equal(code2, code1)
+    assert ast_equal(code1, code1)
+
+
 def test_ast_contains():
     source1 = """test(np.random.randn(10, 11)) + test2 / 99"""
     code1 = ast.parse(source1, mode='eval').body
@@ -185,6 +329,57 @@ def test_ast_contains_ignore_names_multi():
     assert len(matches) == 3
 
 
+def test_ast_contains_ignore_names_consistent():
+    """
+    ignore_var_names requires the renaming to be consistent.
+    """
+    mod = ast.parse("(a + b) + (c + c)")
+
+    test = ast.parse("x + x")
+    matches = list(ast_contains(mod, test, ignore_var_names=True))
+    assert len(matches) == 1
+    assert ast_source(matches[0]['node']) == 'c + c'
+    assert matches[0]['load_names'] == ['c']
+
+    test = ast.parse("x + y")
+    matches = list(ast_contains(mod, test, ignore_var_names=True))
+    assert [m['load_names'] for m in matches] == [['a', 'b']]
+
+
+def test_ast_fingerprint():
+    key1, names1 = ast_fingerprint(ast.parse("a + b * a"), alpha=True)
+    key2, names2 = ast_fingerprint(ast.parse("x + y * x"), alpha=True)
+    key3, _ = ast_fingerprint(ast.parse("x + y * y"), alpha=True)
+    assert key1 == key2
+    assert hash(key1) == hash(key2)
+    assert key1 != key3
+    assert dict(zip(names1, names2)) == {'a': 'x', 'b': 'y'}
+
+    # without alpha, names are part of the key
+    assert ast_fingerprint(ast.parse("a + b"))[0] \
+        != ast_fingerprint(ast.parse("x + y"))[0]
+    assert ast_fingerprint(ast.parse("a + b"))[0] \
+        == ast_fingerprint(ast.parse("a + b"))[0]
+
+    # constants of equal value but different type
+    assert ast_fingerprint(ast.parse("1"))[0] \
+        != ast_fingerprint(ast.parse("True"))[0]
+
+
+def test_shape_ids():
+    table = {}
+    left = ast.parse("a + b * a").body[0].value
+    right = ast.parse("x + y * y").body[0].value
+    left_ids = shape_ids(left, table)
+    right_ids = shape_ids(right, table)
+    # names don't count, so both have the same shape
+    assert left_ids[left] == right_ids[right]
+    assert left_ids[left.right] == right_ids[right.right]
+    assert left_ids[left] != left_ids[left.right]
+    other = ast.parse("x - y * y").body[0].value
+    assert shape_ids(other, table)[other] != right_ids[right]
+
+
 def test_ast_graph_walk():
     source = """
     test(np.random.randn(10, 11))
@@ -220,6 +415,158 @@ def test_ast_graph_walk():
     # using type order to check that the type ordering is stable..
     assert list(map(type, graph_nodes)) == graph_types
 
+def _walk_records(mod):
+    return [
+        (item['node'], item['parent'], item['field_name'],
+         item['field_index'], item['depth'], item['line'])
+        for item in graph_walk(mod)
+    ]
+
+
+def test_ast_graph_walker_reentrant():
+    source = """
+    def bob(x):
+        return x + frank(lambda y: y * 2)
+    a = bob(1)
+    """
+    mod = ast.parse(dedent(source))
+    walker = AstGraphWalker(mod)
+
+    first = list(walker.process())
+    # a walker can be processed again and walks can be interleaved
+    gen1 = walker.process()
+    gen2 = walker.process()
+    interleaved = []
+    for item1, item2 in zip(gen1, gen2):
+        assert item1['node'] is item2['node']
+        interleaved.append(item1)
+    assert [i['node'] for i in interleaved] == [i['node'] for i in first]
+
+    depths = {item['node']: item['depth'] for item in first}
+    func_def, assign = mod.body
+    assert depths[func_def] == 0
+    assert depths[func_def.body[0]] == 1
+    assert depths[assign.value.func] == 2
+    lines = {item['node']: item['line'] for item in first}
+    assert lines[func_def.body[0].value] is func_def
+    assert lines[assign.value] is assign
+
+
+def test_ast_graph_walker_subclass():
+    """ visit_* overrides with the old signature still work """
+    class SkipLambdas(AstGraphWalker):
+        def __init__(self, code):
+            super().__init__(code)
+            self.depths = []
+
+        def visit_Lambda(self, node, parent, field_name, field_index):
+            self.depths.append(self.current_depth)
+            return
+            yield
+
+    source = """
+    def bob(x):
+        return x + frank(lambda y: y * 2)
+    a = bob(1)
+    """
+    mod = ast.parse(dedent(source))
+    walker = SkipLambdas(mod)
+    assert walker.lines is None
+    items = list(walker.process())
+    assert not any(isinstance(item['node'], ast.Lambda) for item in items)
+    # depth of the frank call it's an argument of
+    assert walker.depths == [3]
+    assert walker._processed
+    assert [item['node'] for item in walker.lines] == mod.body
+
+
+def test_graph_walk_concurrent():
+    source = "\n".join(
+        "x{0} = foo(a.b[{0}], c * {0}) + bar(d)".format(i) for i in range(50)
+    )
+    mod = ast.parse(source)
+    expected = _walk_records(mod)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: _walk_records(mod), range(16)))
+
+    for result in results:
+        assert result == expected
+
+
+@pytest.mark.skipif(
+    getattr(sys, '_is_gil_enabled', lambda: True)(),
+    reason="throughput only scales on free-threaded builds",
+)
+def test_graph_walk_concurrent_scaling():
+    source = "\n".join(
+        "x{0} = foo(a.b[{0}], c * {0}) + bar(d)".format(i)
+        for i in range(2000)
+    )
+    mod = ast.parse(source)
+    workers = 4
+
+    def run(n):
+        with ThreadPoolExecutor(max_workers=n) as pool:
+            start = time.perf_counter()
+            list(pool.map(lambda _: _walk_records(mod), range(workers)))
+            return time.perf_counter() - start
+
+    serial = run(1)
+    parallel = run(workers)
+    assert parallel < serial / 1.5
+
+
+def test_parent_map():
+    source = """
+    def bob(x):
+        return x + frank(lambda y: y * 2)
+    """
+    mod = ast.parse(dedent(source))
+    parent_map = ParentMap(mod)
+
+    func_def = mod.body[0]
+    ret = func_def.body[0]
+    binop = ret.value
+    lambda_node = binop.right.args[0]
+    y_load = lambda_node.body.left
+
+    assert parent_map.parent(func_def) is mod
+    assert parent_map.parent(mod) is None
+    assert parent_map.location(binop) == NodeLocation(ret, 'value', None)
+    assert parent_map.location(lambda_node) == \
+        NodeLocation(binop.right, 'args', 0)
+
+    ancestors = list(parent_map.ancestors(y_load))
+    assert ancestors[-3:] == [ret, func_def, mod]
+    assert parent_map.enclosing_statement(y_load) is ret
+    assert parent_map.enclosing_function(y_load) is lambda_node
+    assert parent_map.enclosing_function(binop) is func_def
+
+    # every non-shared node is tracked
+    for item in graph_walk(mod):
+        node = item['node']
+        if node in parent_map:
+            assert parent_map.parent(node) is item['parent']
+
+
+def test_parent_map_replace_delete():
+    mod = ast.parse("a = 1\nb = 2\nc = 3")
+    parent_map = ParentMap(mod)
+    first, second, third = mod.body
+
+    new_value = ast.parse("x + 1", mode='eval').body
+    replace_node(first, 'value', None, new_value, parent_map=parent_map)
+    assert parent_map.parent(new_value) is first
+    assert parent_map.parent(new_value.left) is new_value
+
+    delete_node(mod, 'body', 1, second, parent_map=parent_map)
+    assert second not in parent_map
+    assert second.targets[0] not in parent_map
+    # siblings shifted
+    assert parent_map.location(third) == NodeLocation(mod, 'body', 1)
+
+
 def test_code_context_subset():
     df = pd.DataFrame(np.random.randn(30, 3), columns=['a', 'bob', 'c'])
     ns = {
@@ -1,5 +1,9 @@
 import ast
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
+from inspect import Parameter, _empty
 from textwrap import dedent
 from itertools import zip_longest, starmap
 
@@ -8,12 +12,16 @@ import pytest
 from .. import get_source, quick_parse, Matcher
 from ..function import (
     create_function,
+    create_functions,
     func_rewrite,
+    wait_rewrites,
     func_def_args,
     func_args_realizer,
     add_call_kwargs,
     add_call_starargs,
     ast_sigparams,
+    ast_signature,
+    call_bindings,
     get_call_kwargs,
     get_call_starargs,
 )
@@ -60,11 +68,33 @@ def test_create_function_source():
     source = "def walk(): return AST"
     new_func = create_function(source, ast.walk)
     correct = ast.parse(source)
-    test = ast.parse(new_func.__asttools_source__)
+    # source is only generated on first access
+    assert not hasattr(new_func, '__asttools_source__')
+    test = ast.parse(get_source(new_func))
     assert ast.dump(test) == ast.dump(correct)
+    assert new_func.__asttools_source__ == get_source(new_func)
     # should grab AST form the ast.walk global namespace
 
 
+def test_create_function_source_threads():
+    new_funcs = [
+        create_function("def walk(): return {0}".format(i), ast.walk)
+        for i in range(20)
+    ]
+    barrier = threading.Barrier(4)
+
+    def read_all():
+        barrier.wait()
+        return [get_source(func) for func in new_funcs]
+
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: read_all(), range(4)))
+
+    expected = ["def walk():\n    return {0}".format(i) for i in range(20)]
+    assert all(result == expected for result in results)
+    assert all(hasattr(func, '__asttools_ast__') for func in new_funcs)
+
+
 def test_wrap():
     def capture_transform(code):
         @coroutine.wrap
@@ -180,6 +210,44 @@ def test_argsepc_equal():
         ast_sigparam_case(source)
 
 
+def test_ast_sigparams_kinds():
+    func_def = quick_parse(
+        "def func(a, b=1, /, c=-2, d=(1, 2), *args, e, f=x, g='g', **kw):"
+        " pass"
+    )
+    sigparams = ast_sigparams(func_def)
+    kinds = {name: param.kind for name, param in sigparams.items()}
+    assert kinds == {
+        'a': Parameter.POSITIONAL_ONLY,
+        'b': Parameter.POSITIONAL_ONLY,
+        'c': Parameter.POSITIONAL_OR_KEYWORD,
+        'd': Parameter.POSITIONAL_OR_KEYWORD,
+        'args': Parameter.VAR_POSITIONAL,
+        'e': Parameter.KEYWORD_ONLY,
+        'f': Parameter.KEYWORD_ONLY,
+        'g': Parameter.KEYWORD_ONLY,
+        'kw': Parameter.VAR_KEYWORD,
+    }
+    assert sigparams['a'].default is _empty
+    assert sigparams['b'].default == 1
+    assert sigparams['c'].default == -2
+    assert sigparams['d'].default == (1, 2)
+    assert sigparams['e'].default is _empty
+    # not a literal, so we get the node
+    assert isinstance(sigparams['f'].default, ast.Name)
+    assert sigparams['g'].default == 'g'
+
+
+def test_ast_sigparams_call_constant_args():
+    call = quick_parse("func(1, bob, x + 1, key=-1)").value
+    sigparams = ast_sigparams(call)
+    assert list(sigparams) == ['_0', 'bob', '_2', 'key']
+    assert sigparams['_0'].kind == Parameter.POSITIONAL_ONLY
+    assert sigparams['_0'].default == 1
+    assert isinstance(sigparams['_2'].default, ast.BinOp)
+    assert sigparams['key'].default == -1
+
+
 def test_create_function_method_super():
     """
     The only caveat with creating functions is when you have to deal with
@@ -219,9 +287,11 @@ def test_create_function_ignore_closure():
         self.new_init = True
 
     source = get_source(_init)
-    with pytest.raises(ValueError, match="requires closure of length 0"):
-        new_init = create_function(source, Obj.old_init)
-        # fails
+    # dropping free variables is fine, the unused cells are left out
+    new_init = create_function(source, Obj.old_init)
+    assert new_init.__closure__ is None
+    Obj.__init__ = new_init
+    assert Obj().new_init
 
     new_init = create_function(source, Obj.old_init, ignore_closure=True)
     Obj.__init__ = new_init
@@ -229,6 +299,275 @@ def test_create_function_ignore_closure():
     assert Obj().new_init  # yay
 
 
+def test_create_functions():
+    class Obj:
+        def __init__(self):
+            super().__init__()
+
+    def _init(self):
+        super().__init__()
+        self.new_init = True
+
+    def helper(x):
+        return x + 1
+
+    source = "\n".join([get_source(_init), get_source(helper)])
+    new_funcs = create_functions(
+        [source, "def other(): return 3"],
+        funcs={'_init': Obj.__init__},
+    )
+    assert list(new_funcs) == ['_init', 'helper', 'other']
+    assert new_funcs['helper'](1) == 2
+    assert new_funcs['other']() == 3
+
+    # super() closure is handled the same as create_function
+    Obj.__init__ = new_funcs['_init']
+    assert Obj().new_init
+
+    # all share the template globals
+    assert new_funcs['other'].__globals__ is globals()
+
+    # source is per function, not the batched module
+    test = ast.parse(get_source(new_funcs['helper']))
+    assert ast.dump(test) == ast.dump(ast.parse(get_source(helper)))
+
+    with pytest.raises(ValueError, match="Duplicate"):
+        create_functions(["def bob(): pass", "def bob(): pass"])
+
+
+def test_create_function_closure():
+    """
+    Closures other than super() reuse the cells of the template function.
+    """
+    def outer():
+        count = 0
+        offset = 10
+
+        def inner(x, y=offset):
+            return x + y + count
+
+        def bump():
+            nonlocal count
+            count += 1
+
+        return inner, bump
+
+    inner, bump = outer()
+    code = ast.parse(get_source(inner))
+    code.body[0].body.insert(0, quick_parse("x *= 2"))
+    new_inner = create_function(code, func=inner)
+
+    assert new_inner(1) == 12
+    # cells are shared with the original enclosing scope
+    bump()
+    assert inner(1) == 12
+    assert new_inner(1) == 13
+
+
+def test_func_rewrite_closure_cached():
+    calls = []
+
+    def double_return(code):
+        calls.append(code)
+
+        def visitor(node, meta):
+            if isinstance(node, ast.Return):
+                node.value = ast.BinOp(
+                    left=node.value, op=ast.Mult(), right=ast.Constant(2)
+                )
+            return node
+        return transform(code, visitor)
+
+    def outer(value):
+        @func_rewrite(double_return)
+        def inner():
+            return value
+        return inner
+
+    # the decorator is created once
+    rewrite = func_rewrite(double_return)
+
+    def outer2(value):
+        def inner():
+            return value + 1
+        return rewrite(inner)
+
+    # the decorator is created per outer call but shares the cache
+    assert outer(1)() == 2
+    assert outer(2)() == 4
+    assert len(calls) == 1
+
+    calls.clear()
+    assert outer2(1)() == 4
+    assert outer2(5)() == 12
+    # transform and compile only happen once
+    assert len(calls) == 1
+
+
+def test_func_rewrite_closure_drops_freevar():
+    def drop_if(code):
+        def visitor(node, meta):
+            if isinstance(node, ast.If):
+                return node.orelse
+            return node
+        return transform(code, visitor)
+
+    def outer(flag, value):
+        @func_rewrite(drop_if)
+        def inner():
+            if flag:
+                return -1
+            return value
+        return inner
+
+    for value in (1, 2):
+        inner = outer(True, value)
+        assert inner() == value
+        assert inner.__code__.co_freevars == ('value',)
+
+
+def test_func_rewrite_closure_defaults():
+    def bump_default(code):
+        def visitor(node, meta):
+            if isinstance(node, ast.arguments):
+                node.defaults = [ast.Constant(100)]
+            return node
+        return transform(code, visitor)
+
+    def identity(code):
+        return code
+
+    base = 5
+    local_default = 1
+
+    @func_rewrite(bump_default)
+    def changed(x=1):
+        return x + base
+
+    # the default refers to a local that isn't a free variable
+    @func_rewrite(identity)
+    def unchanged(x=local_default):
+        return x + base
+
+    assert changed() == 105
+    assert changed.__defaults__ == (100,)
+    assert unchanged() == 6
+    assert unchanged.__defaults__ == (1,)
+
+
+def double_return_transform(calls):
+    def double_return(code):
+        calls.append(threading.current_thread())
+
+        def visitor(node, meta):
+            if isinstance(node, ast.Return):
+                node.value = ast.BinOp(
+                    left=node.value, op=ast.Mult(), right=ast.Constant(2)
+                )
+            return node
+        return transform(code, visitor)
+    return double_return
+
+
+def test_func_rewrite_deferred_call():
+    calls = []
+
+    @func_rewrite(double_return_transform(calls), deferred='call')
+    def hello(value, extra=1):
+        """ doc """
+        return value + extra
+
+    # nothing happens until the first call
+    assert calls == []
+    assert hello.__name__ == 'hello'
+    assert hello.__doc__ == ' doc '
+    assert not hello.__asttools_deferred__.done()
+
+    assert hello(1) == 4
+    assert hello(1, extra=2) == 6
+    assert len(calls) == 1
+    assert hello.__asttools_deferred__.done()
+
+    with pytest.raises(ValueError):
+        func_rewrite(double_return_transform(calls), deferred='later')
+
+
+def test_func_rewrite_deferred_module_swap():
+    calls = []
+    namespace = {}
+    two = create_function("def two(): return 2", globals=namespace)
+    assert two.__globals__ is namespace
+
+    trampoline = func_rewrite(double_return_transform(calls),
+                              deferred='call')(two)
+    namespace['two'] = trampoline
+    assert trampoline() == 4
+    # the module name now points straight at the rewritten function
+    assert namespace['two'] is not trampoline
+    assert namespace['two'] is trampoline.__asttools_deferred__.new_func
+    assert namespace['two']() == 4
+    assert len(calls) == 1
+
+
+def test_func_rewrite_deferred_concurrent():
+    calls = []
+    started = threading.Event()
+
+    def slow_transform(code):
+        started.set()
+        time.sleep(0.05)
+        return double_return_transform(calls)(code)
+
+    @func_rewrite(slow_transform, deferred='call')
+    def hello(value):
+        return value
+
+    results = []
+
+    def worker(value):
+        results.append(hello(value))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # one rewrite and every caller got the rewritten function
+    assert len(calls) == 1
+    assert sorted(results) == [i * 2 for i in range(8)]
+
+
+def test_func_rewrite_deferred_background():
+    calls = []
+    rewrite = func_rewrite(double_return_transform(calls),
+                           deferred='background')
+
+    def one():
+        return 1
+
+    def two():
+        return 2
+
+    new_one = rewrite(one)
+    new_two = rewrite(two)
+    assert wait_rewrites() == 0
+    assert len(calls) == 2
+    assert all(thread is not threading.current_thread() for thread in calls)
+    assert new_one.__asttools_deferred__.done()
+    assert new_one() == 2
+    assert new_two() == 4
+
+    # errors surface when the function is called
+    def bad_transform(code):
+        raise ValueError('bad transform')
+
+    bad = func_rewrite(bad_transform, deferred='background')(one)
+    assert wait_rewrites() == 1
+    with pytest.raises(ValueError, match='bad transform'):
+        bad()
+
+
 def test_func_def_args():
     func_text = """
     def bob(arg1, arg2, kw1=None, k2=1, *args, **kwargs):
@@ -347,6 +686,161 @@ def test_get_call_kwargs():
         starargs = get_call_kwargs(call_node)  # noqa: F841
 
 
+def test_ast_signature_cached():
+    call_node = quick_parse("bob(l=1, m=2, *args)").value
+    sig = ast_signature(call_node)
+    assert ast_signature(call_node) is sig
+    assert get_call_starargs(call_node) == 'args'
+    assert get_call_kwargs(call_node) is None
+
+    # mutating the node invalidates the cached signature
+    add_call_kwargs(call_node, 'dct')
+    assert ast_signature(call_node) is not sig
+    assert get_call_kwargs(call_node) == 'dct'
+
+
+def test_ast_signature_renamed_in_place():
+    call_node = quick_parse("bob(a, b, c=1)").value
+    assert list(ast_sigparams(call_node)) == ['a', 'b', 'c']
+    call_node.args[0].id = 'x'
+    call_node.keywords[0].arg = 'y'
+    assert list(ast_sigparams(call_node)) == ['x', 'b', 'y']
+
+    call_node = quick_parse("bob([1, 2])").value
+    assert ast_sigparams(call_node)['_0'].default == [1, 2]
+    call_node.args[0].elts[0].value = 3
+    assert ast_sigparams(call_node)['_0'].default == [3, 2]
+
+    func_def = quick_parse("def func(a, b=1): pass")
+    call_node = quick_parse("func(1, 2)").value
+    assert list(ast_signature(func_def).bind(call_node)) == ['a', 'b']
+    func_def.args.args[0].arg = 'first'
+    assert list(ast_signature(func_def).bind(call_node)) == ['first', 'b']
+
+
+def test_ast_signature_bind():
+    func_def = quick_parse(
+        "def func(a, /, b, c=3, *args, d, e=5, **kwargs): pass"
+    )
+    sig = ast_signature(func_def)
+
+    def bind(call_text):
+        bound = sig.bind(quick_parse(call_text).value)
+        return {
+            name: ast.unparse(value) if isinstance(value, ast.AST)
+            else list(map(ast.unparse, value)) if isinstance(value, list)
+            else {k: ast.unparse(v) for k, v in value.items()}
+            for name, value in bound.items()
+        }
+
+    assert bind("func(1, 2, d=4)") == {
+        'a': '1', 'b': '2', 'c': '3', 'args': [],
+        'd': '4', 'e': '5', 'kwargs': {},
+    }
+    assert bind("func(1, 2, 3, 4, 5, d=x, b2=y)") == {
+        'a': '1', 'b': '2', 'c': '3', 'args': ['4', '5'],
+        'd': 'x', 'e': '5', 'kwargs': {'b2': 'y'},
+    }
+    # positional only passed as keyword goes to **kwargs
+    assert bind("func(1, b=2, d=4, a=0)")['kwargs'] == {'a': '0'}
+
+    with pytest.raises(TypeError, match="missing required argument: 'd'"):
+        bind("func(1, 2)")
+
+    with pytest.raises(TypeError, match="multiple values"):
+        bind("func(1, 2, b=2, d=4)")
+
+    with pytest.raises(ValueError):
+        bind("func(*stuff, d=4)")
+
+    func_def = quick_parse("def func(a, b=1): pass")
+    with pytest.raises(TypeError, match="takes 2 positional arguments"):
+        ast_signature(func_def).bind(quick_parse("func(1, 2, 3)").value)
+
+    with pytest.raises(TypeError, match="unexpected keyword"):
+        ast_signature(func_def).bind(quick_parse("func(1, c=3)").value)
+
+
+def test_call_bindings():
+    source = """
+    def main(data):
+        total = add(data, 1)
+        return scale(total, factor=2) + add(1, 2, 3) + len(data)
+
+    def add(a, b=10):
+        return a + b
+
+    def scale(x, *, factor):
+        return x * factor
+    """
+    records = {
+        ast.unparse(record['node']): record
+        for record in call_bindings(dedent(source))
+    }
+    # len is not defined in the module
+    assert set(records) == {
+        'add(data, 1)',
+        'scale(total, factor=2)',
+        'add(1, 2, 3)',
+    }
+
+    record = records['scale(total, factor=2)']
+    assert record['func_def'].name == 'scale'
+    assert record['error'] is None
+    bound = {k: ast.unparse(v) for k, v in record['bound'].items()}
+    assert bound == {'x': 'total', 'factor': '2'}
+
+    record = records['add(data, 1)']
+    bound = {k: ast.unparse(v) for k, v in record['bound'].items()}
+    assert bound == {'a': 'data', 'b': '1'}
+
+    # errors are reported per call site
+    record = records['add(1, 2, 3)']
+    assert record['bound'] is None
+    assert isinstance(record['error'], TypeError)
+
+
+def test_call_bindings_scopes():
+    source = """
+    def scale(x, factor=2):
+        return x * factor
+
+    class Model:
+        def scale(self, x):
+            return x
+
+        def run(self, x):
+            # the module scale, not the method
+            return scale(x, 3)
+
+    def outer(x):
+        def scale(y):
+            return y
+        return scale(x) + len(x)
+    """
+    records = {
+        ast.unparse(record['node']): record
+        for record in call_bindings(dedent(source))
+    }
+    assert set(records) == {'scale(x, 3)', 'scale(x)'}
+
+    record = records['scale(x, 3)']
+    bound = {k: ast.unparse(v) for k, v in record['bound'].items()}
+    assert bound == {'x': 'x', 'factor': '3'}
+
+    # the nested def shadows the module one
+    record = records['scale(x)']
+    bound = {k: ast.unparse(v) for k, v in record['bound'].items()}
+    assert bound == {'y': 'x'}
+
+
+def test_call_sigparams_name_collision():
+    sigparams = ast_sigparams(quick_parse("bob(1, _1, 3, _0=4)").value)
+    assert list(sigparams) == ['__0', '_1', '_2', '_0']
+    assert sigparams['__0'].kind == Parameter.POSITIONAL_ONLY
+    assert sigparams['_2'].default == 3
+
+
 if __name__ == '__main__':
     def func(arg1, arg2, *args, **kwargs):
         pass
@@ -0,0 +1,171 @@
+import ast
+import math
+from textwrap import dedent
+
+from ..common import get_source
+from ..inline import func_inline, get_helper, inline, inline_calls
+
+SCALE = 3
+
+
+def norm(x, y):
+    return math.sqrt(x * x + y * y)
+
+
+def pick(a, b):
+    return a if a > b else b
+
+
+@inline
+def scaled(v, factor=2):
+    """ multi statement helper """
+    out = v * factor
+    out += SCALE
+    return out
+
+
+def big(x):
+    return x + x + x + x + x + x + x + x + x + x + x + x + x + x + x + x
+
+
+def early(x):
+    if x:
+        return 1
+    return 2
+
+
+def shifted(obj, y):
+    return (obj.val + y) * 1
+
+
+class Bumper:
+    def __init__(self):
+        self.val = 0
+
+    def bump(self):
+        self.val = 10
+        return 1
+
+
+def inlined_source(source, **kwargs):
+    code = ast.parse(dedent(source))
+    inline_calls(code, globals(), **kwargs)
+    return ast.unparse(code)
+
+
+def test_get_helper():
+    assert get_helper(norm) is not None
+    assert get_helper(scaled) is not None
+    assert get_helper(big) is None
+    assert get_helper(big, max_size=100) is not None
+    assert get_helper(early) is None
+    assert get_helper(len) is None
+    assert get_helper(norm) is get_helper(norm)
+
+
+def test_inline_expression():
+    source = """
+    def f(x, y):
+        return norm(x, y) + norm(x, 1)
+    """
+    expected = dedent("""
+    def f(x, y):
+        return math.sqrt(x * x + y * y) + math.sqrt(x * x + 1 * 1)
+    """).strip()
+    assert inlined_source(source) == expected
+
+
+def test_inline_statement():
+    source = """
+    def f(x, y):
+        z = pick(x, y * 2)
+        out = scaled(x + 1)
+        return scaled(out, factor=y)
+    """
+    expected = dedent("""
+    def f(x, y):
+        _pick_a = x
+        _pick_b = y * 2
+        z = _pick_a if _pick_a > _pick_b else _pick_b
+        _scaled_v = x + 1
+        _scaled_out = _scaled_v * 2
+        _scaled_out += SCALE
+        out = _scaled_out
+        _scaled_v_1 = out
+        _scaled_factor = y
+        _scaled_out_1 = _scaled_v_1 * _scaled_factor
+        _scaled_out_1 += SCALE
+        return _scaled_out_1
+    """).strip()
+    assert inlined_source(source) == expected
+
+
+def test_inline_guards():
+    source = dedent("""
+    def f(x, y, math):
+        # math is shadowed
+        a = norm(x, y)
+        # argument with side effects inside an expression
+        b = 1 + pick(x, y())
+        # can't bind statically
+        c = norm(*x)
+        return [norm(i, i) for i in x]
+    """)
+    assert inlined_source(source) == ast.unparse(ast.parse(source))
+
+
+def test_inline_argument_order():
+    source = """
+    def f(obj):
+        a = 1 + shifted(obj, obj.bump())
+        b = shifted(obj, obj.bump())
+        return a, b
+    """
+    code = ast.parse(dedent(source))
+    inline_calls(code, globals())
+    result = ast.unparse(code)
+    # obj.val would be read before obj.bump() ran
+    assert '1 + shifted(obj, obj.bump())' in result
+    # bound to temporaries in call order instead
+    assert '_shifted_y = obj.bump()' in result
+
+    original = dict(globals())
+    exec(dedent(source), original)
+    namespace = dict(globals())
+    exec(compile(code, '<inline>', 'exec'), namespace)
+    assert namespace['f'](Bumper()) == original['f'](Bumper()) == (12, 11)
+
+    # the argument is the first thing evaluated, so it's safe
+    source = """
+    def f(x, y):
+        return 1 + shifted(y(), x)
+    """
+    assert inlined_source(source).endswith('return 1 + (y().val + x) * 1')
+    # but not if it's evaluated more than once
+    source = """
+    def g(x, y):
+        return 1 + pick(y(), x)
+    """
+    assert 'pick(' in inlined_source(source)
+
+
+def test_func_inline():
+    @func_inline
+    def lengths(points):
+        out = []
+        for x, y in points:
+            out.append(norm(x, y) + pick(x, y) + scaled(x))
+        return out
+
+    assert lengths([(3, 4)]) == [5 + 4 + 9]
+    source = get_source(lengths)
+    assert 'norm(' not in source
+    assert 'pick(' not in source
+    # multi statement helpers only inline at the statement level
+    assert 'scaled(' in source
+
+    @func_inline(max_size=1)
+    def small(x, y):
+        return norm(x, y)
+
+    assert 'norm(' in get_source(small)
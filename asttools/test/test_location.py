@@ -0,0 +1,89 @@
+import ast
+from textwrap import dedent
+
+from ..location import LocationIndex
+
+
+source = dedent("""
+def bob(x):
+    return x + frank(1)
+
+value = bob(2)
+""")
+
+
+def test_node_at():
+    index = LocationIndex(source)
+
+    node = index.node_at(3, 15)
+    assert isinstance(node, ast.Name)
+    assert node.id == 'frank'
+
+    # the 1 in frank(1)
+    node = index.node_at(3, 21)
+    assert isinstance(node, ast.Constant)
+
+    # x + frank(1) at the +
+    node = index.node_at(3, 13)
+    assert isinstance(node, ast.BinOp)
+
+    # blank line before anything
+    assert index.node_at(1, 0) is None
+
+    # blank line after the def
+    assert index.node_at(4, 0) is None
+
+    node = index.node_at(5, 0)
+    assert isinstance(node, ast.Name)
+    assert node.id == 'value'
+
+
+def test_enclosing_statement():
+    index = LocationIndex(source)
+    func_def, assign = index.code.body
+
+    frank = index.node_at(3, 15)
+    call = index.enclosing(frank)
+    assert isinstance(call, ast.Call)
+    assert isinstance(index.enclosing(call), ast.BinOp)
+    assert index.statement(frank) is func_def
+    assert index.statement(assign.value) is assign
+    assert index.enclosing(func_def) is None
+    assert index.span(func_def) == ((2, 0), (3, 23))
+
+
+def test_nodes_in():
+    index = LocationIndex(source)
+    nodes = index.nodes_in((5, 0), (6, 0))
+    assert [type(n) for n in nodes] == [
+        ast.Assign,
+        ast.Name,
+        ast.Call,
+        ast.Name,
+        ast.Constant,
+    ]
+
+    for line in range(2, 6):
+        for col in range(0, 25):
+            node = index.node_at(line, col)
+            if node is None:
+                continue
+            # brute force: innermost node that contains the point
+            point = (line, col)
+            contains = [
+                n for n in nodes_with_pos(index.code)
+                if (n.lineno, n.col_offset) <= point
+                < (n.end_lineno, n.end_col_offset)
+            ]
+            assert node in contains
+            # latest start, then earliest end
+            spans = [index.span(n) for n in contains]
+            innermost = max(spans, key=lambda s: (s[0], [-p for p in s[1]]))
+            assert index.span(node) == innermost
+
+
+def nodes_with_pos(code):
+    return [
+        n for n in ast.walk(code)
+        if getattr(n, 'end_lineno', None) is not None
+    ]
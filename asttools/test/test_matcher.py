@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from textwrap import dedent
 import ast
 
@@ -12,7 +13,7 @@ class AM:
         self.template = template
 
         self.verbose = verbose
-        matcher = Matcher(template)
+        matcher = Matcher(template, verbose=verbose)
         self.matcher = matcher
 
     def assert_match(self, other):
@@ -182,3 +183,81 @@ def test_granular_any():
     with pytest.raises():
         AM("meta[1, _any_]") << "meta[1, 1, 3]"
 
+
+def test_matcher_shared_between_threads():
+    matcher = Matcher("test_call(_any_) + 1")
+    hits = quick_parse("test_call(a, b=2) + 1").value
+    misses = quick_parse("test_call(a) + 2").value
+
+    def run(i):
+        node = hits if i % 2 else misses
+        return [matcher.match(node) for _ in range(200)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(run, range(16)))
+
+    for i, result in enumerate(results):
+        assert result == [bool(i % 2)] * 200
+    # nothing is logged unless verbose
+    assert matcher.logs == []
+
+
+def test_named_captures():
+    matcher = Matcher("_any_left_ * 2 + _any_right_")
+    assert matcher.capture_names == {'left', 'right'}
+
+    node = quick_parse("df['a'] * 2 + np.sqrt(x)").value
+    captures = matcher.captures(node)
+    assert set(captures) == {'left', 'right'}
+    assert captures['left'] is node.left.left
+    assert captures['right'] is node.right
+    # still a plain wildcard for match
+    assert matcher.match(node)
+
+    assert matcher.captures(quick_parse("df['a'] * 3 + x").value) is None
+
+
+def test_named_captures_skipped_fields():
+    matcher = Matcher("func(_any_args_)")
+    node = quick_parse("func(a, b + 1)").value
+    assert matcher.captures(node) == {'args': node.args}
+    # keywords aren't captured so the call can't match
+    assert matcher.captures(quick_parse("func(a, k=1)").value) is None
+    assert Matcher("func(_any_)") == quick_parse("func(a, k=1)").value
+
+    matcher = Matcher("_any_obj_.shape")
+    node = quick_parse("df['a'].shape").value
+    assert matcher.captures(node) == {'obj': node.value}
+
+    matcher = Matcher("data[_any_key_]")
+    node = quick_parse("data[i + 1]").value
+    assert matcher.captures(node) == {'key': node.slice}
+
+    matcher = Matcher("-_any_value_")
+    node = quick_parse("-(a * b)").value
+    assert matcher.captures(node) == {'value': node.operand}
+    # the operator still has to match
+    assert not matcher.match(quick_parse("not a").value)
+
+
+def test_named_captures_repeated():
+    matcher = Matcher("_any_x_ + _any_x_")
+    assert matcher.captures(quick_parse("a.b + a.b").value) is not None
+    assert matcher.captures(quick_parse("a.b + a.c").value) is None
+    # unnamed wildcards don't have to agree
+    assert Matcher("_any_ + _any_").match(quick_parse("a.b + a.c").value)
+
+
+def test_named_captures_old_hooks():
+    # overrides written before bindings existed
+    class NameMatcher(Matcher):
+        def match_Name(self, other, node):
+            if node.id == 'ANY_NAME':
+                return isinstance(other, ast.Name)
+            return super().match_Name(other, node)
+
+    matcher = NameMatcher("ANY_NAME * _any_x_")
+    node = quick_parse("a * (b + 1)").value
+    assert matcher == node
+    assert matcher.captures(node) == {'x': node.right}
+    assert matcher.captures(quick_parse("a() * b").value) is None
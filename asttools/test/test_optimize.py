@@ -0,0 +1,532 @@
+import ast
+from functools import partial
+from textwrap import dedent
+
+import pytest
+
+from ..function import func_rewrite
+from ..optimize import (
+    eliminate_common_subexpressions,
+    fold_constants,
+    fold_expression,
+    hoist_lookups,
+    module_constants,
+)
+
+
+def folded_source(source, constants=None):
+    code = ast.parse(dedent(source))
+    fold_constants(code, constants)
+    return ast.unparse(code)
+
+
+def test_fold_expressions():
+    source = """
+    a = x * (2 * 3) + (not True and 5 or 6)
+    b = -(1 + 1) if 3 > 2 > 1 else y
+    c = 'ab' * 2
+    d = 1 / 0
+    e = 'a' * 10 ** 6
+    f = None is not None
+    g = 'a' is 'a'
+    """
+    expected = dedent("""
+    a = x * 6 + 6
+    b = -2
+    c = 'abab'
+    d = 1 / 0
+    e = 'a' * 1000000
+    f = False
+    g = 'a' is 'a'
+    """).strip()
+    assert folded_source(source) == expected
+
+
+def test_fold_expression_copy():
+    node = ast.parse("1 + 2 * 3", mode='eval').body
+    folded = fold_expression(node)
+    assert folded.value == 7
+    assert isinstance(node, ast.BinOp)
+
+
+def test_prune_dead_branches():
+    source = """
+    def f(x):
+        if False:
+            x += 1
+        elif True:
+            x += 2
+        else:
+            x += 3
+        while 0:
+            x += 4
+        if x:
+            return 1
+        else:
+            raise ValueError()
+        x += 5
+    """
+    expected = dedent("""
+    def f(x):
+        x += 2
+        if x:
+            return 1
+        else:
+            raise ValueError()
+    """).strip()
+    assert folded_source(source) == expected
+
+
+def test_prune_keeps_generators():
+    source = """
+    def gen():
+        if False:
+            yield 1
+        return 1
+        yield 2
+    """
+    assert folded_source(source) == dedent(source).strip()
+
+    # empty bodies get a pass
+    assert folded_source("def f(x):\n    if 0:\n        x = 1") == \
+        "def f(x):\n    pass"
+
+
+def test_prune_keeps_scoping():
+    source = """
+    x = 'global'
+
+    def local():
+        if x:
+            return x
+        return 1
+        x = 1
+
+    def branch():
+        y = x
+        if False:
+            x = 1
+        return y
+
+    def rebound():
+        x = 2
+        return x
+        x = 1
+        z = 3
+    """
+    expected = dedent("""
+    x = 'global'
+
+    def local():
+        if x:
+            return x
+        return 1
+        if 0:
+            x = 1
+
+    def branch():
+        y = x
+        if False:
+            x = 1
+        return y
+
+    def rebound():
+        x = 2
+        return x
+        if 0:
+            x = 1
+            z = 3
+    """).strip()
+    code = ast.parse(dedent(source))
+    fold_constants(code)
+    assert ast.unparse(code) == expected
+
+    # x is still local, so these still raise
+    namespace = {}
+    exec(compile(code, '<fold>', 'exec'), namespace)
+    for name in ('local', 'branch'):
+        with pytest.raises(UnboundLocalError):
+            namespace[name]()
+    assert namespace['rebound']() == 2
+
+    # nothing is made local outside a function
+    assert folded_source("if 0:\n    x = 1\ny = 2") == 'y = 2'
+
+
+def test_module_constants():
+    source = dedent("""
+    DEBUG = False
+    SCALE = 60 * 60
+    NAMES = ('a', 'b')
+    MUTABLE = [1, 2]
+    REBOUND = 1
+    GLOBAL = 1
+    DERIVED = SCALE * 2
+
+    def f():
+        global GLOBAL
+        GLOBAL = 2
+
+    REBOUND += 1
+    """)
+    constants = module_constants(source)
+    assert constants == {'DEBUG': False, 'SCALE': 3600, 'NAMES': ('a', 'b')}
+
+
+def test_inline_constants_respects_scope():
+    source = """
+    def f(x):
+        if DEBUG:
+            print(x)
+        return x * SCALE
+
+    def g(SCALE):
+        DEBUG = True
+        if DEBUG:
+            return SCALE
+    """
+    expected = dedent("""
+    def f(x):
+        return x * 3600
+
+    def g(SCALE):
+        DEBUG = True
+        if DEBUG:
+            return SCALE
+    """).strip()
+    constants = {'DEBUG': False, 'SCALE': 3600}
+    assert folded_source(source, constants) == expected
+
+
+def test_func_rewrite_fold_constants():
+    constants = {'DEBUG': False}
+
+    @func_rewrite(partial(fold_constants, constants=constants))
+    def hot(x):
+        if DEBUG:  # noqa: F821
+            raise Exception("shouldn't run")
+        return x * (60 * 60)
+
+    assert hot(2) == 7200
+    consts = hot.__code__.co_consts
+    assert 3600 in consts
+    assert "shouldn't run" not in consts
+
+
+def hoisted_source(source, **kwargs):
+    code = ast.parse(dedent(source))
+    hoist_lookups(code, **kwargs)
+    return ast.unparse(code)
+
+
+def test_hoist_lookups():
+    source = """
+    def f(self, rows, total):
+        for row in rows:
+            total = total + math.sqrt(row) * self.scale
+    """
+    expected = dedent("""
+    def f(self, rows, total):
+        try:
+            _math_sqrt = math.sqrt
+            _self_scale = self.scale
+            _hoisted = True
+        except Exception:
+            _hoisted = False
+        if _hoisted:
+            for row in rows:
+                total = total + _math_sqrt(row) * _self_scale
+        else:
+            for row in rows:
+                total = total + math.sqrt(row) * self.scale
+    """).strip()
+    assert hoisted_source(source) == expected
+
+    # np.sum or out.append could change self.scale
+    source = """
+    def f(self, rows, out):
+        for row in rows:
+            out.append(np.sum(row) * self.scale)
+    """
+    result = hoisted_source(source)
+    assert '_np_sum = np.sum' in result
+    assert '_self' not in result
+
+    expected = dedent("""
+    def f(self, rows, out):
+        try:
+            _np = np
+            _hoisted = True
+        except Exception:
+            _hoisted = False
+        if _hoisted:
+            for row in rows:
+                out.append(_np.sum(row) * self.scale)
+        else:
+            for row in rows:
+                out.append(np.sum(row) * self.scale)
+    """).strip()
+    assert hoisted_source(source, attributes=False) == expected
+
+    # a method call at any depth could change self.scale
+    source = """
+    def f(self, rows):
+        for row in rows:
+            self.items.append(np.sum(row) * self.scale)
+    """
+    result = hoisted_source(source)
+    assert '_np_sum = np.sum' in result
+    assert '_self' not in result
+
+
+def test_hoist_lookups_mutated_chains():
+    source = dedent("""
+    class Counter:
+        def __init__(self):
+            self.value = 0
+
+        def bump(self):
+            self.value += 1
+
+    class Holder:
+        def __init__(self):
+            self.a = Counter()
+
+    counter = Counter()
+
+    def global_root(n):
+        out = []
+        for i in range(n):
+            counter.bump()
+            out.append(counter.value)
+        return out
+
+    def deep_local(self, n):
+        out = []
+        for i in range(n):
+            self.a.bump()
+            out.append(self.a.value)
+        return out
+
+    def passed_on(self, n):
+        out = []
+        for i in range(n):
+            bump(self.a)
+            out.append(self.a.value)
+        return out
+
+    def bump(obj):
+        obj.bump()
+    """)
+    code = ast.parse(source)
+    hoist_lookups(code)
+    result = ast.unparse(code)
+    assert '_counter_value' not in result
+    assert '_self_a_value' not in result
+
+    namespace = {}
+    exec(compile(code, '<hoist>', 'exec'), namespace)
+    holder = namespace['Holder']
+    assert namespace['global_root'](3) == [1, 2, 3]
+    assert namespace['deep_local'](holder(), 3) == [1, 2, 3]
+    assert namespace['passed_on'](holder(), 3) == [1, 2, 3]
+
+
+def test_hoist_lookups_opaque_calls():
+    source = dedent("""
+    class State:
+        x = 0
+
+    STATE = State()
+
+    def tick():
+        STATE.x += 1
+
+    def global_root():
+        total = 0
+        for _ in range(3):
+            tick()
+            total = total + STATE.x
+        return total
+
+    def local_root(self):
+        total = 0
+        for _ in range(3):
+            tick()
+            total = total + self.x
+        return total
+    """)
+    code = ast.parse(source)
+    hoist_lookups(code)
+    result = ast.unparse(code)
+    assert '_STATE_x' not in result
+    assert '_self_x' not in result
+
+    namespace = {}
+    exec(compile(code, '<hoist>', 'exec'), namespace)
+    assert namespace['global_root']() == 6
+    # global_root already ticked 3 times
+    assert namespace['local_root'](namespace['STATE']) == 4 + 5 + 6
+
+
+def test_hoist_lookups_guards():
+    source = dedent("""
+    def f(self, rows, obj):
+        len = 1
+        for row in rows:
+            self.reset()
+            self.total += len
+            obj.count(row)
+            mutate(obj)
+            row.value
+        for row in rows:
+            g = lambda: total
+            total = g()
+    """)
+    # nothing can be hoisted safely except mutate
+    source = hoisted_source(source)
+    assert "_mutate = mutate" in source
+    assert source.count(" = True") == 1
+
+
+def test_func_rewrite_hoist_lookups():
+    class Obj:
+        scale = 3
+
+        @func_rewrite(hoist_lookups)
+        def total(self, rows):
+            total = 0
+            for row in rows:
+                total += len(row) * self.scale
+            return total
+
+        @func_rewrite(hoist_lookups)
+        def missing(self, rows):
+            for row in rows:
+                missing_function(row)  # noqa: F821
+            return 'ok'
+
+    obj = Obj()
+    assert obj.total([[1, 2], [3]]) == 9
+    assert '_len' in Obj.total.__code__.co_varnames
+    # failed lookups only raise where they originally would
+    assert obj.missing([]) == 'ok'
+    with pytest.raises(NameError):
+        obj.missing([1])
+
+
+def cse_source(source, **kwargs):
+    code = ast.parse(dedent(source))
+    eliminate_common_subexpressions(code, **kwargs)
+    return ast.unparse(code)
+
+
+def test_cse_basic_block():
+    source = """
+    def f(df, x, y):
+        c = df['a'] * 2 + 1
+        d = df['a'] * 2 - 1
+        e = (x + y) * (x + y)
+        return len(df) + len(df)
+    """
+    expected = dedent("""
+    def f(df, x, y):
+        _cse = df['a'] * 2
+        c = _cse + 1
+        d = _cse - 1
+        _cse_1 = x + y
+        e = _cse_1 * _cse_1
+        _cse_2 = len(df)
+        return _cse_2 + _cse_2
+    """).strip()
+    assert cse_source(source) == expected
+
+
+def test_cse_invalidation():
+    source = """
+    def f(df, x, y, c):
+        a = x + y
+        x = 3
+        b = x + y
+        g = df['a'] * 2
+        df['a'] = 0
+        h = df['a'] * 2
+        k = df.b * 2
+        log(df)
+        m = df.b * 2
+        n = c and x * y or x * y
+        if c:
+            p = x * y
+        q = x * y
+    """
+    # nothing survives a rebind, a store, an impure call, a conditional
+    # evaluation or a block boundary. df.b isn't a pure attribute.
+    assert cse_source(source) == ast.unparse(ast.parse(dedent(source)))
+
+
+def test_cse_mutation_regression():
+    source = """
+    def f(a, b):
+        x = a + b
+        a[0] = 200
+        y = a + b
+        return y
+
+    def g(a, b):
+        x = a + b
+        a.append(b[0])
+        y = a + b
+        return y
+
+    def h(obj, a, b):
+        alias = obj
+        x = obj.items + b
+        alias.items = [1]
+        y = obj.items + b
+        return y
+    """
+    code = ast.parse(dedent(source))
+    eliminate_common_subexpressions(code)
+    # nothing is reused across the mutation
+    assert '_cse' not in ast.unparse(code)
+
+    namespace = {}
+    exec(compile(code, '<cse>', 'exec'), namespace)
+    assert namespace['f']([1], [3, 5]) == [200, 3, 5]
+    assert namespace['g']([1], [1]) == [1, 1, 1]
+
+    class Obj:
+        items = [2]
+    assert namespace['h'](Obj(), None, [3]) == [1, 3]
+
+
+def test_cse_allow_list():
+    source = """
+    def f(obj):
+        a = obj.value * 2
+        b = obj.value * 2
+        c = norm(obj) + 1
+        d = norm(obj) - 1
+    """
+    result = cse_source(source)
+    assert result.count('obj.value * 2') == 2
+    assert result.count('norm(obj)') == 2
+
+    result = cse_source(
+        source,
+        pure_calls={'norm'},
+        pure_attributes={'value'},
+    )
+    assert result.count('obj.value * 2') == 1
+    assert result.count('norm(obj)') == 1
+
+
+def test_cse_func_rewrite():
+    def kernel(df):
+        total = df['a'] * 2 + df['b']
+        diff = df['a'] * 2 - df['b']
+        return total, diff
+
+    rewritten = func_rewrite(eliminate_common_subexpressions)(kernel)
+    data = {'a': 3, 'b': 1}
+    assert rewritten(data) == kernel(data)
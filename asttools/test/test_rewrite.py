@@ -0,0 +1,156 @@
+import ast
+import copy
+from textwrap import dedent
+
+import pytest
+
+from ..function import func_rewrite
+from ..rewrite import RewriteEngine, RewriteRule
+
+
+def rewritten(engine, source):
+    code = ast.parse(dedent(source))
+    engine.rewrite(code)
+    return ast.unparse(code)
+
+
+def test_rewrite_rules():
+    engine = RewriteEngine()
+    double = engine.add("_any_x_ * 2", "_any_x_ + _any_x_")
+    empty = engine.add("len(_any_seq_) == 0", "not _any_seq_", name='empty')
+
+    source = """
+    a = df['a'] * 2
+    if len(items) == 0:
+        b = f(x) * 3
+    """
+    expected = dedent("""
+    a = df['a'] + df['a']
+    if not items:
+        b = f(x) * 3
+    """).strip()
+    assert rewritten(engine, source) == expected
+    assert engine.hits == {'_any_x_ * 2': 1, 'empty': 1}
+    assert double.hits == 1
+    assert empty.hits == 1
+
+    # only rules for the node type are tried
+    assert set(engine.index) == {ast.BinOp, ast.Compare}
+
+
+def test_rewrite_nested_and_fixpoint():
+    engine = RewriteEngine([
+        ("_any_x_ + 0", "_any_x_"),
+        ("_any_x_ * 1", "_any_x_"),
+    ])
+    # children are rewritten first so nested rules cascade in one pass
+    assert rewritten(engine, "a = (b * 1 + 0) * 1") == 'a = b'
+    assert engine.iterations == 2
+    assert engine.converged
+
+    # rules that undo each other stop at the cap
+    engine = RewriteEngine(
+        [("_any_x_ * 2", "_any_x_ + _any_x_"),
+         ("_any_x_ + _any_x_", "_any_x_ * 2")],
+        max_iterations=3,
+    )
+    rewritten(engine, "a = b * 2")
+    assert engine.iterations == 3
+    assert not engine.converged
+    assert sum(engine.hits.values()) == 3
+
+
+def test_rewrite_list_captures():
+    engine = RewriteEngine()
+    engine.add("old_api(_any_args_)", "new_api(_any_args_, strict=True)")
+    engine.add("with timer(): _any_body_", "with profile(): _any_body_")
+
+    source = """
+    old_api(a, b + 1)
+    old_api(a, k=1)
+    with timer():
+        x = 1
+        y = 2
+    """
+    expected = dedent("""
+    new_api(a, b + 1, strict=True)
+    old_api(a, k=1)
+    with profile():
+        x = 1
+        y = 2
+    """).strip()
+    assert rewritten(engine, source) == expected
+
+
+def test_rewrite_repeated_list_capture():
+    engine = RewriteEngine([("old(_any_args_)", "new(_any_args_, _any_args_)")])
+    assert rewritten(engine, "old(a, b)") == 'new(a, b, a, b)'
+    assert rewritten(engine, "old(a)") == 'new(a, a)'
+
+
+def test_rewrite_capture_ctx():
+    engine = RewriteEngine([("_any_x_ += 1", "_any_x_ = _any_x_ + 1")])
+    source = """
+    def f(obj, d):
+        obj.count += 1
+        d['a'] += 1
+        return obj, d
+    """
+    code = ast.parse(dedent(source))
+    engine.rewrite(code)
+    assert ast.unparse(code).splitlines()[1:3] == [
+        '    obj.count = obj.count + 1',
+        "    d['a'] = d['a'] + 1",
+    ]
+    assign = code.body[0].body[0]
+    assert isinstance(assign.targets[0].ctx, ast.Store)
+    assert isinstance(assign.value.left.ctx, ast.Load)
+    assert isinstance(assign.value.left.value.ctx, ast.Load)
+
+    class Obj:
+        count = 0
+
+    namespace = {}
+    exec(compile(code, '<rewrite>', 'exec'), namespace)
+    obj, d = namespace['f'](Obj(), {'a': 1})
+    assert (obj.count, d) == (1, {'a': 2})
+
+
+def test_rewrite_identity_converges():
+    engine = RewriteEngine([
+        ("f(_any_x_)", "f(_any_x_)"),
+        ("_any_x_ + 0", lambda captures, node: copy.deepcopy(node)),
+    ])
+    assert rewritten(engine, "f(a) + 0") == 'f(a) + 0'
+    assert engine.converged
+    assert engine.iterations == 1
+    assert engine.hits == {'f(_any_x_)': 0, '_any_x_ + 0': 0}
+
+
+def test_rewrite_callable():
+    def fold(captures, node):
+        left, right = captures['a'], captures['b']
+        if isinstance(left, ast.Constant) and isinstance(right, ast.Constant):
+            return ast.Constant(left.value + right.value)
+
+    engine = RewriteEngine([RewriteRule("_any_a_ + _any_b_", fold)])
+    assert rewritten(engine, "a = 1 + 2 + x") == 'a = 3 + x'
+    assert engine.hits == {'_any_a_ + _any_b_': 1}
+
+
+def test_rewrite_rule_errors():
+    with pytest.raises(ValueError, match='wildcard'):
+        RewriteRule("_any_x_", "x")
+    with pytest.raises(ValueError, match='not captured'):
+        RewriteRule("_any_x_ * 2", "_any_y_ + 1")
+
+
+def test_rewrite_func_rewrite():
+    engine = RewriteEngine([("_any_x_ ** 2", "_any_x_ * _any_x_")])
+
+    @func_rewrite(engine)
+    def square(value):
+        return value ** 2
+
+    assert square(3) == 9
+    assert engine.hits == {'_any_x_ ** 2': 1}
@@ -0,0 +1,157 @@
+import ast
+import copy
+import symtable
+from textwrap import dedent
+
+from ..scope import SymbolTable, invalidate_symbol_tables, symbol_table
+from ..transform import transform
+
+
+source = dedent("""
+import os.path as p
+x = 1
+
+def outer(a, b=x, *args, c: int = 2, **kw):
+    y = a
+    z = 3
+
+    def inner(q=z):
+        nonlocal y
+        y += 1
+        return y + b + len(args) + q + p
+
+    class K(Base):
+        attr = z
+
+        def m(self):
+            return super().m() + attr + y
+
+        lst = [attr for _ in range(3)]
+
+    g = lambda t: t + z
+    comp = [i * y for i in args if i > z]
+    d = {k: v + w for k in kw for v in kw[k] if (w := v)}
+    global gg
+    gg = 1
+    return inner, K, g, comp, d
+""")
+
+
+def scope_named(table, name):
+    for node, scope in table.scopes.items():
+        if getattr(node, 'name', None) == name:
+            return scope
+
+
+def test_symbol_table():
+    table = SymbolTable(source)
+    assert table.root.globals >= {'p', 'x', 'outer'}
+
+    outer = scope_named(table, 'outer')
+    assert outer.kind == 'function'
+    assert outer.locals == {
+        'a', 'b', 'args', 'c', 'kw', 'y', 'z', 'inner', 'K', 'g', 'comp',
+        'd', 'w',
+    }
+    assert outer.cells == {'y', 'z', 'b', 'args', 'kw', 'w'}
+    assert outer.free == set()
+    assert outer.globals == {'gg', 'Base'}
+    # defaults are evaluated in the enclosing scope
+    assert 'x' in table.root.loads
+
+    inner = scope_named(table, 'inner')
+    assert inner.free == {'y', 'b', 'args'}
+    assert inner.globals == {'len', 'p'}
+    # q's default is loaded in outer
+    assert 'z' not in inner.loads
+
+    klass = scope_named(table, 'K')
+    assert klass.kind == 'class'
+    assert klass.cells == {'__class__'}
+    # class scope passes y through to m
+    assert klass.free == {'z', 'y'}
+
+    method = scope_named(table, 'm')
+    assert method.free == {'__class__', 'y'}
+    # class attributes are not visible to nested scopes
+    assert 'attr' in method.globals
+
+    comps = [s for s in table.scopes.values() if s.kind == 'comprehension']
+    assert len(comps) == 3
+    # walrus binds in outer
+    dict_comp = table.scopes[table.code.body[2].body[6].value]
+    assert 'w' in dict_comp.nonlocals
+    assert 'w' in dict_comp.free
+
+    frank = table.code.body[2].body[2].body[2].value
+    assert table.scope_of(frank) is inner
+
+
+def test_binding_scope():
+    table = SymbolTable(source)
+    outer = scope_named(table, 'outer')
+    inner = scope_named(table, 'inner')
+    klass = scope_named(table, 'K')
+    method = scope_named(table, 'm')
+
+    assert table.binding_scope('y', inner) is outer
+    assert table.binding_scope('z', outer) is outer
+    assert table.binding_scope('attr', klass) is klass
+    # class scopes are skipped
+    assert table.binding_scope('attr', method) is None
+    assert table.binding_scope('y', method) is outer
+    assert table.binding_scope('x', inner) is table.root
+    assert table.binding_scope('gg', outer) is table.root
+    assert table.binding_scope('len', inner) is None
+
+
+def _std_tables(table):
+    yield table
+    for child in table.get_children():
+        yield from _std_tables(child)
+
+
+def test_symbol_table_matches_symtable():
+    """
+    free variables match the compiler's symtable
+    """
+    table = SymbolTable(source)
+    std = {
+        (t.get_name(), t.get_lineno()): t
+        for t in _std_tables(symtable.symtable(source, '<test>', 'exec'))
+        if t.get_type() == 'function'
+    }
+
+    for node, scope in table.scopes.items():
+        if scope.kind not in ('function', 'lambda'):
+            continue
+        name = 'lambda' if scope.kind == 'lambda' else node.name
+        std_table = std[(name, node.lineno)]
+        assert set(std_table.get_frees()) == scope.free
+
+
+def test_symbol_table_cached():
+    code = ast.parse(source)
+    table = symbol_table(code)
+    assert symbol_table(code) is table
+
+    # a structurally identical copy is still a different node
+    index = next(
+        i for i, stmt in enumerate(code.body)
+        if isinstance(stmt, ast.FunctionDef)
+    )
+    code.body[index] = copy.deepcopy(code.body[index])
+    assert table.scopes.get(code.body[index]) is None
+    invalidate_symbol_tables()
+    new_table = symbol_table(code)
+    assert new_table is not table
+    assert new_table.scopes.get(code.body[index]) is not None
+
+    code.body.append(ast.parse("def late(): pass").body[0])
+    invalidate_symbol_tables(code)
+    assert 'late' in symbol_table(code).root.bindings
+
+    # transform drops the cache itself
+    table = symbol_table(code)
+    transform(code, lambda node, meta: node)
+    assert symbol_table(code) is not table
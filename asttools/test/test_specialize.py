@@ -0,0 +1,161 @@
+import ast
+import math
+from collections import OrderedDict
+from textwrap import dedent
+
+import pytest
+
+from ..common import get_source
+from ..specialize import Specialized, specialize, specialize_code
+
+
+def apply_source():
+    return dedent("""
+    def apply(data, mode, scale=2):
+        if mode == 'sum':
+            total = sum(data)
+        elif mode == 'max':
+            total = max(data)
+        else:
+            raise ValueError(mode)
+        if isinstance(data, (list, tuple)):
+            n = len(data)
+        elif type(data) is dict:
+            n = -1
+        else:
+            n = 0
+        return total * scale + n
+    """)
+
+
+def test_specialize_code():
+    code = ast.parse(apply_source())
+    specialize_code(code, constants={'mode': 'sum'}, types={'data': list})
+    expected = dedent("""
+    def apply(data, mode, scale=2):
+        total = sum(data)
+        n = len(data)
+        return total * scale + n
+    """).strip()
+    assert ast.unparse(code) == expected
+
+    code = ast.parse(apply_source())
+    specialize_code(code, types={'data': dict})
+    assert 'n = -1' in ast.unparse(code)
+    assert 'isinstance' not in ast.unparse(code)
+    assert "mode == 'sum'" in ast.unparse(code)
+
+
+def test_specialize_code_guards():
+    source = dedent("""
+    def f(x, mode):
+        mode = mode.lower()
+        if mode == 'a':
+            return isinstance(x, list)
+        def inner(x):
+            return isinstance(x, list)
+        return inner
+    """)
+    code = ast.parse(source)
+    # rebound param and shadowed parameter are left alone
+    specialize_code(code, constants={'mode': 'a'}, types={'x': list})
+    expected = source.replace('return isinstance(x, list)', 'return True', 1)
+    assert ast.unparse(code) == ast.unparse(ast.parse(expected))
+
+
+def test_specialize():
+    @specialize(constants=['mode'], threshold=2, maxsize=2)
+    def apply(data, mode):
+        if mode == 'sum':
+            return sum(data)
+        if isinstance(data, dict):
+            return max(data.values())
+        return max(data)
+
+    for _ in range(3):
+        assert apply([1, 2], 'sum') == 3
+        assert apply({'a': 1, 'b': 5}, 'max') == 5
+        assert apply([1, 2], mode='max') == 2
+
+    assert len(apply.variants) == 2
+    # the first variant was evicted
+    assert (list, str, 'sum') not in apply.variants
+
+    variant = apply.variants[(dict, str, 'max')]
+    expected = dedent("""
+    def apply(data, mode):
+        return max(data.values())
+    """).strip()
+    assert get_source(variant).strip() == expected
+
+    with pytest.raises(TypeError):
+        apply([1], 'sum', 1)
+
+    apply.cache_clear()
+    assert not apply.variants
+
+
+def test_specialize_method():
+    class Obj:
+        scale = 2
+
+        @specialize(constants='flag', threshold=1)
+        def method(self, value, flag=False):
+            if flag:
+                return value * self.scale
+            return value
+
+    obj = Obj()
+    assert obj.method(3) == 3
+    assert obj.method(3, flag=True) == 6
+    assert len(Obj.method.variants) == 2
+
+
+def test_specialize_dispatcher_edges():
+    calls = []
+
+    @specialize(threshold=1)
+    def nothing():
+        calls.append(1)
+        return 1
+
+    assert nothing() == nothing() == 1
+    assert len(nothing.variants) == 1
+    assert () in nothing.variants
+
+    @specialize(constants=['x'], threshold=1)
+    def sign(x):
+        return math.copysign(1, x)
+
+    # -0.0 == 0.0 but the variants differ
+    assert sign(0.0) == 1
+    assert sign(-0.0) == -1
+    assert len(sign.variants) == 2
+
+    # nan != nan but still hits its variant
+    assert sign(float('nan')) == 1
+    assert sign(float('nan')) == 1
+    assert len(sign.variants) == 3
+
+
+def test_specialize_evicted_between_get_and_move():
+    class EvictOnGet(OrderedDict):
+        """ another thread evicts the key right after it was looked up """
+        def get(self, key, default=None):
+            value = super().get(key, default)
+            self.pop(key, None)
+            return value
+
+    def double(x):
+        return x * 2
+
+    specialized = Specialized(double, threshold=1)
+    specialized.variants = EvictOnGet()
+    dispatch = specialized.dispatcher()
+    assert dispatch(2) == 4
+    assert len(specialized.variants) == 1
+    assert dispatch(3) == 6
+    assert not specialized.variants
+
+    specialized.variants[(int,)] = double
+    assert specialized.call((4,), {}) == 8
@@ -0,0 +1,113 @@
+import ast
+import io
+
+import pytest
+
+from .. import graph_walk
+from ..stream import iter_statement_sources, iter_statements, stream_walk
+
+SOURCE = '''
+# leading comment
+import os
+a = 1; b = 2
+
+@decorator
+@other(
+    1,
+)
+def func(x):
+    """
+    docstring at
+column 0
+    """
+    if x:
+        return 1
+    else:
+        return 2
+# between
+try:
+    pass
+except ValueError:
+    pass
+finally:
+    pass
+c = [
+1,
+2]
+d = 1 + \\
+2
+class Bob:
+    pass
+# trailing comment
+'''
+
+
+def test_iter_statement_sources():
+    chunks = list(iter_statement_sources(SOURCE))
+    # chunks put back together are the source
+    assert ''.join(text for _, text in chunks) == SOURCE
+
+    starts = [lineno for lineno, _ in chunks]
+    assert len(chunks) == 7
+    assert starts == [1, 4, 5, 19, 26, 29, 31]
+    assert 'def func(x):' in chunks[2][1]
+    assert chunks[2][1].lstrip().startswith('@decorator')
+    assert 'finally:' in chunks[3][1]
+    assert chunks[-1][1].strip().startswith('class Bob')
+
+
+def test_iter_statements_matches_parse():
+    module = ast.parse(SOURCE)
+    stmts = [
+        stmt for chunk in iter_statements(io.StringIO(SOURCE))
+        for stmt in chunk.body
+    ]
+    assert [ast.dump(s, include_attributes=True) for s in stmts] \
+        == [ast.dump(s, include_attributes=True) for s in module.body]
+
+
+def test_stream_walk():
+    expected = [
+        (type(item['node']), item['field_name'], item['depth'])
+        for item in graph_walk(ast.parse(SOURCE))
+    ]
+    items = list(stream_walk(SOURCE))
+    assert [
+        (type(item['node']), item['field_name'], item['depth'])
+        for item in items
+    ] == expected
+
+    for item in items:
+        if item['depth'] == 0:
+            assert item['line'] is item['node']
+            assert isinstance(item['parent'], ast.Module)
+            assert item['parent'].body[item['field_index']] is item['node']
+
+
+def test_stream_is_lazy():
+    lines_read = []
+    source = io.StringIO("a = 1\nb = 2\nc = (\n3)\nd = 4\n")
+
+    class Reader:
+        def readline(self):
+            line = source.readline()
+            lines_read.append(line)
+            return line
+
+    gen = iter_statements(Reader())
+    first = next(gen)
+    assert ast.unparse(first) == 'a = 1'
+    # only read up to the start of the next statement
+    assert len(lines_read) == 2
+    assert [ast.unparse(chunk) for chunk in gen] \
+        == ['b = 2', 'c = 3', 'd = 4']
+
+
+def test_stream_syntax_error_lineno():
+    source = "a = 1\nb = 2\nc = = 3\n"
+    with pytest.raises(SyntaxError) as e:
+        list(iter_statements(source))
+    assert e.value.lineno == 3
+
+    with pytest.raises(SyntaxError):
+        list(iter_statements("a = (\n1\n"))
@@ -1,4 +1,5 @@
 import ast
+from concurrent.futures import ThreadPoolExecutor
 from textwrap import dedent
 
 from ..repr import (
@@ -7,8 +8,12 @@ from ..repr import (
 
 from ..transform import (
     transform,
-    NodeTransformer
+    NodeTransformer,
+    EagerTransformer,
+    Pipeline,
+    coroutine,
 )
+from ..graph import ParentMap
 
 def test_name_rename():
     """
@@ -65,3 +70,248 @@ def test_func_renamer():
     transform(mod, visitor)
     new_source = ast_source(mod)
     assert new_source == "data['bob'] = data['frank']"
+
+def test_transform_parent_map():
+    """
+    transform keeps a ParentMap in sync
+    """
+    class DataRenamer(NodeTransformer):
+        def visit_Name(self, node, meta):
+            return ast.copy_location(ast.Subscript(
+                        value=ast.Name(id='data', ctx=ast.Load()),
+                        slice=ast.Constant(value=node.id),
+                        ctx=node.ctx
+                    ), node)
+
+    mod = ast.parse("bob = frank")
+    parent_map = ParentMap(mod)
+    old_frank = mod.body[0].value
+    transform(mod, DataRenamer(), parent_map=parent_map)
+
+    assign = mod.body[0]
+    assert old_frank not in parent_map
+    assert parent_map.parent(assign.value) is assign
+    assert parent_map.parent(assign.value.slice) is assign.value
+    assert parent_map.parent(assign.targets[0]) is assign
+    assert parent_map.location(assign.targets[0]).field_index == 0
+
+
+def test_transform_concurrent():
+    """ concurrent transforms of separate trees with their own visitors """
+    source = "\n".join(
+        "x{0} = a + {0} * b".format(i) for i in range(30)
+    )
+
+    class Renamer(NodeTransformer):
+        def __init__(self, suffix):
+            self.suffix = suffix
+
+        def visit_Name(self, node, meta):
+            node.id = node.id + self.suffix
+            return node
+
+    def run(i):
+        code = ast.parse(source)
+        transform(code, Renamer('_{0}'.format(i)))
+        return ast_source(code)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(run, range(16)))
+
+    for i, result in enumerate(results):
+        assert result == run(i)
+        assert 'a_{0} + '.format(i) in result
+
+
+class CountingRenamer(NodeTransformer):
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+        self.visited = 0
+
+    def visit(self, node, meta):
+        self.visited += 1
+        return super().visit(node, meta)
+
+    def visit_Name(self, node, meta):
+        if node.id == self.old:
+            node.id = self.new
+        return node
+
+
+def test_pipeline_fused():
+    source = "def f():\n    a = b + c\n    print(a, b)"
+
+    @coroutine.wrap
+    def drop_print():
+        node, meta = yield
+        while True:
+            if isinstance(node, ast.Expr):
+                node = None
+            node, meta = yield node
+
+    first = CountingRenamer('b', 'c')
+    second = CountingRenamer('c', 'd')
+    pipeline = Pipeline(first, second, drop_print())
+    assert pipeline.walks == 1
+
+    code = ast.parse(source)
+    pipeline(code)
+    # same result as running the passes one after another
+    assert ast_source(code) == 'def f():\n    a = d + d'
+    # every node was visited once per visitor in a single walk
+    assert first.visited == second.visited
+
+
+def test_pipeline_children_rewritten():
+    class NameToConstant(NodeTransformer):
+        def visit_Name(self, node, meta):
+            if node.id == 'x':
+                return ast.Constant(1)
+            return node
+
+    class FoldAdd(NodeTransformer):
+        def visit_BinOp(self, node, meta):
+            if isinstance(node.left, ast.Constant) \
+               and isinstance(node.right, ast.Constant):
+                return ast.Constant(node.left.value + node.right.value)
+            return node
+
+    # a plain transform only swaps children in after visiting the parent
+    code = ast.parse("y = x + x")
+    transform(code, NameToConstant())
+    transform(code, FoldAdd())
+    assert ast_source(code) == 'y = 2'
+
+    code = ast.parse("y = (x + x) + x")
+    Pipeline(NameToConstant(), FoldAdd())(code)
+    assert ast_source(code) == 'y = 3'
+
+
+def test_pipeline_barrier():
+    class CollectStores(NodeTransformer):
+        def __init__(self):
+            self.stored = set()
+
+        def visit_Name(self, node, meta):
+            if isinstance(node.ctx, ast.Store):
+                self.stored.add(node.id)
+            return node
+
+    class RenameStored(NodeTransformer):
+        def __init__(self, collector):
+            self.collector = collector
+
+        def visit_Name(self, node, meta):
+            if node.id in self.collector.stored:
+                node.id = 'stored_' + node.id
+            return node
+
+    source = "print(x)\nx = 1"
+
+    # the load of x is visited before the store was seen
+    collector = CollectStores()
+    code = ast.parse(source)
+    Pipeline(collector, RenameStored(collector))(code)
+    assert ast_source(code) == 'print(x)\nstored_x = 1'
+
+    collector = CollectStores()
+    pipeline = Pipeline(collector).barrier().add(RenameStored(collector))
+    assert pipeline.walks == 2
+    code = ast.parse(source)
+    pipeline(code)
+    assert ast_source(code) == 'print(stored_x)\nstored_x = 1'
+
+
+def test_pipeline_add_pass():
+    calls = []
+
+    def tree_pass(code):
+        calls.append(ast_source(code))
+        code.body.append(ast.parse("z = 1").body[0])
+
+    pipeline = Pipeline(CountingRenamer('a', 'b'))
+    pipeline.add_pass(tree_pass)
+    pipeline.add(CountingRenamer('z', 'w'))
+    assert pipeline.walks == 2
+
+    code = ast.parse("a = 1")
+    pipeline(code)
+    assert calls == ['b = 1']
+    assert ast_source(code) == 'b = 1\nw = 1'
+
+
+def test_pipeline_new_children():
+    """ later visitors walk the nodes an earlier visitor created """
+    class SquareToMul(NodeTransformer):
+        def visit_Call(self, node, meta):
+            if isinstance(node.func, ast.Name) and node.func.id == 'square':
+                arg = node.args[0]
+                return ast.BinOp(
+                    left=ast.Call(
+                        func=ast.Name(id='abs', ctx=ast.Load()),
+                        args=[arg], keywords=[],
+                    ),
+                    op=ast.Mult(),
+                    right=ast.Name(id='x', ctx=ast.Load()),
+                )
+            return node
+
+    class DropAbs(NodeTransformer):
+        def visit_Call(self, node, meta):
+            if isinstance(node.func, ast.Name) and node.func.id == 'abs':
+                return node.args[0]
+            return node
+
+    source = "z = square(x)"
+    code = ast.parse(source)
+    for visitor in (SquareToMul(), DropAbs(), CountingRenamer('x', 'y')):
+        transform(code, visitor)
+    expected = ast_source(code)
+    assert expected == 'z = y * y'
+
+    code = ast.parse(source)
+    Pipeline(SquareToMul(), DropAbs(), CountingRenamer('x', 'y'))(code)
+    assert ast_source(code) == expected
+
+
+def test_transform_module_statements():
+    """ the Module isn't visited but its statements can be swapped """
+    code = ast.parse("a = 1\nprint(a)\nb = 2")
+    parent_map = ParentMap(code)
+    printed = code.body[1]
+
+    def visitor(node, meta):
+        if isinstance(node, ast.Expr):
+            return None
+        if isinstance(node, ast.Assign) and node.targets[0].id == 'b':
+            return ast.parse("c = 3").body[0]
+        return node
+
+    transform(code, visitor, parent_map=parent_map)
+    assert ast_source(code) == 'a = 1\nc = 3'
+    assert printed not in parent_map
+    assert parent_map.parent(code.body[1]) is code
+
+
+def test_transform_module_statements_mutated():
+    """ statements mutated in place, or under a non Module root, are kept """
+    code = ast.parse("a = 1\nb = 2")
+
+    def visitor(node, meta):
+        if isinstance(node, ast.Assign):
+            node.value = ast.Constant(value=3)
+        return node
+
+    transform(code, visitor)
+    assert ast_source(code) == 'a = 3\nb = 3'
+
+    func = ast.parse("def f():\n    a = 1\n    print(a)").body[0]
+
+    def drop_prints(node, meta):
+        if isinstance(node, ast.Expr):
+            return None
+        return node
+
+    transform(func, drop_prints)
+    assert ast_source(func) == 'def f():\n    a = 1'
@@ -0,0 +1,130 @@
+import ast
+import math
+from textwrap import dedent
+
+import numpy as np
+import pytest
+
+from ..common import get_source
+from ..function import func_rewrite
+from ..vectorize import vector_ok, vectorize_loops
+
+
+def kernel(out, a, b, c):
+    for i in range(len(a)):
+        out[i] = a[i] * b[i] + c
+        out[i] += math.sqrt(a[i]) * i
+    return out
+
+
+def test_vectorize_loops():
+    fast = func_rewrite(vectorize_loops)(kernel)
+    source = get_source(fast)
+    assert '_asttools_np.sqrt(a[_asttools_start:_asttools_stop])' in source
+
+    a = np.random.rand(100)
+    b = np.random.rand(100)
+    expected = kernel(np.empty(100), a, b, 2.0)
+    result = fast(np.empty(100), a, b, 2.0)
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_vectorize_fallback():
+    fast = func_rewrite(vectorize_loops)(kernel)
+
+    # lists aren't arrays
+    assert fast([0.0] * 2, [1.0, 4.0], [1.0, 1.0], 1.0) == [2.0, 7.0]
+
+    # math.sqrt raises where np.sqrt would only warn
+    out = np.zeros(2)
+    with pytest.raises(ValueError):
+        fast(out, np.array([-1.0, 1.0]), np.ones(2), 1.0)
+
+    # out overlaps a
+    data = np.arange(4, dtype=float)
+    expected = kernel(data[1:], data[:3], np.ones(3), 0.0)
+    data = np.arange(4, dtype=float)
+    result = fast(data[1:], data[:3], np.ones(3), 0.0)
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_vectorize_reads_written_dtype():
+    def kernel(out, a):
+        for i in range(1, len(a)):
+            out[i] = a[i] / 2
+            out[i] = out[i] * 3
+        return out
+
+    fast = func_rewrite(vectorize_loops)(kernel)
+    assert '_asttools_np.asarray' in get_source(fast)
+    a = np.arange(5)
+    expected = kernel(np.zeros(5, dtype=int), a)
+    result = fast(np.zeros(5, dtype=int), a)
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_vectorize_index_overflow():
+    def powers(out, n):
+        for i in range(n):
+            out[i] = i * i * i * i * i * i * i * i
+        return out
+
+    fast = func_rewrite(vectorize_loops)(powers)
+    assert 'dtype=_asttools_np.float64' in get_source(fast)
+
+    # the python ints don't wrap around like int64 would
+    expected = powers(np.zeros(300), 300)
+    result = fast(np.zeros(300), 300)
+    assert result[-1] == pytest.approx(299 ** 8)
+    np.testing.assert_allclose(result, expected, rtol=1e-15)
+
+    # an int target would get the exact ints, so the loop runs
+    expected = powers(np.zeros(100, dtype=np.int64), 100)
+    result = fast(np.zeros(100, dtype=np.int64), 100)
+    np.testing.assert_array_equal(result, expected)
+    with pytest.raises(OverflowError):
+        fast(np.zeros(300, dtype=np.int64), 300)
+
+    # storing the loop variable itself keeps the int64 arange
+    def index(out, n):
+        for i in range(n):
+            out[i] = i
+        return out
+
+    fast = func_rewrite(vectorize_loops)(index)
+    assert 'dtype' not in get_source(fast)
+    result = fast(np.zeros(5, dtype=np.int64), 5)
+    np.testing.assert_array_equal(result, np.arange(5))
+
+
+def test_vectorize_skips():
+    source = dedent("""
+    def f(out, a, b, n):
+        for i in range(n):
+            out[i] = a[i + 1]
+        for i in range(n):
+            out[i] = a[i] if a[i] else 0
+        for j in range(n):
+            out[j] = a[j]
+        for x in a:
+            out[0] = x
+        return j
+    """)
+    code = ast.parse(source)
+    vectorize_loops(code)
+    assert ast.unparse(code) == ast.unparse(ast.parse(source))
+
+
+def test_vector_ok():
+    a = np.ones(3)
+    out = np.zeros(3)
+    ok = vector_ok(0, 3, (out,), (a,), (1.0,), (('range', range),))
+    assert ok
+    assert not vector_ok(0, 4, (out,), (a,), (), ())
+    assert not vector_ok(0, 3, (out,), (a,), (a,), ())
+    assert not vector_ok(0, 3, (out,), (out[::-1],), (), ())
+    assert not vector_ok(0, 3, (out,), (a,), (), (('range', len),))
+    assert vector_ok(0, 3, (out,), (a,), (), (('np.sqrt', np.sqrt),))
+    assert vector_ok(0, 3, (out,), (a,), (), (), (out,))
+    ints = np.zeros(3, dtype=int)
+    assert not vector_ok(0, 3, (ints,), (a,), (), (), (ints,))
@@ -1,7 +1,9 @@
 import ast
 from ast import AST
 from textwrap import dedent
-from .graph import graph_walk, NodeLocation
+from .common import node_fields
+from .graph import AstGraphWalker, graph_walk, NodeLocation
+from .scope import invalidate_symbol_tables
 
 _missing = object()
 
@@ -15,6 +17,51 @@ class NodeTransformer:
     def generic_visit(self, node, meta):
         return node
 
+class EagerTransformer(NodeTransformer):
+    """
+    transform only swaps in the new children of a node after the node has
+    been visited. EagerTransformer does it before, so that rewrites can
+    cascade up the tree. i.e. 1 + (2 * 3) folds in one pass.
+
+    visit_blocks is called with every node before it's visited and can
+    rewrite the statement lists of the node.
+
+    replaced is per transform, so use a new instance for every call.
+    """
+    def __init__(self):
+        # {old_node: new_node}
+        self.replaced = {}
+
+    def visit(self, node, meta):
+        self.substitute_children(node)
+        self.visit_blocks(node)
+        new_node = super().visit(node, meta)
+        if new_node is not node:
+            self.replaced[node] = new_node
+        return new_node
+
+    def visit_blocks(self, node):
+        pass
+
+    def substitute_children(self, node):
+        replaced = self.replaced
+        if not replaced:
+            return
+
+        for field_name in node_fields(type(node)):
+            value = getattr(node, field_name, None)
+            if isinstance(value, AST):
+                if value in replaced:
+                    setattr(node, field_name, replaced[value])
+            elif isinstance(value, list):
+                if any(item in replaced for item in value
+                       if isinstance(item, AST)):
+                    value[:] = [
+                        replaced.get(item, item)
+                        if isinstance(item, AST) else item
+                        for item in value
+                    ]
+
 class coroutine:
     """
     @coroutine.wrap
@@ -37,7 +84,7 @@ class coroutine:
     def __call__(self, node, meta):
         return self.coro.send((node, meta))
 
-def transform(root, visitor):
+def transform(root, visitor, parent_map=None):
     """
     Largely taken from the ast source. Works a bit differently because
     it depends on the graph_walk which returns items leaf first and then to
@@ -48,6 +95,18 @@ def transform(root, visitor):
 
     This would occur if you changed the ast.Assign.value when handling the
     ast.Assign node.
+
+    A Module root is never passed to the visitor, but what the visitor
+    returns for its statements is swapped into its body like any other
+    node's children. Returning None deletes the statement.
+
+    parent_map : ParentMap
+        kept in sync with the replaced and deleted nodes.
+
+    Thread safety: transform mutates root, so concurrent transforms have to
+    work on different trees. Its own state is local to the call. A visitor
+    that keeps state, like EagerTransformer, shouldn't be shared between
+    concurrent calls.
     """
     gen = graph_walk(root)
     done = {}
@@ -57,31 +116,189 @@ def transform(root, visitor):
 
     for item in gen:
         node = item['node']
+        if parent_map is not None:
+            old_children = parent_map.children(node)
+
         new_node = visitor(node, item)
+        _substitute_children(node, done)
 
-        for field_name, old_value in ast.iter_fields(node):
-            old_value = getattr(node, field_name, None)
+        if parent_map is not None:
+            parent_map.update_children(node, old_children)
+
+        done[node] = new_node
 
-            if isinstance(old_value, list):
-                new_values = []
-                for field_index, value in enumerate(old_value):
-                    done_node = done.get(value, _missing)
-                    if done_node is _missing: # fields were mutated in visitor
-                        new_values.append(value)
-                    elif done_node:
-                        new_values.append(done_node)
-                old_value[:] = new_values
+    # graph_walk doesn't yield a Module, so its statements are swapped here
+    if isinstance(root, ast.Module):
+        if parent_map is not None:
+            old_children = parent_map.children(root)
+        _substitute_children(root, done)
+        if parent_map is not None:
+            parent_map.update_children(root, old_children)
+    invalidate_symbol_tables()
+    return root
 
-            elif isinstance(old_value, ast.AST):
+def _substitute_children(node, done):
+    """ swap the children of node for what the visitor returned for them """
+    for field_name, old_value in ast.iter_fields(node):
+        old_value = getattr(node, field_name, None)
 
-                done_node = done.get(old_value, _missing)
+        if isinstance(old_value, list):
+            new_values = []
+            for field_index, value in enumerate(old_value):
+                done_node = done.get(value, _missing)
                 if done_node is _missing: # fields were mutated in visitor
+                    new_values.append(value)
+                elif done_node:
+                    new_values.append(done_node)
+            old_value[:] = new_values
+
+        elif isinstance(old_value, ast.AST):
+
+            done_node = done.get(old_value, _missing)
+            if done_node is _missing: # fields were mutated in visitor
+                continue
+
+            if done_node is None:
+                delattr(node, field_name)
+            else:
+                setattr(node, field_name, done_node)
+
+
+class FusedTransformer(EagerTransformer):
+    """
+    Runs visitors one after another on each node in a single walk. Every
+    visitor gets the node returned by the one before it. A visitor
+    returning None deletes the node and the rest are skipped.
+
+    Like EagerTransformer, the children of a node are swapped for their
+    rewritten versions before the node is visited.
+
+    New children that a visitor hangs under the node weren't part of the
+    walk, so they are walked right away with the visitors after it. This
+    gives the same result as running the visitors in separate walks.
+    """
+    def __init__(self, visitors):
+        super().__init__()
+        self.visitors = [
+            visitor.visit if isinstance(visitor, NodeTransformer) else visitor
+            for visitor in visitors
+        ]
+        # nodes that every visitor is done with
+        self.seen = set()
+
+    def visit(self, node, meta):
+        self.substitute_children(node)
+        new_node = self.run_visitors(node, meta, 0)
+        if new_node is not node and new_node:
+            self.replaced[node] = new_node
+        return new_node
+
+    def run_visitors(self, node, meta, start):
+        seen = self.seen
+        seen.add(node)
+        new_node = node
+        last = len(self.visitors) - 1
+        for index in range(start, last + 1):
+            new_node = self.visitors[index](new_node, meta)
+            if not new_node:
+                # transform takes care of deleting it
+                return new_node
+            if index < last:
+                self.walk_new_children(new_node, meta, index + 1)
+        seen.add(new_node)
+        return new_node
+
+    def walk_new_children(self, node, meta, start):
+        """ run the visitors from start on the unseen subtrees of node """
+        seen = self.seen
+        new_children = []
+        for field_name in node_fields(type(node)):
+            value = getattr(node, field_name, None)
+            if isinstance(value, AST):
+                if value not in seen:
+                    new_children.append((value, field_name, None))
+            elif isinstance(value, list):
+                for field_index, child in enumerate(value):
+                    if isinstance(child, AST) and child not in seen:
+                        new_children.append((child, field_name, field_index))
+        if not new_children:
+            return
+
+        done = {}
+        walker = AstGraphWalker(node)
+        walker.current_depth = meta['depth']
+        walker.line = meta['line']
+        for child, field_name, field_index in new_children:
+            items = walker.visit(child, node, field_name, field_index)
+            for item in items:
+                new_node = item['node']
+                if new_node in seen:
                     continue
+                _substitute_children(new_node, done)
+                done[new_node] = self.run_visitors(new_node, item, start)
+        _substitute_children(node, done)
 
-                if done_node is None:
-                    delattr(node, field_name)
-                else:
-                    setattr(node, field_name, done_node)
+class Pipeline:
+    """
+    Runs many transform passes with as few walks as possible.
 
-        done[node] = new_node
-    return root
+        pipeline = Pipeline(Renamer(), folder)
+        pipeline.barrier()
+        pipeline.add_pass(fold_constants)
+        pipeline(code)
+
+    Consecutive visitors are fused into one post-order walk with a
+    FusedTransformer. At each node they run in the order they were added,
+    on children that every visitor is already done with. Nodes a visitor
+    creates are walked by the visitors after it, as they would be in a
+    separate pass. Visitors that need an earlier pass to be done with the
+    whole tree, i.e. one that collects names, go after a barrier.
+
+    Passes added with add_pass take the whole tree, i.e. fold_constants,
+    and always act as a barrier.
+    """
+    def __init__(self, *visitors):
+        # list of ('visitors', [visitor]) and ('pass', func)
+        self.stages = []
+        for visitor in visitors:
+            self.add(visitor)
+
+    def add(self, visitor):
+        """ add a transform visitor. NodeTransformer, coroutine or function """
+        if not self.stages or self.stages[-1][0] != 'visitors':
+            self.stages.append(('visitors', []))
+        self.stages[-1][1].append(visitor)
+        return self
+
+    def add_pass(self, func):
+        """ add a function that takes and rewrites the whole tree """
+        self.stages.append(('pass', func))
+        return self
+
+    def barrier(self):
+        """ visitors added after this run in a new walk """
+        if self.stages and self.stages[-1] != ('visitors', []):
+            self.stages.append(('visitors', []))
+        return self
+
+    @property
+    def walks(self):
+        """ number of graph walks a run takes """
+        return sum(
+            1 for kind, stage in self.stages if kind == 'visitors' and stage
+        )
+
+    def __call__(self, root, parent_map=None):
+        """
+        parent_map : ParentMap
+            kept in sync by the visitor walks. Passes added with add_pass
+            have to keep it up to date themselves.
+        """
+        for kind, stage in self.stages:
+            if kind == 'pass':
+                result = stage(root)
+                if result is not None:
+                    root = result
+            elif stage:
+                transform(root, FusedTransformer(stage), parent_map=parent_map)
+        return root
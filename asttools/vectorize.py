@@ -0,0 +1,487 @@
+"""
+Vectorize elementwise loops over 1-D arrays.
+
+    for i in range(len(a)):
+        out[i] = a[i] * b[i] + math.sqrt(c)
+
+is rewritten to compute out[0:len(a)] = a[0:len(a)] * b[0:len(a)] + ...
+with numpy whenever a runtime guard passes, and to run the original loop
+otherwise.
+
+A loop is vectorized when it iterates over range(stop) or
+range(start, stop), its body only assigns to array[i], and the right hand
+sides only use arithmetic, constants, loop invariant scalars, array[i],
+the loop variable and math/numpy functions with a numpy ufunc equivalent.
+
+The guard checks that the arrays are non-object 1-D ndarrays long enough
+for the range, that targets don't overlap the other arrays and that the
+scalars are scalars. The loop variable is a python int that never
+overflows, so arithmetic on it is done on a float64 arange, and only for
+targets that would have stored a float anyway. The vectorized expressions are computed with
+np.errstate(all='raise') before anything is assigned. If the guard fails
+or anything raises, the original loop runs.
+"""
+import ast
+import copy
+import math
+import operator
+
+import numpy as np
+
+from .common import node_fields
+from .optimize import _scope_nodes, _unique_name
+from .scope import SymbolTable, invalidate_symbol_tables
+
+# func: (python function, numpy ufunc)
+_ufuncs = {
+    'abs': (abs, np.abs),
+    'math.sqrt': (math.sqrt, np.sqrt),
+    'math.exp': (math.exp, np.exp),
+    'math.log': (math.log, np.log),
+    'math.log10': (math.log10, np.log10),
+    'math.sin': (math.sin, np.sin),
+    'math.cos': (math.cos, np.cos),
+    'math.tan': (math.tan, np.tan),
+    'math.tanh': (math.tanh, np.tanh),
+    'math.fabs': (math.fabs, np.fabs),
+}
+
+# functions the guard has to see as is
+_python_funcs = {name: funcs[0] for name, funcs in _ufuncs.items()}
+_python_funcs['range'] = range
+
+_binops = (
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+)
+
+_unaryops = (ast.USub, ast.UAdd)
+
+_constant_types = (int, float, complex, bool)
+
+
+class NotVectorizable(Exception):
+    pass
+
+
+# largest range a float64 arange holds exactly
+MAX_FLOAT_INDEX = 2 ** 53
+
+
+def vector_ok(start, stop, targets, arrays, scalars, funcs,
+              float_targets=()):
+    """
+    Runtime guard for a vectorized loop.
+
+    funcs : ((name, obj), ...)
+        range and the functions called in the loop body. Must be the
+        function expected for name or a numpy ufunc.
+    float_targets : targets computed from a float64 arange of the loop
+        variable. Must be float or complex.
+    """
+    try:
+        start = operator.index(start)
+        stop = operator.index(stop)
+    except TypeError:
+        return False
+    if start < 0 or stop < 0:
+        return False
+
+    for arr in targets + arrays:
+        if type(arr) is not np.ndarray or arr.ndim != 1:
+            return False
+        if arr.dtype.kind == 'O' or len(arr) < stop:
+            return False
+
+    for arr in float_targets:
+        if stop > MAX_FLOAT_INDEX or arr.dtype.kind not in 'fc':
+            return False
+
+    for target in targets:
+        if not target.flags.writeable:
+            return False
+        for arr in targets + arrays:
+            if arr is not target and np.may_share_memory(target, arr):
+                return False
+
+    for scalar in scalars:
+        if isinstance(scalar, np.ndarray) or not np.isscalar(scalar):
+            return False
+
+    for name, obj in funcs:
+        expected = _python_funcs.get(name)
+        if expected is None:
+            if not isinstance(obj, np.ufunc):
+                return False
+        elif obj is not expected:
+            return False
+    return True
+
+
+def _dotted(node):
+    """ 'math.sqrt' for a chain of names. None otherwise """
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return '.'.join(reversed(parts))
+
+
+class LoopVectorizer:
+    """
+    Translate the body of an elementwise for loop into numpy expressions.
+    Raises NotVectorizable for anything it can't prove is elementwise.
+    """
+    def __init__(self, loop, taken):
+        self.loop = loop
+        self.taken = taken
+
+        target = loop.target
+        if not isinstance(target, ast.Name) or loop.orelse:
+            raise NotVectorizable("Not a simple for loop")
+        self.var = target.id
+
+        self.start, self.stop = self.range_args(loop.iter)
+        self.start_name = _unique_name('_asttools_start', taken)
+        self.stop_name = _unique_name('_asttools_stop', taken)
+
+        self.arrays = []
+        self.targets = []
+        self.scalars = []
+        self.funcs = [('range', loop.iter.func)]
+        # {target: temp name} of the latest value written to a target
+        self.written = {}
+        self.temps = []
+        # temps that are read back and need the dtype of their target
+        self.casts = set()
+        # targets computed with arithmetic on the loop variable
+        self.float_targets = []
+        self.float_index = False
+
+        for stmt in loop.body:
+            self.visit_stmt(stmt)
+
+        overlap = set(self.scalars) & set(self.arrays + self.targets)
+        if overlap or self.var in self.scalars:
+            raise NotVectorizable("Names used as arrays and scalars")
+
+    def range_args(self, node):
+        if not (isinstance(node, ast.Call)
+                and isinstance(node.func, ast.Name)
+                and node.func.id == 'range'
+                and not node.keywords
+                and 1 <= len(node.args) <= 2):
+            raise NotVectorizable("Can only vectorize range loops")
+        if any(isinstance(arg, ast.Starred) for arg in node.args):
+            raise NotVectorizable("Can only vectorize range loops")
+
+        if len(node.args) == 1:
+            return ast.Constant(value=0), node.args[0]
+        return node.args[0], node.args[1]
+
+    def slice(self):
+        return ast.Slice(
+            lower=ast.Name(id=self.start_name, ctx=ast.Load()),
+            upper=ast.Name(id=self.stop_name, ctx=ast.Load()),
+        )
+
+    def is_element(self, node):
+        return (
+            isinstance(node, ast.Subscript)
+            and isinstance(node.value, ast.Name)
+            and isinstance(node.slice, ast.Name)
+            and node.slice.id == self.var
+        )
+
+    def visit_stmt(self, stmt):
+        if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1:
+            target = stmt.targets[0]
+            value = stmt.value
+        elif isinstance(stmt, ast.AugAssign):
+            target = stmt.target
+            value = None
+        else:
+            raise NotVectorizable("Only array[i] assignments")
+
+        if not self.is_element(target):
+            raise NotVectorizable("Only array[i] assignments")
+
+        if value is None:
+            # a[i] += x => a[i] = a[i] + x
+            load = copy.deepcopy(target)
+            load.ctx = ast.Load()
+            value = ast.BinOp(left=load, op=stmt.op, right=stmt.value)
+
+        name = target.value.id
+        # out[i] = i can stay int64. Anything else on i could overflow
+        # where the python int wouldn't.
+        self.float_index = not (
+            isinstance(value, ast.Name) and value.id == self.var
+        ) and any(
+            isinstance(node, ast.Name) and node.id == self.var
+            for node in ast.walk(value)
+        )
+        if self.float_index and name not in self.float_targets:
+            self.float_targets.append(name)
+
+        expr = self.visit_expr(value)
+        if name not in self.targets:
+            self.targets.append(name)
+
+        temp = _unique_name('_asttools_t', self.taken)
+        self.temps.append((temp, name, expr))
+        self.written[name] = temp
+
+    def visit_expr(self, node):
+        if isinstance(node, ast.Constant):
+            if not isinstance(node.value, _constant_types):
+                raise NotVectorizable("Unsupported constant")
+            return ast.Constant(value=node.value)
+
+        if isinstance(node, ast.Name):
+            if node.id == self.var:
+                # np.arange(start, stop[, dtype=np.float64])
+                keywords = []
+                if self.float_index:
+                    keywords.append(ast.keyword(
+                        arg='dtype',
+                        value=ast.Attribute(
+                            value=ast.Name(id='_asttools_np', ctx=ast.Load()),
+                            attr='float64',
+                            ctx=ast.Load(),
+                        ),
+                    ))
+                return ast.Call(
+                    func=ast.Attribute(
+                        value=ast.Name(id='_asttools_np', ctx=ast.Load()),
+                        attr='arange',
+                        ctx=ast.Load(),
+                    ),
+                    args=[
+                        ast.Name(id=self.start_name, ctx=ast.Load()),
+                        ast.Name(id=self.stop_name, ctx=ast.Load()),
+                    ],
+                    keywords=keywords,
+                )
+            if node.id not in self.scalars:
+                self.scalars.append(node.id)
+            return ast.Name(id=node.id, ctx=ast.Load())
+
+        if self.is_element(node):
+            name = node.value.id
+            if name in self.written:
+                # reads after a write see the new values
+                temp = self.written[name]
+                self.casts.add(temp)
+                return ast.Name(id=temp, ctx=ast.Load())
+            if name not in self.arrays:
+                self.arrays.append(name)
+            return ast.Subscript(
+                value=ast.Name(id=name, ctx=ast.Load()),
+                slice=self.slice(),
+                ctx=ast.Load(),
+            )
+
+        if isinstance(node, ast.BinOp) and isinstance(node.op, _binops):
+            return ast.BinOp(
+                left=self.visit_expr(node.left),
+                op=node.op,
+                right=self.visit_expr(node.right),
+            )
+
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, _unaryops):
+            return ast.UnaryOp(op=node.op, operand=self.visit_expr(node.operand))
+
+        if isinstance(node, ast.Call):
+            return self.visit_call(node)
+
+        raise NotVectorizable(
+            "Unsupported {0}".format(node.__class__.__name__))
+
+    def visit_call(self, node):
+        name = _dotted(node.func)
+        if name is None or node.keywords or len(node.args) != 1:
+            raise NotVectorizable("Unsupported call")
+        if isinstance(node.args[0], ast.Starred):
+            raise NotVectorizable("Unsupported call")
+
+        self.funcs.append((name, node.func))
+        arg = self.visit_expr(node.args[0])
+
+        if name in _ufuncs:
+            ufunc = _ufuncs[name][1].__name__
+            func = ast.Attribute(
+                value=ast.Name(id='_asttools_np', ctx=ast.Load()),
+                attr=ufunc,
+                ctx=ast.Load(),
+            )
+        else:
+            # checked to be a ufunc by the guard
+            func = node.func
+        return ast.Call(func=func, args=[arg], keywords=[])
+
+    def rewrite(self):
+        """ statements that replace the loop """
+        flag = _unique_name('_asttools_vectorized', self.taken)
+
+        def names(items):
+            if not items:
+                return '()'
+            return '({0},)'.format(', '.join(items))
+
+        funcs = ', '.join(
+            "({0!r}, {1})".format(name, ast.unparse(func))
+            for name, func in self.funcs
+        )
+        funcs = '({0},)'.format(funcs) if funcs else '()'
+
+        compute = []
+        for temp, name, expr in self.temps:
+            compute.append("            {0} = {1}".format(
+                temp, ast.unparse(expr)))
+            if temp in self.casts:
+                # as if it had been stored in the target array
+                compute.append(
+                    "            {0} = _asttools_np.asarray({0}, "
+                    "dtype={1}.dtype)".format(temp, name)
+                )
+
+        assigns = []
+        for name in self.targets:
+            assigns.append("        {name}[{start}:{stop}] = {temp}".format(
+                name=name,
+                start=self.start_name,
+                stop=self.stop_name,
+                temp=self.written[name],
+            ))
+
+        source = TEMPLATE.format(
+            start=self.start_name,
+            stop=self.stop_name,
+            start_src=ast.unparse(self.start),
+            stop_src=ast.unparse(self.stop),
+            flag=flag,
+            targets=names(self.targets),
+            arrays=names(self.arrays),
+            scalars=names(self.scalars),
+            funcs=funcs,
+            float_targets=names(self.float_targets),
+            compute='\n'.join(compute),
+            assigns='\n'.join(assigns),
+        )
+        stmts = ast.parse(source).body
+
+        # the original loop, over the already evaluated range
+        fallback = stmts[-1]
+        loop = self.loop
+        loop.iter = ast.Call(
+            func=ast.Name(id='range', ctx=ast.Load()),
+            args=[
+                ast.Name(id=self.start_name, ctx=ast.Load()),
+                ast.Name(id=self.stop_name, ctx=ast.Load()),
+            ],
+            keywords=[],
+        )
+        fallback.body = [loop]
+
+        for stmt in stmts:
+            ast.copy_location(stmt, loop)
+            ast.fix_missing_locations(stmt)
+        return stmts
+
+
+TEMPLATE = """
+from asttools.vectorize import np as _asttools_np
+from asttools.vectorize import vector_ok as _asttools_vector_ok
+{start} = {start_src}
+{stop} = {stop_src}
+try:
+    {flag} = _asttools_vector_ok(
+        {start}, {stop}, {targets}, {arrays}, {scalars}, {funcs},
+        {float_targets})
+except NameError:
+    {flag} = False
+if {flag}:
+    try:
+        with _asttools_np.errstate(all='raise'):
+{compute}
+    except Exception:
+        {flag} = False
+    else:
+{assigns}
+if not {flag}:
+    pass
+"""
+
+
+def _own_loops(node):
+    """
+    (parent, field_name, field_index, loop) for the for loops in the scope
+    of node, including nested loops. Nested scopes are not entered.
+    """
+    for field_name in node_fields(type(node)):
+        value = getattr(node, field_name, None)
+        if not isinstance(value, list):
+            value = [value]
+        for i, child in enumerate(value):
+            if not isinstance(child, ast.AST):
+                continue
+            if isinstance(child, ast.For):
+                yield node, field_name, i, child
+            if not isinstance(child, _scope_nodes):
+                yield from _own_loops(child)
+
+
+def vectorize_loops(code):
+    """
+    Rewrite elementwise loops over 1-D arrays into guarded numpy
+    expressions in place. Can be passed straight to func_rewrite.
+    """
+    table = SymbolTable(code)
+    taken = set()
+    for node in ast.walk(code):
+        if isinstance(node, ast.Name):
+            taken.add(node.id)
+        elif isinstance(node, ast.arg):
+            taken.add(node.arg)
+
+    for func_def, scope in list(table.scopes.items()):
+        if scope.kind != 'function':
+            continue
+
+        loops = list(_own_loops(func_def))
+        # replace later loops first so the indexes of the earlier ones in
+        # the same statement list stay valid
+        for parent, field_name, field_index, loop in reversed(loops):
+            if not _loop_var_is_private(func_def, loop):
+                continue
+            try:
+                vectorizer = LoopVectorizer(loop, taken)
+            except NotVectorizable:
+                continue
+            stmts = getattr(parent, field_name)
+            stmts[field_index:field_index+1] = vectorizer.rewrite()
+    invalidate_symbol_tables()
+    return code
+
+
+def _loop_var_is_private(func_def, loop):
+    """
+    The vectorized loop never binds its loop variable, so it can't be used
+    outside of the loop.
+    """
+    target = loop.target
+    if not isinstance(target, ast.Name):
+        return False
+    name = target.id
+    inside = sum(
+        1 for node in ast.walk(loop)
+        if isinstance(node, ast.Name) and node.id == name
+    )
+    total = sum(
+        1 for node in ast.walk(func_def)
+        if isinstance(node, ast.Name) and node.id == name
+    )
+    return inside == total